@@ -1,3 +1,4 @@
+import json
 import subprocess
 from pathlib import Path
 from os.path import join, dirname, abspath
@@ -8,30 +9,52 @@ import sys
 
 GIGAHORSE_TOOLCHAIN_ROOT = dirname(abspath(__file__))
 
+PERF_BASELINES_FILE = join(GIGAHORSE_TOOLCHAIN_ROOT, "tests", "perf_baselines.json")
+
+def pytest_addoption(parser):
+    parser.addoption("--update-perf-baselines", action="store_true",
+                     help="Record the measurements of the perf tests as their baselines in tests/perf_baselines.json, instead of checking them.")
+
+@pytest.hookimpl(trylast=True)
+def pytest_collection_modifyitems(config, items):
+    """Batches the logic tests left once -k and -m deselected the others, so a batch only analyzes the contracts of tests that run."""
+    from test_gigahorse import LogicTestCase, assign_batches, batches
+
+    selected: dict[str, LogicTestCase] = {}
+    for item in items:
+        callspec = getattr(item, "callspec", None)
+        test = callspec.params.get("gigahorse_test") if callspec is not None else None
+        if isinstance(test, LogicTestCase):
+            selected.setdefault(test.name, test)
+    batches[:] = assign_batches(list(selected.values()))
+
 def pytest_sessionstart(session):
     print("\n[gigahorse] Running analysis binary compilation before tests begin...\n", file=sys.stderr)
 
+@pytest.fixture(scope="session")
+def gigahorse_batch_dir(tmp_path_factory, worker_id) -> Path:
+    """Where the test batches record that they ran, shared across all workers."""
+    if worker_id == "master":
+        return tmp_path_factory.mktemp("batches")
+    batch_dir = tmp_path_factory.getbasetemp().parent / "batches"
+    batch_dir.mkdir(exist_ok=True)
+    return batch_dir
+
 @pytest.fixture(scope="session", autouse=True)
 def gigahorse_prereqs(tmp_path_factory, worker_id):
-    """Compiles core .dl files exactly once, shared across all workers."""
+    """Compiles the programs of every test configuration exactly once, shared across all workers."""
 
     def _run_prereq(working_dir: Path):
-        common_clients = ["-C", join(GIGAHORSE_TOOLCHAIN_ROOT, "clients/analytics_client.dl")]
-        result = subprocess.run(
-            [
-                "python3",
-                join(GIGAHORSE_TOOLCHAIN_ROOT, "gigahorse.py"),
-                join(GIGAHORSE_TOOLCHAIN_ROOT, "examples/long_running.hex"),
-                "--restart",
-                "--jobs", "1",
-                "--working_dir", str(working_dir),
-                "--disable_scalable_fallback",
-                *common_clients,
-            ],
-            capture_output=True,
-        )
-        if result.returncode != 0:
-            pytest.exit(f"Analysis binary compilation failed:\n{result.stderr.decode()}", returncode=1)
+        from test_gigahorse import compilation_batches
+
+        # gigahorse.py compiles its programs even without contracts to analyze
+        no_contracts = working_dir / "no_contracts"
+        no_contracts.mkdir(parents=True, exist_ok=True)
+        for i, batch in enumerate(compilation_batches()):
+            batch_dir = working_dir / str(i)
+            result = subprocess.run(batch.command([str(no_contracts)], str(batch_dir), str(batch_dir / "results.json"), 1), capture_output=True)
+            if result.returncode != 0:
+                pytest.exit(f"Analysis binary compilation failed:\n{result.stderr.decode()}", returncode=1)
 
     if worker_id == "master":
         _run_prereq(tmp_path_factory.mktemp("pretest"))
@@ -45,4 +68,34 @@ def gigahorse_prereqs(tmp_path_factory, worker_id):
                 _run_prereq(root_tmp_dir / "pretest_shared")
                 done_path.write_text("done")
 
-    yield
\ No newline at end of file
+    yield
+
+
+def _load_perf_baselines() -> dict:
+    try:
+        with open(PERF_BASELINES_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+@pytest.fixture(scope="session")
+def update_perf_baselines(request) -> bool:
+    return request.config.getoption("--update-perf-baselines")
+
+@pytest.fixture(scope="session")
+def perf_baselines(tmp_path_factory, update_perf_baselines):
+    """The baselines of the perf tests, by test and contract. When updating them, the new ones are merged into the file at the end of the session."""
+    if not update_perf_baselines:
+        yield _load_perf_baselines()
+        return
+
+    updated: dict = {}
+    yield updated
+
+    if updated:
+        # xdist workers each merge the tests they ran
+        with FileLock(str(tmp_path_factory.getbasetemp().parent / "perf_baselines.lock")):
+            baselines = _load_perf_baselines() | updated
+            with open(PERF_BASELINES_FILE, "w") as f:
+                json.dump(dict(sorted(baselines.items())), f, indent=1)
+                f.write("\n")
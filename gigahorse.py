@@ -8,16 +8,27 @@ import logging
 import shutil
 import sys
 import time
-from collections import defaultdict
+from itertools import islice
 from multiprocessing import Process, SimpleQueue, Manager, Event, cpu_count
-from typing import Any
-from os.path import join, getsize
+from typing import Any, Callable, Iterable, Iterator
+from os.path import join
+from fnmatch import fnmatchcase
 import os
 
 # Local project imports
 from src.common import GIGAHORSE_DIR, DEFAULT_SOUFFLE_BIN, log
-from src.runners import MAIN_DECOMPILER_MAX_CONTEXT_DEPTH
-from src.runners import test_souffle, get_souffle_executable_path, compile_datalog, AbstractFactGenerator, DecompilerFactGenerator, CustomFactGenerator, MixedFactGenerator, AnalysisExecutor, TimeoutException, DecompilationException, FactGenSelectionEnum, FactGenUsedEnum
+from src.runners import MAIN_DECOMPILER_MAX_CONTEXT_DEPTH, CLIENT_MANIFEST_FILE
+from src.runners import RELATION_SIZES_SUFFIX, read_relation_sizes, decompiler_programs_run, test_souffle, get_souffle_executable_path, compile_datalog, AbstractFactGenerator, DecompilerFactGenerator, CustomFactGenerator, MixedFactGenerator, AnalysisExecutor, TimeoutException, DecompilationException, FactGenSelectionEnum, FactGenUsedEnum
+from src.signatures import build_signature_indexes
+from src.inputs import ContractSpool, discover_contracts, contract_shard
+from src.ledger import CompletionLedger
+from src.results import log_summary, write_results_file, RESULTS_FORMATS
+from src.profiling import PROFILE_SUFFIX, collect_profiles
+from src.blowup import DEFAULT_RSS_THRESHOLD, DEFAULT_GRACE_PERIOD
+from src.context_depth import ContextDepthHistory
+from src.tac_schema import StitchMap
+from src.work_queue import WorkQueue, POLL_INTERVAL
+from src.scheduling import MemoryAdmissionController, Lookahead, DEFAULT_MEMORY_RESERVE, DEFAULT_MEMORY_PER_BYTECODE_BYTE, ADMISSION_RETRY_INTERVAL, load_memory_history, souffle_threads_for_job
 
 ## Constants
 
@@ -42,6 +53,19 @@ DEFAULT_TIMEOUT = 120
 DEFAULT_MINIMUM_CLIENT_TIME = 10
 """Default minimum time to allow each client to work."""
 
+DEFAULT_ANALYTICS_PATTERNS = ['Analytics_*', 'Metric_*', 'Verbatim_*', 'Size_*']
+"""Relations of a contract's outputs collected in its analytics by default."""
+
+BOOKKEEPING_SUFFIXES = (RELATION_SIZES_SUFFIX, PROFILE_SUFFIX)
+"""Files the pipeline writes next to a contract's output relations, which aren't reported as outputs."""
+
+BOOKKEEPING_FILES = {StitchMap.FILENAME}
+
+LINE_COUNT_CHUNK_SIZE = 1 << 20
+
+AUTO_SOUFFLE_THREADS = 0
+"""Value of --souffle_threads requesting the automatic split of cores between jobs and souffle threads."""
+
 DEFAULT_NUM_JOBS = max(int(cpu_count() * 0.9), 1)
 """Bugfix for one core systems."""
 
@@ -56,8 +80,9 @@ parser = argparse.ArgumentParser(
 parser.add_argument(
     "filepath",
     metavar = "DIR",
-    nargs="+",
+    nargs="*",
     help="The location to grab contracts from (as bytecode files). Accepts both filenames and directories. All contract filenames should be unique."
+    " Corpora of many contracts (.jsonl, .csv, optionally gzipped, or tar archives of .hex files) are streamed instead of read up front."
 )
 
 parser.add_argument("-S",
@@ -84,6 +109,13 @@ parser.add_argument("-r",
                     metavar="FILE",
                     help=f"The location to write the results (default: {DEFAULT_RESULTS_FILE}).")
 
+parser.add_argument("--results_format",
+                    choices=RESULTS_FORMATS,
+                    default="json",
+                    help="The format of the results file (default: json). The columnar format is a gzipped stream of chunks, with the analytics"
+                    " of each chunk stored per key and every string stored once. It can be read with src.results.iter_results,"
+                    " which tooling/compare-runs.py and tooling/merge-results.py use.")
+
 parser.add_argument("-w",
                     "--working_dir",
                     default=TEMP_WORKING_DIR,
@@ -103,6 +135,83 @@ parser.add_argument("-j",
                     metavar="NUM",
                     help=f"The number of subprocesses to run at once (default: {DEFAULT_NUM_JOBS}).")
 
+def souffle_threads_arg(value: str) -> int:
+    if value == "auto":
+        return AUTO_SOUFFLE_THREADS
+    threads = int(value)
+    if threads < 1:
+        raise argparse.ArgumentTypeError("the number of souffle threads must be positive or 'auto'")
+    return threads
+
+parser.add_argument("--souffle_threads",
+                    type=souffle_threads_arg,
+                    default=1,
+                    metavar="NUM",
+                    help="The number of threads each souffle program runs with (default: 1). With 'auto', the cores are split"
+                    " between jobs and threads depending on how many contracts are left, giving the tail of a batch more threads.")
+
+def shard_arg(value: str) -> tuple[int, int]:
+    try:
+        shard, num_shards = (int(v) for v in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("the shard must be given as i/N")
+    if not 0 <= shard < num_shards:
+        raise argparse.ArgumentTypeError("the shard i/N must satisfy 0 <= i < N")
+    return shard, num_shards
+
+parser.add_argument("--shard",
+                    type=shard_arg,
+                    default=None,
+                    metavar="i/N",
+                    help="Only analyze the contracts of shard i (counting from 0) out of N, partitioned deterministically by the hash of"
+                    " their file names, so the same inputs can be split between hosts. Use tooling/merge-results.py to combine the results files.")
+
+parser.add_argument("--queue",
+                    default=None,
+                    metavar="FILE",
+                    help="Add the contracts to a work queue (an SQLite database, created if missing) and analyze contracts claimed from it,"
+                    " so that any number of gigahorse.py instances on the same host can share the work. Instances can join with no contracts of their own."
+                    " Contracts claimed by killed instances are claimed again once their lease expires. Streamed contracts are written to the working directory when added.")
+
+parser.add_argument("--analytics",
+                    default=','.join(DEFAULT_ANALYTICS_PATTERNS),
+                    metavar="PATTERNS",
+                    help="Comma-separated glob patterns of the Analytics_*, Metric_* (row counts) and Verbatim_* (contents) output relations,"
+                    " and of the Size_* relation sizes printed by the decompiler (see logic/telemetry.dl),"
+                    f" collected in the analytics of each contract, others are skipped (default: {','.join(DEFAULT_ANALYTICS_PATTERNS)}).")
+
+parser.add_argument("--client_jobs",
+                    type=int,
+                    default=1,
+                    metavar="NUM",
+                    help="The number of clients of a contract that can run at once, if they do not read or write each other's files"
+                    " (default: 1). Each of the --jobs contracts can then have up to NUM souffle processes running.")
+
+parser.add_argument("--memory_reserve",
+                    type=float,
+                    default=DEFAULT_MEMORY_RESERVE / 1_000_000_000,
+                    metavar="GB",
+                    help=f"Memory to keep free when admitting new jobs with --memory_admission (default: {DEFAULT_MEMORY_RESERVE // 1_000_000_000} GB).")
+
+parser.add_argument("--memory_history",
+                    default=None,
+                    metavar="FILE",
+                    help="A results file of a previous run, its peak memory per contract is used to estimate the memory needed by each job"
+                    " (and its peak memory per byte of bytecode, that of contracts it doesn't have).")
+
+parser.add_argument("--memory_per_bytecode_byte",
+                    type=int,
+                    default=DEFAULT_MEMORY_PER_BYTECODE_BYTE,
+                    metavar="BYTES",
+                    help="The peak memory per byte of bytecode assumed by --memory_admission until enough jobs have been observed,"
+                    f" in this run or the --memory_history (default: {DEFAULT_MEMORY_PER_BYTECODE_BYTE}).")
+
+parser.add_argument("--memory_admission",
+                    action="store_true",
+                    default=False,
+                    help="Hold back new jobs while the memory available in the system doesn't cover their estimated footprint"
+                    " (by default, jobs are launched regardless of the memory available).")
+
 parser.add_argument("-k",
                     "--skip",
                     type=int,
@@ -138,6 +247,13 @@ parser.add_argument("--enable_limitsize",
                         )
                     )
 
+parser.add_argument("--adaptive_limitsize",
+                    action="store_true",
+                    default=False,
+                    help="Like --enable_limitsize, but the limitsize caps of the main decompiler depend on the number of basic blocks of each contract:"
+                    " a tier of caps is selected per contract, each tier compiled to its own executable. The selected tier is recorded"
+                    " in the limitsize_tier analytic, and the caps that were reached in Analytics_VarMayBeLimitSizeReached.")
+
 parser.add_argument("--disable_inline",
                     action="store_true",
                     default=False,
@@ -150,6 +266,13 @@ parser.add_argument("--skip_sig_resolution",
                     help="Doesn't attempt to resolve external function, event, and error signatures, reducing execution time."
                     "To be used when benchmarking.")
 
+parser.add_argument("--filter_signatures",
+                    action="store_true",
+                    default=False,
+                    help="Instead of linking the full function, event and error signature files in every working directory,"
+                    " only write the signatures matching constants pushed by each contract, looked up in indexes kept in the cache directory."
+                    " Signatures of constants computed in ways other than shifts of pushed values will not be resolved.")
+
 parser.add_argument("-q",
                     "--quiet",
                     action="store_true",
@@ -165,13 +288,20 @@ parser.add_argument("-v",
 parser.add_argument("--rerun_clients",
                     action="store_true",
                     default=False,
-                    help="Rerun client analyses. Only attempts to decompile if it hasn't tried in the current working dir.")
+                    help="Rerun client analyses. Only attempts to decompile if it hasn't tried in the current working dir."
+                    " Compiled souffle clients whose binary and input files are unchanged since their last successful run with --rerun_clients are skipped.")
 
 parser.add_argument("--restart",
                     action="store_true",
                     default=False,
                     help="Erase working dir and decompile/analyze from scratch.")
 
+parser.add_argument("--adopt_working_dir",
+                    action="store_true",
+                    default=False,
+                    help="When reusing a working dir predating the completion ledger, treat its contract directories as finished (without results)"
+                    " instead of analyzing them again.")
+
 parser.add_argument("--debug",
                     action="store_true",
                     default=False,
@@ -188,6 +318,13 @@ parser.add_argument("-i",
                     default=False,
                     help="Run souffle in interpreted mode.")
 
+parser.add_argument("--profile",
+                    action="store_true",
+                    default=False,
+                    help="Run the souffle programs with profiling enabled (compiled to separate executables), "
+                    "writing the profile log of each program next to its .err file, and report the relations and rules "
+                    "taking the most time over all contracts at the end of the run. Profiling slows the analysis down.")
+
 parser.add_argument(
     "--tac_gen_config",
     nargs="?",
@@ -228,7 +365,7 @@ def get_souffle_macros() -> str:
 
     return souffle_macros
 
-def analyze_contract(index: int, contract_filename: str, result_queue, fact_generator: AbstractFactGenerator, souffle_clients: list[str], other_clients: list[str]) -> None:
+def analyze_contract(index: int, contract_filename: str, result_queue, fact_generator: AbstractFactGenerator, souffle_clients: list[str], other_clients: list[str], souffle_threads: int = 1) -> None:
     """
     Perform static analysis on a contract, storing the result in the queue.
     This is a worker function to be passed to a subprocess.
@@ -240,8 +377,11 @@ def analyze_contract(index: int, contract_filename: str, result_queue, fact_gene
         fact_generator: the fact generator to be used (decompiler is used by default)
         souffle_clients: list of souffle datalog clients
         other_clients: list of other clients (language agnostic)
+        souffle_threads: the number of threads souffle programs run with
     """
     analysis_executor = fact_generator.analysis_executor
+    analysis_executor.reset_statistics()
+    analysis_executor.souffle_threads = souffle_threads
     try:
         # prepare working directory
         exists, work_dir, out_dir = prepare_working_dir(contract_filename)
@@ -261,6 +401,7 @@ def analyze_contract(index: int, contract_filename: str, result_queue, fact_gene
             disassemble_time, decomp_time, decompiler_config = fact_generator.generate_facts(contract_filename, work_dir, out_dir)
 
             inline_start = time.time()
+            analysis_executor.stage = "inline"
             if not args.disable_inline and decompiler_config != FactGenUsedEnum.MultiContract:
                 # ignore timeouts here: if it happens, just continue to the clients
                 _, inl_errors = analysis_executor.run_clients([DEFAULT_INLINER_DL]*DEFAULT_INLINER_ROUNDS, [], out_dir, out_dir, start_time)
@@ -278,14 +419,14 @@ def analyze_contract(index: int, contract_filename: str, result_queue, fact_gene
             raise TimeoutException()
 
         client_start = time.time()
-        timeouts, errors = analysis_executor.run_clients(souffle_clients, other_clients, out_dir, out_dir, client_start)
+        analysis_executor.stage = "client"
+        timeouts, errors = analysis_executor.run_clients(souffle_clients, other_clients, out_dir, out_dir, client_start, manifest_file=join(work_dir, CLIENT_MANIFEST_FILE))
 
         # Collect the results and put them in the result queue
-        files = []
-        for fname in os.listdir(out_dir):
-            fpath = join(out_dir, fname)
-            if getsize(fpath) != 0:
-                files.append(fname.split(".")[0])
+        with os.scandir(out_dir) as entries:
+            out_entries = list(entries)
+        files = [entry.name.split(".")[0] for entry in out_entries
+                 if entry.stat().st_size != 0 and not entry.name.endswith(BOOKKEEPING_SUFFIXES) and entry.name not in BOOKKEEPING_FILES]
         meta = []
         # Decompile + Analysis time
         analytics['disassemble_time'] = disassemble_time
@@ -296,6 +437,12 @@ def analyze_contract(index: int, contract_filename: str, result_queue, fact_gene
         analytics['client_timeouts'] = len(timeouts)
         analytics['bytecode_size'] = (len(bytecode) - 2)//2
         analytics['decompiler_config'] = decompiler_config
+        analytics['souffle_threads'] = souffle_threads
+        analytics['reused_clients'] = len(analysis_executor.reused_clients)
+        analytics['fallback_reasons'] = analysis_executor.fallback_reasons
+        analytics['limitsize_tier'] = analysis_executor.limitsize_tier
+        analytics |= analysis_executor.decompiler_analytics
+        analytics['resource_usage'] = analysis_executor.resource_analytics()
         contract_msg = "{}: {:.46} completed in {:.2f} + {:.2f} + {:.2f} + {:.2f} secs.".format(
             index, contract_name, analytics['disassemble_time'],
             analytics['decomp_time'], analytics['inline_time'], analytics['client_time']
@@ -309,34 +456,75 @@ def analyze_contract(index: int, contract_filename: str, result_queue, fact_gene
 
         log(contract_msg)
 
-        get_gigahorse_analytics(out_dir, analytics)
+        get_gigahorse_analytics(out_dir, analytics, out_entries, args.analytics.split(','), decompiler_programs_run(decompiler_config))
 
         result_queue.put((contract_name, files, meta, analytics))
     except TimeoutException as e:
-        result_queue.put((contract_name, [], ["TIMEOUT"], {}))
+        result_queue.put((contract_name, [], ["TIMEOUT"] + killed_meta(analysis_executor, contract_name), {}))
         log("{} timed out.".format(contract_name))
     except DecompilationException as e:
         log(f"Error during execution of decompilation binary: {e}")
-        result_queue.put((contract_name, [], ["ERROR"], {}))
+        result_queue.put((contract_name, [], ["ERROR"] + killed_meta(analysis_executor, contract_name), {}))
     except Exception as e:
         log(f"Other Error: {e}")
         result_queue.put((contract_name, [], ["ERROR"], {}))
 
 
-def get_gigahorse_analytics(out_dir: str, analytics: dict) -> None:
-    for fname in os.listdir(out_dir):
-        fpath = join(out_dir, fname)
-        if not (fname.startswith('Analytics_') or fname.startswith('Metric_')):
+def killed_meta(analysis_executor: AnalysisExecutor, contract_name: str) -> list[str]:
+    """Distinguishes failures caused by processes getting killed (most likely for running out of memory)"""
+    killed = analysis_executor.killed_clients()
+    if not killed:
+        return []
+    log(f"{contract_name}: {', '.join(killed)} killed by SIGKILL, possibly out of memory.")
+    return ["KILLED"]
+
+
+def count_lines(path: str, size: int) -> int:
+    """Number of lines of a file (counting a last line without a newline), reading it in large chunks"""
+    if size == 0:
+        return 0
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        while chunk := f.read(LINE_COUNT_CHUNK_SIZE):
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+    return lines + (last != b'\n')
+
+def relation_size_key(relation: str) -> str:
+    """The analytics key of a relation's size, e.g. `Size_BlockOutputContents` for `global.BlockOutputContents`"""
+    return 'Size_' + relation.removeprefix('global.').replace('.', '_')
+
+def get_gigahorse_analytics(out_dir: str, analytics: dict, entries: list[os.DirEntry] | None = None, patterns: list[str] = DEFAULT_ANALYTICS_PATTERNS,
+                            sizes_programs: Iterable[str] = ()) -> None:
+    """
+    Adds to analytics the number of rows of the `Analytics_*` and `Metric_*` relations in out_dir, the contents of the `Verbatim_*` ones
+    and the `Size_*` relation sizes printed by the `sizes_programs`, keeping only those whose names match one of the patterns.
+    The entries of out_dir can be given if they are already scanned.
+    """
+    if entries is None:
+        with os.scandir(out_dir) as scanned:
+            entries = list(scanned)
+
+    size_files = {entry.name.removesuffix(RELATION_SIZES_SUFFIX): entry.path for entry in entries if entry.name.endswith(RELATION_SIZES_SUFFIX)}
+    # programs run later (the fallback decompilers) print more relevant sizes
+    for program in sizes_programs:
+        if program not in size_files:
             continue
-        stat_name = fname.split(".")[0]
-        analytics[stat_name] = sum(1 for line in open(join(out_dir, fname)))
-
-    for fname in os.listdir(out_dir):
-        fpath = join(out_dir, fname)
-        if not fname.startswith('Verbatim_'):
+        for relation, size in read_relation_sizes(size_files[program]).items():
+            stat_name = relation_size_key(relation)
+            if any(fnmatchcase(stat_name, pattern) for pattern in patterns):
+                analytics[stat_name] = size
+
+    for entry in entries:
+        stat_name = entry.name.split(".")[0]
+        if not any(fnmatchcase(stat_name, pattern) for pattern in patterns):
             continue
-        stat_name = fname.split(".")[0]
-        analytics[stat_name] = open(join(out_dir, fname)).read()
+        if stat_name.startswith('Analytics_') or stat_name.startswith('Metric_'):
+            analytics[stat_name] = count_lines(entry.path, entry.stat().st_size)
+        elif stat_name.startswith('Verbatim_'):
+            with open(entry.path) as f:
+                analytics[stat_name] = f.read()
 
     try:
         f = open(join(out_dir, 'vulnerability.csv'))
@@ -349,7 +537,7 @@ def get_gigahorse_analytics(out_dir: str, analytics: dict) -> None:
             key = f'{confidence}: {vulnerability_type}'
             analytics[key] = analytics.get(key, 0) + 1
 
-def flush_queue(run_sig: Any, result_queue: SimpleQueue, result_list: Any) -> None:
+def flush_queue(run_sig: Any, result_queue: SimpleQueue, result_list: Any, ledger_dir: str | None = None) -> None:
     """
     For flushing the queue periodically to a list so it doesn't fill up.
 
@@ -358,70 +546,76 @@ def flush_queue(run_sig: Any, result_queue: SimpleQueue, result_list: Any) -> No
         run_sig: terminate when the Event run_sig is cleared.
         result_queue: the queue in which results accumulate before being flushed
         result_list: the final list of results.
+        ledger_dir: if given, the results are also recorded in the completion ledger of this working directory.
     """
-    while run_sig.is_set():
+    ledger = CompletionLedger(ledger_dir) if ledger_dir is not None else None
+    running = True
+    while running:
         time.sleep(0.1)
+        # drain the queue one last time after run_sig is cleared
+        running = run_sig.is_set()
+        items = []
         while not result_queue.empty():
-            item = result_queue.get()
-            result_list.append(item)
+            items.append(result_queue.get())
+        if not items:
+            continue
+        result_list.extend(items)
+        if ledger is not None:
+            ledger.record(items)
 
-def write_results(res_list: Any, results_file: str) -> None:
+def write_results(res_list: Any, results_file: str, results_format: str = 'json') -> None:
     """
-    Filters the results in res_list, logging the appropriate messages
-    and writting them to the results_file json file
+    Logs the summaries of the results in res_list
+    and writes them to the results_file, as json or in the compressed columnar format
     """
-    total = len(res_list)
-    vulnerability_counts: defaultdict[str, int] = defaultdict(int)
-    analytics_sums: defaultdict[str, int] = defaultdict(int)
-    meta_counts: defaultdict[str, int] = defaultdict(int)
-    all_files = set()
-    for _, files, meta, analytics in res_list:
-        for f in files:
-            all_files.add(f)
-        for m in meta:
-            meta_counts[m] += 1
-        for k, a in analytics.items():
-            if ':' in k: # tell-tale sign for vulnerability key
-                vulnerability_counts[k] += 1
-            if isinstance(a, int):
-                analytics_sums[k] += a
-            if k in all_files:
-                all_files.remove(k)
-
-    analytics_sums_sorted = sorted(list(analytics_sums.items()), key = lambda a: a[0])
-    if analytics_sums_sorted:
-        log('\n')
-        log('-'*80)
-        log('Analytics')
-        log('-'*80)
-        for res, sums in analytics_sums_sorted:
-            log("  {}: {}".format(res, sums))
-        log('\n')
-
-    vulnerability_counts_sorted = sorted(list(vulnerability_counts.items()), key = lambda a: a[0])
-    if vulnerability_counts_sorted:
-        log('-'*80)
-        log('Summary (flagged contracts)')
-        log('-'*80)
-
-        for res, count in vulnerability_counts_sorted:
-            log("  {}: {:.2f}%".format(res, 100 * count / total))
-
-    if meta_counts:
-        log('-'*80)
-        log('Timeouts and Errors')
-        log('-'*80)
-        for k, v in meta_counts.items():
-            log(f"  {k}: {v} of {total} contracts")
-        log('\n')
+    log_summary(res_list)
 
     log("\nWriting results to {}".format(results_file))
-    with open(results_file, 'w') as f:
-        f.write(json.dumps(list(res_list), indent=1))
+    write_results_file(res_list, results_file, results_format)
+
+def already_finished(contract_name: str, working_dir: str, ledger: CompletionLedger | None, res_list: Any, work_queue: WorkQueue | None = None) -> bool:
+    """
+    Whether a contract was analyzed by an earlier run, in which case its result (if known) is carried over to res_list.
+    Without a ledger, any existing working directory counts as finished.
+    The working directory of an interrupted analysis is only removed if the contract is still claimed by this instance,
+    as another instance sharing the working directory may have claimed it (and be analyzing it) since.
+    """
+    if ledger is None:
+        return os.path.isdir(working_dir)
+
+    finished, previous_result = ledger.lookup(contract_name)
+    if finished:
+        if previous_result is not None:
+            res_list.append(previous_result)
+        return True
+
+    if os.path.isdir(working_dir):
+        if work_queue is not None and not work_queue.owns(contract_name):
+            # left to the instance that claimed it
+            return True
+        log(f"{os.path.split(contract_name)[1]} was interrupted in an earlier run, analyzing it again.")
+        shutil.rmtree(working_dir)
+    return False
+
+def settle_contract(contract_name: str, succeeded: bool, spool: ContractSpool | None, work_queue: WorkQueue | None) -> None:
+    """
+    Wraps up a contract whose job ended, acknowledging it if it was claimed from a work queue.
+    A streamed contract is released from the spool only once settled, not while it is left in the queue to be retried.
+    """
+    if work_queue is not None and not work_queue.ack(contract_name, done=succeeded):
+        return
+    if spool is not None:
+        spool.release(contract_name)
 
-def batch_analysis(fact_generator: AbstractFactGenerator, souffle_clients: list[str], other_clients: list[str], contracts: list[str], num_of_jobs: int) -> Any:
+def batch_analysis(fact_generator: AbstractFactGenerator, souffle_clients: list[str], other_clients: list[str], contracts: Iterable[str | None], num_of_jobs: int, admission: MemoryAdmissionController | None = None, souffle_threads: int = 1, spool: ContractSpool | None = None, ledger: CompletionLedger | None = None, work_queue: WorkQueue | None = None) -> Any:
     """
-    Given a fact generator and the client lists, analyzes the contracts list, using num_of_jobs parallel jobs/processes
+    Given a fact generator and the client lists, analyzes the contracts, using num_of_jobs parallel jobs/processes.
+    The contracts are consumed lazily, so they can be streamed; streamed contracts are released from the spool once analyzed.
+    Contracts finished according to the ledger are skipped, keeping their earlier results, and interrupted ones are analyzed again.
+    If the contracts are claimed from a work queue, they are claimed one launch at a time (None meaning none can be claimed yet),
+    their leases are renewed while they are analyzed and they are acknowledged once done.
+    If an admission controller is given, new jobs are held back while there isn't enough memory for them.
+    Each job runs souffle with souffle_threads threads, or, for AUTO_SOUFFLE_THREADS, with its share of the idle cores.
     """
     # Set up multiprocessing result list and queue.
     manager = Manager()
@@ -436,13 +630,20 @@ def batch_analysis(fact_generator: AbstractFactGenerator, souffle_clients: list[
     # Start the periodic flush process, only run while run_signal is set.
     run_signal = Event()
     run_signal.set()
-    flush_proc = Process(target=flush_queue, args=(run_signal, res_queue, res_list))
+    flush_proc = Process(target=flush_queue, args=(run_signal, res_queue, res_list, os.path.abspath(args.working_dir) if ledger is not None else None))
     flush_proc.start()
 
     workers: list[dict[str, Any]] = []
     avail_jobs = list(range(num_of_jobs))
-    contract_iter = enumerate(contracts)
+    contract_iter = Lookahead(enumerate(contracts), num_of_jobs)
+    # contracts aren't claimed ahead of their launch, to leave them to other instances
+    queue_depth = contract_iter.depth if work_queue is None else lambda: work_queue.claimable(num_of_jobs)
     contracts_exhausted = False
+    # Whether no contract could be claimed from the work queue yet
+    waiting_for_queue = False
+    # A contract whose launch was held back by the admission controller
+    held_back: tuple[int, str] | None = None
+    observed_results = 0
 
     log("Analysing...\n")
     try:
@@ -450,27 +651,51 @@ def batch_analysis(fact_generator: AbstractFactGenerator, souffle_clients: list[
             # If there's both workers and contracts available, use the former to work on the latter.
             while not contracts_exhausted and len(avail_jobs) > 0:
                 try:
-                    index, contract_name = next(contract_iter)
+                    if held_back is not None:
+                        index, contract_name = held_back
+                        held_back = None
+                    else:
+                        index, next_contract = next(contract_iter)
+                        if next_contract is None:
+                            waiting_for_queue = True
+                            break
+                        contract_name = next_contract
                     working_dir = get_working_dir(contract_name)
-                    if os.path.isdir(working_dir) and not args.rerun_clients:
+                    if not args.rerun_clients and already_finished(contract_name, working_dir, ledger, res_list, work_queue):
                         # no need to create another process
+                        settle_contract(contract_name, True, spool, work_queue)
                         continue
 
+                    memory_estimate = 0
+                    if admission is not None:
+                        memory_estimate = admission.estimate(contract_name)
+                        if not admission.admit(memory_estimate, workers):
+                            held_back = index, contract_name
+                            break
+
+                    job_souffle_threads = souffle_threads
+                    if souffle_threads == AUTO_SOUFFLE_THREADS:
+                        threads_in_use = sum(w["souffle_threads"] for w in workers)
+                        job_souffle_threads = souffle_threads_for_job(cpu_count(), threads_in_use, len(avail_jobs), queue_depth())
+
                     # reduce number of available jobs
                     job_index = avail_jobs.pop()
-                    proc = Process(target=analyze_contract, args=(index, contract_name, res_queue, fact_generator, souffle_clients, other_clients))
+                    proc = Process(target=analyze_contract, args=(index, contract_name, res_queue, fact_generator, souffle_clients, other_clients, job_souffle_threads))
                     proc.start()
                     start_time = time.time()
                     workers.append({"name": contract_name,
                                     "proc": proc,
                                     "time": start_time,
-                                    "job_index": job_index})
+                                    "job_index": job_index,
+                                    "memory_estimate": memory_estimate,
+                                    "souffle_threads": job_souffle_threads})
                 except StopIteration:
                     contracts_exhausted = True
 
             # Loop until some process terminates (to retask it) or,
-            # if there are no unanalyzed contracts left, until currently-running contracts are done
-            while len(avail_jobs) == 0 or (contracts_exhausted and 0 < len(workers)):
+            # if there are no unanalyzed contracts left, until currently-running contracts are done.
+            # A held back launch is retried periodically, as memory may be freed by running jobs, and so is claiming from the work queue.
+            while len(avail_jobs) == 0 or (contracts_exhausted and 0 < len(workers)) or held_back is not None or waiting_for_queue:
                 to_remove = []
                 for i in range(len(workers)):
                     start_time = workers[i]["time"]
@@ -482,11 +707,31 @@ def batch_analysis(fact_generator: AbstractFactGenerator, souffle_clients: list[
                         to_remove.append(i)
                         proc.join()
                         avail_jobs.append(job_index)
+                        # a job that didn't exit cleanly (e.g. killed) didn't produce its result
+                        settle_contract(name, proc.exitcode == 0, spool, work_queue)
 
                 # Reverse index order so as to pop elements correctly
                 for i in reversed(to_remove):
                     workers.pop(i)
 
+                if work_queue is not None:
+                    work_queue.renew_if_due()
+
+                if admission is not None and to_remove:
+                    new_results = res_list[observed_results:]
+                    observed_results += len(new_results)
+                    for _, _, _, analytics in new_results:
+                        admission.observe(analytics)
+
+                if held_back is not None:
+                    time.sleep(ADMISSION_RETRY_INTERVAL)
+                    break
+
+                if waiting_for_queue:
+                    waiting_for_queue = False
+                    time.sleep(POLL_INTERVAL)
+                    break
+
                 time.sleep(0.01)
 
         # Conclude and write results to file.
@@ -517,6 +762,9 @@ def run_gigahorse(args, fact_generator: AbstractFactGenerator) -> None:
 
     analysis_executor = AnalysisExecutor(args.timeout_secs, args.interpreted, args.minimum_client_time, args.debug, args.souffle_bin, args.cache_dir, get_souffle_macros())
 
+    analysis_executor.reuse_client_outputs = args.rerun_clients
+    analysis_executor.client_jobs = args.client_jobs
+    analysis_executor.profile = args.profile
     fact_generator.analysis_executor = analysis_executor
 
     clients_split = [a.strip() for a in args.client.split(',')]
@@ -533,12 +781,21 @@ def run_gigahorse(args, fact_generator: AbstractFactGenerator) -> None:
 
         souffle_files += souffle_clients
 
+        souffle_variants = fact_generator.get_datalog_variants()
+
         running_processes = []
         for file in souffle_files:
-            proc = Process(target = compile_datalog, args=(file, args.souffle_bin, args.cache_dir, args.reuse_datalog_bin, get_souffle_macros()))
+            proc = Process(target = compile_datalog, args=(file, args.souffle_bin, args.cache_dir, args.reuse_datalog_bin, get_souffle_macros(), args.profile))
+            proc.start()
+            running_processes.append(proc)
+        for file, variant, variant_macros in souffle_variants:
+            proc = Process(target = compile_datalog, args=(file, args.souffle_bin, args.cache_dir, args.reuse_datalog_bin, f"{get_souffle_macros()} {variant_macros}", args.profile, variant))
             proc.start()
             running_processes.append(proc)
 
+    if args.filter_signatures and not args.skip_sig_resolution:
+        build_signature_indexes(args.cache_dir)
+
     if args.restart:
         log("Removing working directory {}".format(args.working_dir))
         shutil.rmtree(args.working_dir, ignore_errors = True)
@@ -551,38 +808,78 @@ def run_gigahorse(args, fact_generator: AbstractFactGenerator) -> None:
 
         # check all programs have been compiled
         for file in souffle_files:
-            open(get_souffle_executable_path(args.cache_dir, file), 'r') # check program exists
-
-    # Extract contract filenames.
-    log("Processing contract names...")
-
-    contracts = []
-
-    for filepath in args.filepath:
-        if os.path.isdir(filepath):
-            if args.interpreted:
-                log("[WARNING]: Running batch analysis in interpreted mode.")
-            unfiltered = [join(filepath, f) for f in os.listdir(filepath)]
-        else:
-            unfiltered = [filepath]
-
-        contracts += [u for u in unfiltered if fact_generator.match_pattern(u)]
-
-    contracts = contracts[args.skip:]
-    if isinstance(fact_generator, MixedFactGenerator):
+            open(get_souffle_executable_path(args.cache_dir, file, args.profile), 'r') # check program exists
+        for file, variant, _ in souffle_variants:
+            open(get_souffle_executable_path(args.cache_dir, file, args.profile, variant), 'r')
+
+    # Contracts are discovered lazily, as the analysis goes.
+    if args.interpreted and any(os.path.isdir(filepath) for filepath in args.filepath):
+        log("[WARNING]: Running batch analysis in interpreted mode.")
+
+    ledger = CompletionLedger(args.working_dir, args.adopt_working_dir)
+    if ledger.legacy_entries and args.adopt_working_dir:
+        log(f"[WARNING]: The working directory predates the completion ledger, treating its {ledger.legacy_entries} contract directories as finished.")
+    elif ledger.legacy_entries:
+        log(f"[WARNING]: The working directory predates the completion ledger, analyzing its {ledger.legacy_entries} contract directories again"
+            " (use --adopt_working_dir to treat them as finished).")
+
+    spool = ContractSpool(args.working_dir)
+    def selected(contract_filename: str) -> bool:
+        if args.shard is not None and contract_shard(contract_filename, args.shard[1]) != args.shard[0]:
+            return False
+        return fact_generator.match_pattern(contract_filename)
+
+    discovered = (c for c in discover_contracts(args.filepath) if selected(spool.filename(c)))
+    contracts: Iterable[str] = map(spool.materialize, islice(discovered, args.skip, None))
+
+    work_queue = None
+    if args.queue is not None:
+        # Contracts claimed from the queue replace the inputs, which are added to it a chunk at a time as contracts are claimed;
+        # their priority decides the order they are claimed in
+        work_queue = WorkQueue(args.queue)
+        priority_of: Callable[[str], int] = lambda _: fact_generator.priority
+        if isinstance(fact_generator, MixedFactGenerator):
+            # lower priority contracts are only added after all higher priority ones, which have to be claimed first
+            priority_of = fact_generator.priority_of
+            contracts = (c for contract_list in fact_generator.partition_inputs_by_priority(contracts) for c in contract_list)
+        contract_lists: Iterator[Iterable[str | None]] = iter([work_queue.claims((c, priority_of(c)) for c in contracts)])
+    elif isinstance(fact_generator, MixedFactGenerator):
         contract_lists = fact_generator.partition_inputs_by_priority(contracts)
     else:
-        contract_lists = [contracts]
+        contract_lists = iter([contracts])
+
+    admission = None
+    if args.memory_admission:
+        history = load_memory_history(args.memory_history) if args.memory_history else None
+        admission = MemoryAdmissionController(int(args.memory_reserve * 1_000_000_000), history, args.memory_per_bytecode_byte)
 
     res_list = list()
     round_num = 1
     for contract_list in contract_lists:
-        log(f"Round {round_num}: Discovered {len(contract_list)} contracts. Setting up workers.")
-        tmp_list = batch_analysis(fact_generator, souffle_clients, other_clients, contract_list, args.jobs)
+        if isinstance(contract_list, list):
+            log(f"Round {round_num}: Discovered {len(contract_list)} contracts. Setting up workers.")
+        else:
+            log(f"Round {round_num}: Discovering contracts as they are analyzed. Setting up workers.")
+        tmp_list = batch_analysis(fact_generator, souffle_clients, other_clients, contract_list, args.jobs, admission, args.souffle_threads, spool, ledger, work_queue)
         res_list += tmp_list
         round_num += 1
 
-    write_results(res_list, args.results_file)
+    if admission is not None:
+        admission.report()
+
+    if work_queue is not None:
+        log(f"Added {work_queue.added} contracts to the work queue {args.queue}.")
+        log(f"Work queue: {', '.join(f'{n} {status}' for status, n in sorted(work_queue.counts().items()))}.")
+
+    if args.profile:
+        collect_profiles(args.working_dir).log()
+
+    if args.context_depth_history:
+        depth_history = ContextDepthHistory(args.context_depth_history, args.context_depth)
+        depth_history.record_results(res_list)
+        depth_history.save()
+
+    write_results(res_list, args.results_file, args.results_format)
 
 if __name__ == "__main__":
     # Decompiler tuning
@@ -593,6 +890,15 @@ if __name__ == "__main__":
                         metavar="NUM",
                         help=f"Override the maximum context depth for decompilation (default is {MAIN_DECOMPILER_MAX_CONTEXT_DEPTH}).")
 
+    parser.add_argument("--context_depth_history",
+                        default=None,
+                        metavar="FILE",
+                        help="Tune the context depth of each contract analyzed again, using (and updating) this history of earlier runs."
+                        " A contract is decompiled with the next lower depth to try, or the cheapest depth known to give the same"
+                        " Analytics_JumpToMany and Analytics_ReachableBlocks as the default depth (-cd). If a lower depth gives a different"
+                        " result, the contract is decompiled again with the default depth. The history can be seeded from results files"
+                        " with python3 -m src.context_depth.")
+
     parser.add_argument("--early_cloning",
                         action="store_true",
                         default=False,
@@ -615,7 +921,30 @@ if __name__ == "__main__":
                         help="Disables the scalable fallback configuration (using a hybrid-precise context configuration) that kicks off"
                         " if decompilation with the default (transactional) config takes up more than half of the total timeout.")
 
+    parser.add_argument("--early_fallback",
+                        action="store_true",
+                        default=False,
+                        help="Abort the default (and then the scalable fallback) decompiler configuration as soon as its memory clearly blows up,"
+                        " instead of waiting for half of the timeout, so the next fallback configuration gets most of it. A run is aborted when its RSS"
+                        " goes over a threshold, learned from the --memory_history results if given, or when its RSS grows fast enough to reach"
+                        " the memory limit before its timeout. The reasons of the fallbacks are recorded in the fallback_reasons analytic.")
+
+    parser.add_argument("--early_fallback_rss",
+                        type=float,
+                        default=None,
+                        metavar="GB",
+                        help=f"The RSS threshold of --early_fallback, instead of learning one (default: {DEFAULT_RSS_THRESHOLD // 1_000_000_000} GB"
+                        " if none can be learned).")
+
+    parser.add_argument("--early_fallback_grace",
+                        type=float,
+                        default=DEFAULT_GRACE_PERIOD,
+                        metavar="SECONDS",
+                        help=f"Seconds a decompiler run is left to grow before --early_fallback considers its growth rate (default: {DEFAULT_GRACE_PERIOD:.0f}).")
+
     args = parser.parse_args()
+    if not args.filepath and args.queue is None:
+        parser.error("the contracts to analyze are required, unless working on a --queue")
 
     tac_gen_config_json = args.tac_gen_config
     with open(tac_gen_config_json, 'r') as config:
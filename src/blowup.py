@@ -0,0 +1,106 @@
+"""blowup.py: spotting decompiler runs whose memory blows up, to start the next fallback before their timeout"""
+
+import os
+
+from collections import deque
+from typing import Callable
+
+from .common import log
+from .results import iter_results, percentile
+
+DEFAULT_RSS_THRESHOLD = 16 * 1_000_000_000
+"""RSS over which a decompiler run is aborted when no threshold is learned for it (16 GB)"""
+
+RSS_THRESHOLD_MARGIN = 1.5
+"""Margin over the peak RSS of the decompiler runs that succeeded in a previous run, giving the learned threshold"""
+
+MIN_OBSERVATIONS = 10
+"""Number of successful runs of a decompiler configuration needed to learn its threshold"""
+
+DEFAULT_GRACE_PERIOD = 30.0
+"""Seconds a run is left alone before its growth rate is considered, as loading the facts is a burst of growth"""
+
+GROWTH_WINDOW = 10.0
+"""Seconds over which the RSS growth rate is measured"""
+
+SUCCESSFUL_CONFIGS = {
+    'DefaultDecomp': 'main.dl',
+    'ScalableDecomp': 'fallback_scalable.dl',
+}
+"""The decompiler program whose resource usage is representative of a successful run, per decompiler config"""
+
+ProcessMonitor = Callable[[int, float], str | None]
+"""Called with the pid and elapsed time of a running process, returns the reason to abort it (or None to let it run)"""
+
+
+def process_rss(pid: int) -> int:
+    """Current resident set size of a process in bytes, 0 if it is not running"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def learn_rss_thresholds(results_file: str) -> dict[str, int]:
+    """
+    RSS thresholds of the decompiler programs, learned from the contracts of a previous run they succeeded on:
+    the 99th percentile of their peak RSS, with a margin
+    """
+    peaks: dict[str, list[int]] = {program: [] for program in SUCCESSFUL_CONFIGS.values()}
+    for _, _, meta, analytics in iter_results(results_file, {'decompiler_config', 'resource_usage'}):
+        program = SUCCESSFUL_CONFIGS.get(analytics.get('decompiler_config'))
+        if program is None or meta:
+            continue
+        usage = analytics.get('resource_usage', {}).get('clients', {}).get(program)
+        if usage and usage['max_rss'] > 0:
+            peaks[program].append(usage['max_rss'])
+
+    return {
+        program: int(percentile(sorted(program_peaks), 99) * RSS_THRESHOLD_MARGIN)
+        for program, program_peaks in peaks.items() if len(program_peaks) >= MIN_OBSERVATIONS
+    }
+
+
+class BlowupDetector:
+    """
+    Aborts decompiler runs that are clearly too expensive, so that the next fallback configuration gets most of the timeout:
+    runs whose RSS goes over their threshold, and runs whose RSS keeps growing fast enough to reach the memory limit before their timeout.
+    """
+
+    def __init__(self, memory_limit: int, rss_threshold: int | None = None, history_file: str | None = None, grace_period: float = DEFAULT_GRACE_PERIOD):
+        self.memory_limit = memory_limit
+        self.default_threshold = rss_threshold if rss_threshold is not None else DEFAULT_RSS_THRESHOLD
+        self.grace_period = grace_period
+        self.thresholds: dict[str, int] = {}
+        if rss_threshold is None and history_file is not None:
+            self.thresholds = learn_rss_thresholds(history_file)
+            for program, threshold in self.thresholds.items():
+                log(f"Learned an RSS threshold of {threshold / 1_000_000_000:.1f} GB for {program} from {history_file}")
+
+    def monitor(self, souffle_program: str, timeout: float) -> ProcessMonitor:
+        """A monitor for a run of the program, which will be killed on `timeout` seconds anyway"""
+        threshold = self.thresholds.get(os.path.basename(souffle_program), self.default_threshold)
+        samples: deque[tuple[float, int]] = deque()
+
+        def check(pid: int, elapsed: float) -> str | None:
+            rss = process_rss(pid)
+            if rss > threshold:
+                return f"RSS of {rss / 1_000_000_000:.1f} GB over the {threshold / 1_000_000_000:.1f} GB threshold after {elapsed:.0f} secs"
+
+            samples.append((elapsed, rss))
+            while elapsed - samples[0][0] > GROWTH_WINDOW:
+                samples.popleft()
+            if elapsed < self.grace_period or elapsed - samples[0][0] < GROWTH_WINDOW / 2:
+                return None
+
+            rate = (rss - samples[0][1]) / (elapsed - samples[0][0])
+            if rate > 0 and rss + rate * (timeout - elapsed) > self.memory_limit:
+                return (f"RSS growing at {rate / 1_000_000:.0f} MB/s after {elapsed:.0f} secs, "
+                        f"reaching the {self.memory_limit / 1_000_000_000:.0f} GB memory limit before the timeout")
+            return None
+
+        return check
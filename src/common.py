@@ -3,6 +3,8 @@ from os.path import abspath, dirname, join, exists
 import os
 import logging
 
+from typing import Any
+
 GIGAHORSE_DIR = join(dirname(abspath(__file__)), '..')
 """The path of the gigahorse-toolchain clone."""
 
@@ -23,8 +25,13 @@ COMMON_FACTS_DIR = os.environ.get("COMMON_FACTS_DIR", COMMON_FACTS_DEFAULT_DIR)
 log = lambda msg: logging.log(logging.INFO + 1, msg)
 log_debug = lambda msg: logging.log(logging.DEBUG, msg)
 
+def peak_memory(analytics: dict[str, Any]) -> int:
+    """The largest peak RSS of any stage in the `resource_usage` analytics of a contract"""
+    stages = analytics.get('resource_usage', {}).get('stages', {})
+    return max((usage['max_rss'] for usage in stages.values()), default=0)
+
 def __get_sig_file(simple_filename: str) -> str:
-    preferred_dest = join(join(dirname(abspath(__file__)), '../../common-facts'), simple_filename)
+    preferred_dest = join(COMMON_FACTS_DIR, simple_filename)
     fallback_dest = join(join(dirname(abspath(__file__)), '..'), simple_filename)
     return preferred_dest if exists(preferred_dest) else fallback_dest
 
@@ -0,0 +1,158 @@
+"""context_depth.py: per-contract tuning of the maximum context depth of the main decompiler, from the results of earlier runs"""
+
+import hashlib
+import json
+import os
+
+from dataclasses import dataclass
+from os.path import join
+from typing import Any, Iterable
+
+from .common import log
+from .results import iter_results
+
+TUNING_ANALYTICS = ['Analytics_JumpToMany', 'Analytics_ReachableBlocks']
+"""A lower context depth is only used for a contract if it gives the same values for these"""
+
+DEPTH_CANDIDATES = [16, 12, 8, 6, 4]
+"""Depths tried below the default one, one more (lower) each time a contract is analyzed"""
+
+
+def bytecode_hash(bytecode: str) -> str:
+    return hashlib.md5(bytecode.strip().encode()).hexdigest()
+
+
+def tuning_values(out_dir: str) -> dict[str, int]:
+    """The TUNING_ANALYTICS of a decompiler output"""
+    values = {}
+    for analytic in TUNING_ANALYTICS:
+        try:
+            with open(join(out_dir, analytic + '.csv'), 'rb') as f:
+                values[analytic] = sum(1 for _ in f)
+        except FileNotFoundError:
+            values[analytic] = 0
+    return values
+
+
+@dataclass
+class DepthPlan:
+    """
+    The context depth to decompile a contract with, and the result it has to match to be kept,
+    otherwise the contract is decompiled again with the fallback depth
+    """
+    depth: int
+    fallback_depth: int
+    reference: dict[str, int]
+
+    def matches(self, out_dir: str) -> bool:
+        return tuning_values(out_dir) == self.reference
+
+
+class ContextDepthHistory:
+    """
+    The context depths contracts were decompiled with by the main decompiler configuration, and the results they gave,
+    in a JSON file keyed by contract name. The result at the default depth is the reference the lower depths are compared against.
+    A contract whose bytecode changed starts over.
+    """
+
+    def __init__(self, history_file: str, default_depth: int):
+        self.history_file = history_file
+        self.default_depth = default_depth
+        self.entries: dict[str, dict[str, Any]] = {}
+        if os.path.exists(history_file):
+            with open(history_file) as f:
+                self.entries = json.load(f)
+
+    def entry(self, contract_name: str, code_hash: str | None) -> dict[str, Any]:
+        entry = self.entries.get(contract_name)
+        if entry is None or (code_hash is not None and entry['bytecode_hash'] not in (None, code_hash)):
+            entry = self.entries[contract_name] = {'bytecode_hash': code_hash, 'reference': None, 'depths': {}}
+        elif entry['bytecode_hash'] is None:
+            entry['bytecode_hash'] = code_hash
+        return entry
+
+    def plan(self, contract_name: str, code_hash: str) -> DepthPlan | None:
+        """
+        The depth to try for a contract: the next candidate below the cheapest depth known to give the reference result,
+        falling back to that cheapest depth, unless a lower depth already failed to, in which case that cheapest depth,
+        falling back to the default one. None if there is no reference yet.
+        """
+        entry = self.entries.get(contract_name)
+        if entry is None or entry['reference'] is None or entry['bytecode_hash'] not in (None, code_hash):
+            return None
+
+        depths = {int(depth): run for depth, run in entry['depths'].items()}
+        identical = [depth for depth, run in depths.items() if run['identical']]
+        cheapest = min(identical + [self.default_depth])
+        lower = [depth for depth in DEPTH_CANDIDATES if depth < cheapest]
+        if lower and lower[0] not in depths:
+            return DepthPlan(lower[0], cheapest, entry['reference'])
+        return DepthPlan(cheapest, self.default_depth, entry['reference'])
+
+    def record(self, contract_name: str, code_hash: str | None, analytics: dict[str, Any]) -> None:
+        """Records a successful decompilation by the main decompiler configuration"""
+        depth = analytics.get('context_depth', self.default_depth)
+        values = {analytic: analytics.get(analytic, 0) for analytic in TUNING_ANALYTICS}
+        entry = self.entry(contract_name, code_hash)
+        if depth != self.default_depth and entry['reference'] is None:
+            return
+        if depth == self.default_depth:
+            if entry['reference'] != values:
+                # the lower depths were compared against another result
+                entry['depths'] = {}
+            entry['reference'] = values
+        entry['depths'][str(depth)] = {
+            'identical': depth == self.default_depth or values == entry['reference'],
+            'decompiler_config': analytics.get('decompiler_config'),
+            'decomp_time': analytics.get('decomp_time')
+        }
+
+    def record_mismatch(self, contract_name: str, code_hash: str | None, depth: int) -> None:
+        """Records that a lower depth gave a different result than the reference one"""
+        self.entry(contract_name, code_hash)['depths'][str(depth)] = {'identical': False}
+
+    def record_results(self, results: Iterable[list[Any] | tuple[Any, ...]], context_depth: int | None = None) -> int:
+        """Records the results of a run, `context_depth` being the depth of a run predating the `context_depth` analytic"""
+        recorded = 0
+        for name, _, meta, analytics in results:
+            if 'context_depth_mismatch' in analytics:
+                self.record_mismatch(name, analytics.get('bytecode_hash'), analytics['context_depth_mismatch'])
+            if meta or analytics.get('decompiler_config') != 'DefaultDecomp':
+                # a lower depth that needed a fallback doesn't do
+                if analytics.get('context_depth', self.default_depth) != self.default_depth:
+                    self.record_mismatch(name, analytics.get('bytecode_hash'), analytics['context_depth'])
+                continue
+            if context_depth is not None and 'context_depth' not in analytics:
+                analytics = analytics | {'context_depth': context_depth}
+            self.record(name, analytics.get('bytecode_hash'), analytics)
+            recorded += 1
+        return recorded
+
+    def save(self) -> None:
+        with open(self.history_file + '.tmp', 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(self.history_file + '.tmp', self.history_file)
+
+
+if __name__ == "__main__":
+    import argparse
+    import logging
+
+    parser = argparse.ArgumentParser(description="Seeds the context depth history of gigahorse.py --context_depth_history from results files.")
+    parser.add_argument("history_file", metavar="HISTORY_FILE")
+    parser.add_argument("result_files", nargs="+", metavar="RESULTS_FILE")
+    parser.add_argument("--default_depth", type=int, default=20, metavar="NUM",
+                        help="The default context depth of the runs to tune (default: 20).")
+    parser.add_argument("-cd", "--context_depth", type=int, default=None, metavar="NUM",
+                        help="The context depth the results files were produced with, if they predate the context_depth analytic"
+                        " (by default, the default context depth).")
+
+    args = parser.parse_args()
+    logging.basicConfig(format='%(message)s', level=logging.INFO + 1)
+
+    history = ContextDepthHistory(args.history_file, args.default_depth)
+    for results_file in args.result_files:
+        keys = set(TUNING_ANALYTICS) | {'context_depth', 'context_depth_mismatch', 'decompiler_config', 'decomp_time', 'bytecode_hash'}
+        recorded = history.record_results(iter_results(results_file, keys), args.context_depth or args.default_depth)
+        log(f"Recorded {recorded} contracts of {results_file}")
+    history.save()
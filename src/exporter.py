@@ -7,6 +7,7 @@ import os
 import src.opcodes as opcodes
 import src.basicblock as basicblock
 from src.common import public_function_signature_filename, event_signature_filename, error_signature_filename, COMMON_FACTS_DIR
+from src.signatures import SignatureIndex, selector_candidates, filter_signatures
 
 
 from typing import Any
@@ -112,16 +113,20 @@ class EVMBlockExporter(FactExporter):
       ordered: if True (default), print BasicBlocks in order of entry
       bytecode_hex: bytecode in hexadecimal form, used to export the compiler metadata
       metadata: dict containing metadata output by the solidity compiler
+      signature_indexes: if given, only the signatures matching constants pushed in the bytecode
+        are looked up in these indexes and written out, instead of linking the full signature files
     """
 
     def __init__(self, output_dir: str, blocks: list[basicblock.EVMBasicBlock], ordered: bool = True,
-                 bytecode_hex: str | None = None, metadata: dict[Any, Any] | None = None, skip_sig_resolution: bool = False):
+                 bytecode_hex: str | None = None, metadata: dict[Any, Any] | None = None, skip_sig_resolution: bool = False,
+                 signature_indexes: dict[str, SignatureIndex | None] | None = None):
         super().__init__(output_dir)
         self.blocks = blocks
         self.ordered = ordered
         self.bytecode_hex = bytecode_hex
         self.process_metadata(metadata)
         self.skip_sig_resolution = skip_sig_resolution
+        self.signature_indexes = signature_indexes
 
     def process_metadata(self, metadata: dict[Any, Any] | None = None) -> None:
         """
@@ -159,9 +164,14 @@ class EVMBlockExporter(FactExporter):
             version_bytes = self.bytecode_hex[index : index + 6]
             return f"{int(version_bytes[0:2], 16)}.{int(version_bytes[2:4], 16)}.{int(version_bytes[4:6], 16)}"
 
-        def link_or_output_signature_file(signatures_filename_in: str, signatures_filename_out_simple: str):
+        def link_or_output_signature_file(signatures_filename_in: str, signatures_filename_out_simple: str, candidates: set[int]):
             signatures_filename_out = self.get_out_file_path(signatures_filename_out_simple)
-            if not self.skip_sig_resolution and os.path.isfile(signatures_filename_in):
+            if not self.skip_sig_resolution and self.signature_indexes is not None:
+                index = self.signature_indexes.get(signatures_filename_out_simple)
+                rows = filter_signatures(index, candidates) if index is not None else []
+                with open(signatures_filename_out, 'w') as f:
+                    f.writelines(row + '\n' for row in rows)
+            elif not self.skip_sig_resolution and os.path.isfile(signatures_filename_in):
                 try:
                     os.symlink(signatures_filename_in, signatures_filename_out)
                 except FileExistsError:
@@ -207,9 +217,12 @@ class EVMBlockExporter(FactExporter):
                 language = "unknown"
                 compiler_version = "unknown"
 
-        link_or_output_signature_file(public_function_signature_filename, 'PublicFunctionSignature.facts')
-        link_or_output_signature_file(event_signature_filename, 'EventSignature.facts')
-        link_or_output_signature_file(error_signature_filename, 'ErrorSignature.facts')
+        pushed_values = {op.value for block in self.blocks for op in block.evm_ops if op.opcode.is_push()} if self.signature_indexes is not None else set()
+        selectors = selector_candidates(pushed_values)
+
+        link_or_output_signature_file(public_function_signature_filename, 'PublicFunctionSignature.facts', selectors)
+        link_or_output_signature_file(event_signature_filename, 'EventSignature.facts', pushed_values)
+        link_or_output_signature_file(error_signature_filename, 'ErrorSignature.facts', selectors)
 
         if os.path.isdir(COMMON_FACTS_DIR):
             try:
@@ -0,0 +1,196 @@
+"""inputs.py: streaming contracts out of JSONL, CSV and tar corpora, instead of one .hex file per contract"""
+
+import csv
+import gzip
+import hashlib
+import json
+import os
+import sys
+import tarfile
+
+from dataclasses import dataclass
+from os.path import join
+from typing import Any, Iterable, Iterator, TextIO
+
+CORPUS_SUFFIXES = ('.jsonl', '.jsonl.gz', '.csv', '.csv.gz', '.tar', '.tar.gz', '.tgz')
+"""Inputs with these suffixes are read as corpora of many contracts"""
+
+NAME_FIELDS = ('address', 'name', 'contract_address')
+"""Fields of a JSONL object or CSV row naming the contract, the first one present is used"""
+
+BYTECODE_FIELDS = ('bytecode', 'code', 'runtime_bytecode')
+"""Fields of a JSONL object or CSV row holding the bytecode, the first one present is used"""
+
+METADATA_FIELD = '_metadata'
+"""Optional field with the solc metadata of the contract (a JSON object, or a JSON string in CSV)"""
+
+METADATA_SUFFIX = '_metadata.json'
+
+SPOOL_DIR = '.spool'
+"""Directory, under the working directory, holding the contracts being analyzed"""
+
+
+@dataclass
+class StreamedContract:
+    name: str
+    bytecode: str
+    metadata: dict[str, Any] | None = None
+
+
+def is_corpus(path: str) -> bool:
+    return os.path.isfile(path) and path.endswith(CORPUS_SUFFIXES)
+
+
+def first_field(record: dict[str, Any], fields: tuple[str, ...]) -> Any:
+    for field in fields:
+        if record.get(field):
+            return record[field]
+    return None
+
+
+def record_to_contract(record: dict[str, Any]) -> StreamedContract | None:
+    name = first_field(record, NAME_FIELDS)
+    bytecode = first_field(record, BYTECODE_FIELDS)
+    if name is None or bytecode is None:
+        return None
+
+    metadata = record.get(METADATA_FIELD) or None
+    if isinstance(metadata, str):
+        metadata = json.loads(metadata)
+    return StreamedContract(str(name).replace(os.sep, '_'), bytecode.strip(), metadata)
+
+
+def open_text(path: str) -> TextIO:
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', newline='')
+    return open(path, newline='')
+
+
+def parse_jsonl(lines: Iterable[str]) -> Iterator[StreamedContract]:
+    for line in lines:
+        if not line.strip():
+            continue
+        contract = record_to_contract(json.loads(line))
+        if contract is not None:
+            yield contract
+
+
+def iter_jsonl(path: str) -> Iterator[StreamedContract]:
+    with open_text(path) as f:
+        yield from parse_jsonl(f)
+
+
+def iter_csv(path: str) -> Iterator[StreamedContract]:
+    # creation bytecode can be larger than the default field limit
+    csv.field_size_limit(sys.maxsize)
+    with open_text(path) as f:
+        for record in csv.DictReader(f):
+            contract = record_to_contract(record)
+            if contract is not None:
+                yield contract
+
+
+def iter_tar(path: str) -> Iterator[StreamedContract]:
+    """
+    Streams the `<name>.hex` members of a (possibly compressed) tar archive.
+    A `<name>_metadata.json` member is attached to its contract if it is right before or right after it.
+    """
+    pending: StreamedContract | None = None
+    metadata: dict[str, dict[str, Any]] = {}
+    with tarfile.open(path, mode='r|*') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            member_name = os.path.basename(member.name)
+            f = tar.extractfile(member)
+            assert f is not None
+            content = f.read().decode()
+
+            if member_name.endswith(METADATA_SUFFIX):
+                name = member_name[:-len(METADATA_SUFFIX)]
+                if pending is not None and pending.name == name:
+                    pending.metadata = json.loads(content)
+                else:
+                    metadata = {name: json.loads(content)}
+                continue
+
+            if not member_name.endswith('.hex'):
+                continue
+
+            if pending is not None:
+                yield pending
+            name = member_name[:-len('.hex')]
+            pending = StreamedContract(name, content.strip(), metadata.pop(name, None))
+            metadata = {}
+
+    if pending is not None:
+        yield pending
+
+
+def iter_corpus(path: str) -> Iterator[StreamedContract]:
+    if path.endswith(('.jsonl', '.jsonl.gz')):
+        return iter_jsonl(path)
+    if path.endswith(('.csv', '.csv.gz')):
+        return iter_csv(path)
+    return iter_tar(path)
+
+
+def discover_contracts(filepaths: list[str]) -> Iterator[str | StreamedContract]:
+    """
+    Lazily yields the contracts of the given inputs: files as they are, the entries of directories as they are scanned,
+    and the contracts streamed out of corpora.
+    """
+    for filepath in filepaths:
+        if is_corpus(filepath):
+            yield from iter_corpus(filepath)
+        elif os.path.isdir(filepath):
+            with os.scandir(filepath) as entries:
+                for entry in entries:
+                    yield join(filepath, entry.name)
+        else:
+            yield filepath
+
+
+def contract_shard(contract_filename: str, num_shards: int) -> int:
+    """The shard a contract belongs to, from the md5 of its name, so it doesn't depend on where the contract is read from"""
+    digest = hashlib.md5(os.path.split(contract_filename)[1].encode()).digest()
+    return int.from_bytes(digest[:8], 'big') % num_shards
+
+
+class ContractSpool:
+    """
+    Writes streamed contracts to `.hex` files (and `_metadata.json` files) only when they are about to be analyzed,
+    as the rest of the pipeline works on files, and removes them once they are no longer needed.
+    """
+
+    def __init__(self, working_dir: str):
+        self.spool_dir = join(os.path.abspath(working_dir), SPOOL_DIR)
+
+    def filename(self, contract: str | StreamedContract) -> str:
+        """The filename of a contract, where it is (or will be) written for streamed contracts"""
+        if isinstance(contract, str):
+            return contract
+        return join(self.spool_dir, contract.name + '.hex')
+
+    def materialize(self, contract: str | StreamedContract) -> str:
+        """Writes a streamed contract to the spool, returning its filename"""
+        if isinstance(contract, str):
+            return contract
+        os.makedirs(self.spool_dir, exist_ok=True)
+        contract_filename = self.filename(contract)
+        with open(contract_filename, 'w') as f:
+            f.write(contract.bytecode)
+        if contract.metadata is not None:
+            with open(join(self.spool_dir, contract.name + METADATA_SUFFIX), 'w') as f:
+                json.dump(contract.metadata, f)
+        return contract_filename
+
+    def release(self, contract_filename: str) -> None:
+        """Removes a spooled contract, does nothing for contracts that weren't streamed"""
+        if os.path.dirname(contract_filename) != self.spool_dir:
+            return
+        for filename in [contract_filename, contract_filename[:-len('.hex')] + METADATA_SUFFIX]:
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,75 @@
+"""ledger.py: durable record of the contracts a batch analysis has finished, used to resume interrupted runs"""
+
+import json
+import os
+import sqlite3
+
+from contextlib import contextmanager
+from os.path import join
+from typing import Any, Iterator
+
+LEDGER_FILE = '.ledger.sqlite'
+"""Name of the ledger, kept in the working directory"""
+
+LEGACY_STATUS = 'LEGACY'
+"""Status of the contract directories found when the ledger was created, if adopted as finished without a known result"""
+
+
+def ledger_key(contract_name: str) -> str:
+    """The name of the contract's working directory, which identifies it in the ledger"""
+    return os.path.split(contract_name)[1].split('.')[0]
+
+
+class CompletionLedger:
+    """
+    Finished contracts, with their status and result row, keyed by the name of their working directory.
+    A contract is only recorded once its result is produced, so a contract whose working directory exists
+    but isn't in the ledger was interrupted and has to be analyzed again.
+
+    The ledger is written by the result-flushing process of each instance using the working directory, and can be read at the same time.
+    No connection is kept open between operations, so none is inherited by the analysis processes forked in between.
+    """
+
+    def __init__(self, working_dir: str, adopt_legacy: bool = False):
+        os.makedirs(working_dir, exist_ok=True)
+        self.ledger_file = join(working_dir, LEDGER_FILE)
+        created = not os.path.exists(self.ledger_file)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS finished (name TEXT PRIMARY KEY, status TEXT NOT NULL, result TEXT)')
+
+            # Working directories of runs predating the ledger only have contract directories to go by, which can't tell
+            # finished contracts from interrupted ones: unless adopted as finished, they are analyzed again
+            self.legacy_entries = 0
+            if created:
+                legacy_dirs = [entry.name for entry in os.scandir(working_dir) if entry.is_dir() and not entry.name.startswith('.')]
+                if adopt_legacy:
+                    conn.executemany('INSERT OR IGNORE INTO finished (name, status) VALUES (?, ?)', [(d, LEGACY_STATUS) for d in legacy_dirs])
+                self.legacy_entries = len(legacy_dirs)
+            conn.commit()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.ledger_file, timeout=60)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def record(self, results: list[tuple[str, list[str], list[str], dict[str, Any]]]) -> None:
+        """Records the result rows of finished contracts, replacing earlier ones"""
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO finished (name, status, result) VALUES (?, ?, ?)',
+                [(ledger_key(name), meta[0] if meta else 'OK', json.dumps([name, files, meta, analytics])) for name, files, meta, analytics in results]
+            )
+            conn.commit()
+
+    def lookup(self, contract_name: str) -> tuple[bool, list[Any] | None]:
+        """Whether the contract has finished, and its result row if it is known"""
+        with self._connect() as conn:
+            row = conn.execute('SELECT result FROM finished WHERE name = ?', (ledger_key(contract_name),)).fetchone()
+        if row is None:
+            return False, None
+        return True, json.loads(row[0]) if row[0] is not None else None
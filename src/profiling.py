@@ -0,0 +1,225 @@
+"""profiling.py: parsing the profile logs of souffle programs run with --profile, and hot-spot reports over them"""
+
+import json
+import os
+
+from dataclasses import dataclass, field
+from os.path import join
+from typing import Any, Iterable, Iterator
+
+from .common import log
+
+PROFILE_SUFFIX = '.prof'
+"""Suffix of the profile log of a client, written next to its `.err` file"""
+
+PROFILE_EXECUTABLE_SUFFIX = '_profile'
+"""Suffix of the executables compiled with profiling enabled, so they don't replace the regular ones"""
+
+
+@dataclass
+class RelationProfile:
+    tuples: int = 0
+    runtime: float = 0.0
+    """Seconds spent evaluating the relation, over all its rules and iterations"""
+    iterations: int = 0
+
+
+@dataclass
+class RuleProfile:
+    tuples: int = 0
+    runtime: float = 0.0
+
+
+@dataclass
+class ProgramProfile:
+    """The profile of a single run of a souffle program"""
+    program: str
+    relations: dict[str, RelationProfile] = field(default_factory=dict)
+    rules: dict[tuple[str, str], RuleProfile] = field(default_factory=dict)
+    """Keyed by (relation, rule), the versions of recursive rules are summed"""
+
+
+def _runtime(entry: dict[str, Any]) -> float:
+    """Runtime of a profile entry in seconds, souffle records start and end times in microseconds"""
+    runtime = entry.get('runtime')
+    if isinstance(runtime, dict):
+        return max(runtime.get('end', 0) - runtime.get('start', 0), 0) / 1_000_000
+    if isinstance(runtime, (int, float)):
+        return runtime / 1_000_000
+    return 0.0
+
+
+def _tuples(entry: dict[str, Any]) -> int:
+    tuples = entry.get('num-tuples', 0)
+    return tuples if isinstance(tuples, int) else 0
+
+
+def _rule_entries(rules: dict[str, Any]) -> Iterator[tuple[str, dict[str, Any]]]:
+    """
+    The (rule, entry) pairs of a rules directory. Recursive rules have an entry per version,
+    nested under the rule, which are yielded separately under the name of the rule.
+    """
+    for rule, entry in rules.items():
+        if not isinstance(entry, dict):
+            continue
+        if 'runtime' in entry or 'num-tuples' in entry:
+            yield rule, entry
+        else:
+            for version in entry.values():
+                if isinstance(version, dict):
+                    yield rule, version
+
+
+def _iterations(relation: dict[str, Any]) -> list[dict[str, Any]]:
+    iterations = relation.get('iteration', [])
+    if isinstance(iterations, dict):
+        iterations = list(iterations.values())
+    return [it for it in iterations if isinstance(it, dict)]
+
+
+def parse_profile(profile: dict[str, Any], program: str) -> ProgramProfile:
+    """Extracts the relation and rule statistics out of a souffle profile log"""
+    result = ProgramProfile(program)
+    relations = profile.get('root', profile).get('program', {}).get('relation', {})
+
+    for name, relation in relations.items():
+        if not isinstance(relation, dict):
+            continue
+        rel = result.relations[name] = RelationProfile()
+        rel.tuples = _tuples(relation)
+        rules_runtime = 0.0
+
+        def add_rules(rules: dict[str, Any]) -> None:
+            nonlocal rules_runtime
+            for rule, entry in _rule_entries(rules):
+                rule_profile = result.rules.setdefault((name, rule), RuleProfile())
+                rule_profile.tuples += _tuples(entry)
+                rule_profile.runtime += _runtime(entry)
+                rules_runtime += _runtime(entry)
+
+        add_rules(relation.get('non-recursive-rule', {}))
+        iterations = _iterations(relation)
+        rel.iterations = len(iterations)
+        for iteration in iterations:
+            add_rules(iteration.get('recursive-rule', {}))
+            # recursive relations get their tuples over their iterations
+            if not rel.tuples:
+                rel.tuples += _tuples(iteration)
+
+        rel.runtime = _runtime(relation) or rules_runtime
+
+    return result
+
+
+def load_profile(profile_file: str) -> ProgramProfile | None:
+    """Loads the profile log of a client, None if it is missing or incomplete (e.g. the client was killed)"""
+    program = os.path.basename(profile_file)[:-len(PROFILE_SUFFIX)]
+    try:
+        with open(profile_file) as f:
+            return parse_profile(json.load(f), program)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def contract_profiles(out_dir: str) -> list[ProgramProfile]:
+    """The profiles of the clients run on a contract"""
+    profiles = []
+    for entry in sorted(os.scandir(out_dir), key=lambda e: e.name) if os.path.isdir(out_dir) else []:
+        if entry.name.endswith(PROFILE_SUFFIX) and (profile := load_profile(entry.path)) is not None:
+            profiles.append(profile)
+    return profiles
+
+
+@dataclass
+class HotSpot:
+    """A relation or rule, aggregated over the contracts it was profiled in"""
+    contracts: int = 0
+    runtime: float = 0.0
+    max_runtime: float = 0.0
+    tuples: int = 0
+    max_tuples: int = 0
+    worst_contract: str = ''
+    """The contract it took the most time in"""
+
+    def add(self, contract: str, runtime: float, tuples: int) -> None:
+        self.contracts += 1
+        self.runtime += runtime
+        self.tuples += tuples
+        self.max_tuples = max(self.max_tuples, tuples)
+        if runtime >= self.max_runtime:
+            self.max_runtime = runtime
+            self.worst_contract = contract
+
+
+@dataclass
+class ProfileReport:
+    """Relations and rules of every program, aggregated over the contracts of a batch"""
+    contracts: int = 0
+    relations: dict[tuple[str, str], HotSpot] = field(default_factory=dict)
+    """Keyed by (program, relation)"""
+    rules: dict[tuple[str, str, str], HotSpot] = field(default_factory=dict)
+    """Keyed by (program, relation, rule)"""
+
+    def add(self, contract: str, profiles: Iterable[ProgramProfile]) -> None:
+        self.contracts += 1
+        for profile in profiles:
+            for name, rel in profile.relations.items():
+                self.relations.setdefault((profile.program, name), HotSpot()).add(contract, rel.runtime, rel.tuples)
+            for (name, rule), rule_profile in profile.rules.items():
+                self.rules.setdefault((profile.program, name, rule), HotSpot()).add(contract, rule_profile.runtime, rule_profile.tuples)
+
+    def log(self, top: int = 20) -> None:
+        if not self.relations:
+            return
+        log('-'*80)
+        log(f'Profile hot spots ({self.contracts} contracts)')
+        log('-'*80)
+
+        log('  Relations by total runtime:')
+        for (program, name), spot in sorted(self.relations.items(), key=lambda kv: -kv[1].runtime)[:top]:
+            log(f"    {spot.runtime:10.2f}s  {program}: {name} (max {spot.max_runtime:.2f}s in {spot.worst_contract}, "
+                f"max {spot.max_tuples} tuples, {spot.contracts} contracts)")
+
+        log('  Relations by largest size:')
+        for (program, name), spot in sorted(self.relations.items(), key=lambda kv: -kv[1].max_tuples)[:top]:
+            log(f"    {spot.max_tuples:12}  {program}: {name} ({spot.tuples} tuples in total)")
+
+        log('  Rules by total runtime:')
+        for (program, name, rule), spot in sorted(self.rules.items(), key=lambda kv: -kv[1].runtime)[:top]:
+            log(f"    {spot.runtime:10.2f}s  {program}: {name} (max {spot.max_runtime:.2f}s in {spot.worst_contract})")
+            log(f"                 {' '.join(rule.split())[:200]}")
+        log('\n')
+
+
+def collect_profiles(working_dir: str) -> ProfileReport:
+    """Aggregates the profiles of the contracts analyzed in a working directory"""
+    report = ProfileReport()
+    for entry in sorted(os.scandir(working_dir), key=lambda e: e.name):
+        if not entry.is_dir() or entry.name.startswith('.'):
+            continue
+        profiles = contract_profiles(join(entry.path, 'out'))
+        if profiles:
+            report.add(entry.name, profiles)
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    import logging
+
+    parser = argparse.ArgumentParser(description="Reports the relations and rules taking the most time, "
+                                                 "from the profiles of a gigahorse.py run with --profile.")
+    parser.add_argument("working_dir", metavar="DIR",
+                        help="The working directory of the run, or the working directory of a single contract.")
+    parser.add_argument("-n", "--top", type=int, default=20, metavar="NUM",
+                        help="The number of relations and rules listed in each ranking (default: 20).")
+
+    args = parser.parse_args()
+    logging.basicConfig(format='%(message)s', level=logging.INFO + 1)
+
+    if os.path.isdir(join(args.working_dir, 'out')):
+        report = ProfileReport()
+        report.add(os.path.basename(os.path.normpath(args.working_dir)), contract_profiles(join(args.working_dir, 'out')))
+    else:
+        report = collect_profiles(args.working_dir)
+    report.log(args.top)
@@ -0,0 +1,210 @@
+"""results.py: summaries of the results of batch analyses, shared by gigahorse.py and the tooling merging results files"""
+
+import gzip
+import json
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Iterator
+
+from .common import log
+
+
+RESULTS_FORMATS = ['json', 'columnar']
+
+COLUMNAR_FORMAT = 'gigahorse-columnar'
+COLUMNAR_VERSION = 1
+
+COLUMNAR_CHUNK_ROWS = 10_000
+"""Contracts per chunk of a columnar results file, which is the unit it is read in"""
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class StringTable:
+    """Dictionary encoding of the strings of a columnar results file, each chunk introducing the strings it uses for the first time"""
+
+    def __init__(self) -> None:
+        self.ids: dict[str, int] = {}
+        self.new_strings: list[str] = []
+
+    def encode(self, string: str) -> int:
+        string_id = self.ids.get(string)
+        if string_id is None:
+            string_id = self.ids[string] = len(self.ids)
+            self.new_strings.append(string)
+        return string_id
+
+    def take_new_strings(self) -> list[str]:
+        new_strings, self.new_strings = self.new_strings, []
+        return new_strings
+
+
+def encode_chunk(rows: list, strings: StringTable) -> dict[str, Any]:
+    """
+    A chunk of results: the names, output relations and meta of its contracts as string ids,
+    and one column per analytic, holding its values and, unless every contract has it, the rows they belong to
+    """
+    column_rows: defaultdict[int, list[int]] = defaultdict(list)
+    column_values: defaultdict[int, list[Any]] = defaultdict(list)
+    names, files, meta = [], [], []
+    for i, (name, row_files, row_meta, analytics) in enumerate(rows):
+        names.append(strings.encode(name))
+        files.append([strings.encode(f) for f in row_files])
+        meta.append([strings.encode(m) for m in row_meta])
+        for key, value in analytics.items():
+            key_id = strings.encode(key)
+            column_rows[key_id].append(i)
+            column_values[key_id].append(value)
+
+    columns = {
+        str(key_id): [None if len(column_rows[key_id]) == len(rows) else column_rows[key_id], values]
+        for key_id, values in column_values.items()
+    }
+    return {'strings': strings.take_new_strings(), 'names': names, 'files': files, 'meta': meta, 'columns': columns}
+
+
+def write_columnar_results(res_list: Any, results_file: str) -> None:
+    """Writes results as a gzipped stream of JSON lines: a header, followed by chunks of up to COLUMNAR_CHUNK_ROWS contracts"""
+    strings = StringTable()
+    with gzip.open(results_file, 'wt') as f:
+        f.write(json.dumps({'format': COLUMNAR_FORMAT, 'version': COLUMNAR_VERSION}) + '\n')
+        for start in range(0, len(res_list), COLUMNAR_CHUNK_ROWS):
+            f.write(json.dumps(encode_chunk(res_list[start : start + COLUMNAR_CHUNK_ROWS], strings), separators=(',', ':')) + '\n')
+
+
+def write_results_file(res_list: Any, results_file: str, results_format: str = 'json') -> None:
+    if results_format == 'columnar':
+        write_columnar_results(res_list, results_file)
+    else:
+        with open(results_file, 'w') as f:
+            f.write(json.dumps(list(res_list), indent=1))
+
+
+def iter_columnar_results(results_file: str, analytics_keys: set[str] | None = None) -> Iterator[list[Any]]:
+    """Streams the results of a columnar results file, one chunk at a time, decoding only the given analytics if any are given"""
+    strings: list[str] = []
+    with gzip.open(results_file, 'rt') as f:
+        header = json.loads(f.readline())
+        if header.get('format') != COLUMNAR_FORMAT or header.get('version') != COLUMNAR_VERSION:
+            raise ValueError(f"{results_file} is not a supported columnar results file")
+        for line in f:
+            chunk = json.loads(line)
+            strings.extend(chunk['strings'])
+            rows = [[strings[name], [strings[i] for i in files], [strings[i] for i in meta], {}]
+                    for name, files, meta in zip(chunk['names'], chunk['files'], chunk['meta'])]
+            for key_id, (column_rows, values) in chunk['columns'].items():
+                key = strings[int(key_id)]
+                if analytics_keys is not None and key not in analytics_keys:
+                    continue
+                for i, value in zip(column_rows if column_rows is not None else range(len(rows)), values):
+                    rows[i][3][key] = value
+            yield from rows
+
+
+def iter_results(results_file: str, analytics_keys: set[str] | None = None) -> Iterator[list[Any]]:
+    """
+    The [name, files, meta, analytics] results of a results file, in either format.
+    Columnar files are streamed; if analytics_keys is given, only those analytics are decoded.
+    """
+    with open(results_file, 'rb') as f:
+        is_columnar = f.read(2) == GZIP_MAGIC
+    if is_columnar:
+        yield from iter_columnar_results(results_file, analytics_keys)
+        return
+    with open(results_file) as f:
+        res_list = json.load(f)
+    for name, files, meta, analytics in res_list:
+        if analytics_keys is not None:
+            analytics = {k: v for k, v in analytics.items() if k in analytics_keys}
+        yield [name, files, meta, analytics]
+
+
+@dataclass
+class ResultsSummary:
+    total: int = 0
+    analytics_sums: defaultdict[str, int] = field(default_factory=lambda: defaultdict(int))
+    vulnerability_counts: defaultdict[str, int] = field(default_factory=lambda: defaultdict(int))
+    meta_counts: defaultdict[str, int] = field(default_factory=lambda: defaultdict(int))
+
+
+def summarize(res_list: Any) -> ResultsSummary:
+    """Sums the int analytics and counts the flagged contracts and the timeouts and errors of a list of results"""
+    summary = ResultsSummary(total=len(res_list))
+    for _, _, meta, analytics in res_list:
+        for m in meta:
+            summary.meta_counts[m] += 1
+        for k, a in analytics.items():
+            if ':' in k: # tell-tale sign for vulnerability key
+                summary.vulnerability_counts[k] += 1
+            if isinstance(a, int):
+                summary.analytics_sums[k] += a
+    return summary
+
+
+def percentile(sorted_values: list, p: float) -> Any:
+    """Nearest-rank percentile of an already sorted, non-empty list"""
+    return sorted_values[max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values))) - 1))]
+
+
+def log_resource_usage(res_list: Any) -> None:
+    """
+    Logs percentiles of the peak memory and cpu time of every stage and client,
+    using the `resource_usage` analytics of each contract
+    """
+    samples: defaultdict[str, dict[str, list]] = defaultdict(lambda: {'max_rss': [], 'cpu_time': []})
+    for _, _, _, analytics in res_list:
+        resource_usage = analytics.get('resource_usage', {})
+        for group, prefix in [('stages', 'stage'), ('clients', 'client')]:
+            for name, usage in resource_usage.get(group, {}).items():
+                samples[f'{prefix} {name}']['max_rss'].append(usage['max_rss'])
+                samples[f'{prefix} {name}']['cpu_time'].append(usage['user_time'] + usage['sys_time'])
+
+    if not samples:
+        return
+
+    log('-'*80)
+    log('Resource usage (p50 / p90 / p99 / max)')
+    log('-'*80)
+    for name, values in sorted(samples.items()):
+        rss = sorted(values['max_rss'])
+        cpu = sorted(values['cpu_time'])
+        log("  {} ({} contracts):".format(name, len(rss)))
+        log("    peak RSS (MB): {}".format(' / '.join(f'{percentile(rss, p) / 1_000_000:.1f}' for p in [50, 90, 99, 100])))
+        log("    cpu time (s):  {}".format(' / '.join(f'{percentile(cpu, p):.2f}' for p in [50, 90, 99, 100])))
+    log('\n')
+
+
+def log_summary(res_list: Any) -> None:
+    """Logs the analytics sums, the percentage of flagged contracts, the timeouts and errors, and the resource usage"""
+    summary = summarize(res_list)
+    total = summary.total
+
+    analytics_sums_sorted = sorted(list(summary.analytics_sums.items()), key = lambda a: a[0])
+    if analytics_sums_sorted:
+        log('\n')
+        log('-'*80)
+        log('Analytics')
+        log('-'*80)
+        for res, sums in analytics_sums_sorted:
+            log("  {}: {}".format(res, sums))
+        log('\n')
+
+    vulnerability_counts_sorted = sorted(list(summary.vulnerability_counts.items()), key = lambda a: a[0])
+    if vulnerability_counts_sorted:
+        log('-'*80)
+        log('Summary (flagged contracts)')
+        log('-'*80)
+
+        for res, count in vulnerability_counts_sorted:
+            log("  {}: {:.2f}%".format(res, 100 * count / total))
+
+    if summary.meta_counts:
+        log('-'*80)
+        log('Timeouts and Errors')
+        log('-'*80)
+        for k, v in summary.meta_counts.items():
+            log(f"  {k}: {v} of {total} contracts")
+        log('\n')
+
+    log_resource_usage(res_list)
@@ -8,10 +8,14 @@ import time
 import shutil
 import json
 import re
+import signal
+import threading
 
-from typing import Any
+from typing import Any, Iterable, Iterator
 from enum import Enum
-from itertools import groupby
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
+from dataclasses import dataclass
+from collections import defaultdict
 
 from abc import ABC, abstractmethod
 from pathlib import Path
@@ -19,18 +23,68 @@ from pathlib import Path
 from .common import GIGAHORSE_DIR, SOUFFLE_COMPILED_SUFFIX, log, log_debug
 from . import exporter
 from . import blockparse
-from .tac_schema import TACRelations
+from .tac_schema import StitchMap, StitchMember, stitch_dirs
+from .signatures import SignatureIndex, open_signature_indexes
+from .profiling import PROFILE_SUFFIX, PROFILE_EXECUTABLE_SUFFIX
+from .blowup import BlowupDetector, ProcessMonitor
+from .context_depth import ContextDepthHistory, bytecode_hash
 
 devnull = subprocess.DEVNULL
 
+manifest_lock = threading.Lock()
+
 DEFAULT_MEMORY_LIMIT = 50 * 1_000_000_000
 """Hard capped memory limit for analyses processes (50 GB)"""
 
+MONITOR_INTERVAL = 1.0
+"""Seconds between the checks of a process' monitor, see `run_process`"""
+
 MAX_CONTEXT_DEPTH_INPUT_FILE = "MaxContextDepth.csv"
 MAIN_DECOMPILER_MAX_CONTEXT_DEPTH = 20
 FALLBACK_SCALABLE_MAX_CONTEXT_DEPTH = 10
 LAST_RESORT_MAX_CONTEXT_DEPTH = 10
 
+
+@dataclass
+class LimitsizeTier:
+    """The limitsize caps of the main decompiler for contracts with up to `max_blocks` basic blocks, see `--adaptive_limitsize`"""
+    name: str
+    max_blocks: int | None
+    block_output_contents: int
+    big_block_output_contents: int
+    can_reach_under_context: int
+
+    def souffle_macros(self) -> str:
+        return (f"ENABLE_LIMITSIZE= LIMITSIZE_BLOCK_OUTPUT_CONTENTS={self.block_output_contents} "
+                f"LIMITSIZE_BIG_BLOCK_OUTPUT_CONTENTS={self.big_block_output_contents} "
+                f"LIMITSIZE_CAN_REACH_UNDER_CONTEXT={self.can_reach_under_context}")
+
+LIMITSIZE_TIERS = [
+    # the defaults of logic/global_components.dl and logic/functions.dl, which rarely hold back contracts of this size
+    LimitsizeTier('default', 4000, 1_000_000, 2_000_000, 25_000_000),
+    LimitsizeTier('large', 12000, 500_000, 1_000_000, 12_500_000),
+    LimitsizeTier('huge', None, 250_000, 500_000, 6_250_000),
+]
+"""
+Each tier is compiled to its own executable, caps can't be given to a compiled program at runtime.
+The caps shrink as contracts grow, so the largest contracts stop blowing up earlier, leaving time for their fallback configurations.
+"""
+
+
+def select_limitsize_tier(num_blocks: int) -> LimitsizeTier:
+    return next(tier for tier in LIMITSIZE_TIERS if tier.max_blocks is None or num_blocks <= tier.max_blocks)
+
+CLIENT_MANIFEST_FILE = "client_manifest.json"
+"""Records the fingerprints of the client runs of a contract, stored in its working dir"""
+
+RELATION_SIZES_SUFFIX = ".sizes"
+"""Suffix of the file keeping the stdout of a decompiler program, where `.printsize` directives (see `logic/telemetry.dl`) print"""
+
+NO_TELEMETRY_MACRO = "NO_TELEMETRY"
+
+IO_DIRECTIVE_PATTERN = re.compile(r'^\s*\.(input|output)\s+([\w.]+(?:\s*,\s*[\w.]+)*)\s*(?:\((.*)\))?', re.MULTILINE)
+DIRECTIVE_PARAMETER_PATTERN = re.compile(r'(\w+)\s*=\s*("(?:[^"\\]|\\.)*"|[^,\s)]+)')
+
 FACT_GEN_HIGH_PRIORITY = 1
 FACT_GEN_LOW_PRIORITY = 2
 
@@ -60,14 +114,82 @@ class DecompilationException(Exception):
     """
     pass
 
-def set_memory_limit(memory_limit: int):
-    resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+@dataclass
+class ProcessUsage:
+    """Resource usage of a single child process, as reported by `wait4`."""
+    wall_time: float
+    max_rss: int
+    """Peak resident set size, in bytes"""
+    user_time: float
+    sys_time: float
+    read_bytes: int
+    write_bytes: int
+    signal: int = 0
+    """Number of the signal that terminated the process, 0 if it exited normally"""
+    timed_out: bool = False
+    aborted: str | None = None
+    """Why the process was killed by its monitor before its timeout, if it was"""
+
+
+def aggregate_usage(usages: list[ProcessUsage]) -> dict[str, Any]:
+    """Combines the usage of several processes: peak memory is maxed, times and I/O are summed"""
+    return {
+        'processes': len(usages),
+        'max_rss': max((u.max_rss for u in usages), default=0),
+        'user_time': sum(u.user_time for u in usages),
+        'sys_time': sum(u.sys_time for u in usages),
+        'read_bytes': sum(u.read_bytes for u in usages),
+        'write_bytes': sum(u.write_bytes for u in usages),
+        'signals': sorted({u.signal for u in usages if u.signal})
+    }
+
+def set_memory_limit(pid: int, memory_limit: int) -> None:
+    """
+    Limits the address space of a running process. This is done from the parent, right after spawning the process,
+    rather than in a `preexec_fn`, which isn't safe when processes are spawned from many threads (e.g. with --client_jobs).
+    """
+    try:
+        resource.prlimit(pid, resource.RLIMIT_AS, (memory_limit, memory_limit))
+    except ProcessLookupError:
+        # it already exited
+        pass
 
-def get_souffle_executable_path(cache_dir: str, dl_filename: str) -> str:
-    executable_filename = os.path.basename(dl_filename) + SOUFFLE_COMPILED_SUFFIX
+def get_souffle_executable_path(cache_dir: str, dl_filename: str, profile: bool = False, variant: str | None = None) -> str:
+    """The compiled program, `variant` naming a build of the program with different macros (e.g. a limitsize tier)"""
+    executable_filename = os.path.basename(dl_filename) + (f'.{variant}' if variant else '') + SOUFFLE_COMPILED_SUFFIX
+    if profile:
+        executable_filename += PROFILE_EXECUTABLE_SUFFIX
     executable_path = join(cache_dir, executable_filename)
     return executable_path
 
+def get_souffle_io_path(cache_dir: str, dl_filename: str, profile: bool = False, variant: str | None = None) -> str:
+    """File describing the compiled program: the hash of the binary and the files it reads and writes"""
+    return get_souffle_executable_path(cache_dir, dl_filename, profile, variant) + '.io.json'
+
+def file_md5(filename: str) -> str:
+    hasher = hashlib.md5()
+    with open(filename, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def parse_io_directives(program: str) -> tuple[list[str], list[str]]:
+    """
+    Extracts the files read and written by a preprocessed souffle program from its `.input` and `.output` directives.
+    Only file I/O is considered, using the souffle default filenames when none is given.
+    """
+    inputs, outputs = set(), set()
+    for kind, relations, parameters in IO_DIRECTIVE_PATTERN.findall(program):
+        params = {k: v.strip('"') for k, v in DIRECTIVE_PARAMETER_PATTERN.findall(parameters)}
+        if params.get('IO', 'file') != 'file':
+            continue
+        for relation in (r.strip() for r in relations.split(',')):
+            if kind == 'input':
+                inputs.add(params.get('filename', f'{relation}.facts'))
+            else:
+                outputs.add(params.get('filename', f'{relation}.csv'))
+    return sorted(inputs), sorted(outputs)
+
 def test_souffle(souffle_bin: str):
     souffle_process = subprocess.run([souffle_bin, "--version"], universal_newlines=True, capture_output=True)
     assert not(souffle_process.returncode), "Souffle binary not found at {souffle_bin}. Stopping."
@@ -83,6 +205,59 @@ class AnalysisExecutor:
         self.souffle_bin = souffle_bin
         self.cache_dir = cache_dir
         self.souffle_macros = souffle_macros
+        self.telemetry = not any(macro_def.split('=')[0] == NO_TELEMETRY_MACRO for macro_def in souffle_macros.split())
+        """Whether the decompiler programs print relation sizes, unless NO_TELEMETRY is defined"""
+        self.souffle_threads = 1
+        """Number of threads each souffle program runs with"""
+        self.client_jobs = 1
+        """Number of independent clients `run_clients` can run at once"""
+        self.stage = "client"
+        """The pipeline stage the processes started next belong to, used to group their resource usage"""
+        self.process_usage: list[tuple[str, str, ProcessUsage]] = []
+        self.reuse_client_outputs = False
+        """Skip clients whose binary and inputs match the fingerprint of their previous run, see `run_clients`"""
+        self.profile = False
+        """Run souffle programs with profiling, writing their profile log next to their `.err` file"""
+        self.reused_clients: list[str] = []
+        self.fallback_reasons: list[str] = []
+        """Why each fallback decompiler configuration used for the current contract was needed"""
+        self.limitsize_tier: str | None = None
+        """The limitsize tier selected for the current contract, if limitsize is adaptive"""
+        self.decompiler_analytics: dict[str, Any] = {}
+        """Analytics of the current contract recorded while decompiling it"""
+        self._client_io: dict[str, dict[str, Any] | None] = {}
+        self._file_hashes: dict[tuple[str, int, int], str] = {}
+
+    def reset_statistics(self) -> None:
+        self.stage = "client"
+        self.process_usage = []
+        self.reused_clients = []
+        self.fallback_reasons = []
+        self.limitsize_tier = None
+        self.decompiler_analytics = {}
+
+    def record_usage(self, client_name: str, usage: ProcessUsage) -> None:
+        self.process_usage.append((self.stage, client_name, usage))
+
+    def killed_clients(self) -> list[str]:
+        """Clients killed by a SIGKILL not sent by us on timeout, typically by the kernel OOM killer"""
+        return [client_name for _, client_name, usage in self.process_usage if usage.signal == signal.SIGKILL and not usage.timed_out and usage.aborted is None]
+
+    def last_usage(self, client_name: str) -> ProcessUsage | None:
+        """The resource usage of the latest run of a client"""
+        return next((usage for _, name, usage in reversed(self.process_usage) if name == client_name), None)
+
+    def resource_analytics(self) -> dict[str, Any]:
+        """Resource usage of the processes run so far, aggregated per stage and per client"""
+        by_stage: dict[str, list[ProcessUsage]] = {}
+        by_client: dict[str, list[ProcessUsage]] = {}
+        for stage, client_name, usage in self.process_usage:
+            by_stage.setdefault(stage, []).append(usage)
+            by_client.setdefault(client_name, []).append(usage)
+        return {
+            'stages': {stage: aggregate_usage(usages) for stage, usages in by_stage.items()},
+            'clients': {client_name: aggregate_usage(usages) for client_name, usages in by_client.items()}
+        }
 
     def calc_timeout(self, start_time: float, half: bool = False) -> float:
             timeout_left = self.timeout - time.time() + start_time
@@ -91,14 +266,68 @@ class AnalysisExecutor:
 
             return max(timeout_left, self.minimum_client_time)
 
-    def run_souffle_client(self, souffle_client: str, in_dir: str, out_dir: str, start_time: float, half: bool) -> tuple[list[str], list[str]]:
-        errors = []
-        timeouts = []
+    def client_io(self, souffle_client: str) -> dict[str, Any] | None:
+        """The description of a compiled client written by `compile_datalog`, None if not available"""
+        if self.interpreted:
+            return None
+        if souffle_client not in self._client_io:
+            try:
+                with open(get_souffle_io_path(self.cache_dir, souffle_client, self.profile)) as f:
+                    self._client_io[souffle_client] = json.load(f)
+            except (OSError, ValueError):
+                self._client_io[souffle_client] = None
+        return self._client_io[souffle_client]
+
+    def file_hash(self, filename: str) -> str | None:
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        key = (filename, stat.st_mtime_ns, stat.st_size)
+        if key not in self._file_hashes:
+            self._file_hashes[key] = file_md5(filename)
+        return self._file_hashes[key]
+
+    def client_fingerprint(self, souffle_client: str, in_dir: str) -> dict[str, Any] | None:
+        """The hash of the client's binary and of every input file it reads"""
+        client_io = self.client_io(souffle_client)
+        if client_io is None:
+            return None
+        return {
+            'binary_hash': client_io['binary_hash'],
+            'inputs': {filename: self.file_hash(join(in_dir, filename)) for filename in client_io['inputs']}
+        }
+
+    def run_souffle_client(self, souffle_client: str, in_dir: str, out_dir: str, start_time: float, half: bool, manifest_file: str | None = None,
+                           monitor: ProcessMonitor | None = None, variant: str | None = None, print_sizes: bool = False) -> tuple[list[str], list[str]]:
+        """
+        Runs a souffle client. When `reuse_client_outputs` is set and a manifest file is given, a run with a fingerprint matching
+        the one recorded in the manifest is skipped, keeping the previous outputs, and the fingerprint of a successful run is recorded.
+        A client aborted by its monitor is reported as timed out. A compiled `variant` of the client is run if given.
+        With `print_sizes` (for the decompiler programs) and telemetry enabled, its stdout is kept in `<client>.sizes`.
+        """
+        errors: list[str] = []
+        timeouts: list[str] = []
+        client_name = os.path.basename(souffle_client)
+        # fingerprints are only needed to reuse outputs, hashing the inputs of every client isn't free
+        if not self.reuse_client_outputs:
+            manifest_file = None
+        fingerprint = self.client_fingerprint(souffle_client, in_dir) if manifest_file is not None else None
+        if manifest_file is not None and fingerprint is not None:
+            client_io = self.client_io(souffle_client)
+            assert client_io is not None
+            manifest = load_client_manifest(manifest_file)
+            if manifest.get(client_name) == fingerprint and all(os.path.exists(join(out_dir, o)) for o in client_io['outputs']):
+                log_debug(f"Reusing the outputs of {client_name} in {out_dir}")
+                self.reused_clients.append(client_name)
+                return errors, timeouts
+
         err_filename = join(out_dir, os.path.basename(souffle_client) + '.err')
+        sizes_file: Any = open(join(out_dir, client_name + RELATION_SIZES_SUFFIX), 'w') if print_sizes and self.telemetry else devnull
         if not self.interpreted:
             err_file: Any = open(err_filename, 'w')
             analysis_args = [
-                get_souffle_executable_path(self.cache_dir, souffle_client),
+                get_souffle_executable_path(self.cache_dir, souffle_client, self.profile, variant),
                 f"--facts={in_dir}", f"--output={out_dir}"
             ]
         else:
@@ -110,7 +339,17 @@ class AnalysisExecutor:
                 "-M", self.souffle_macros
             ]
 
-        if run_process(analysis_args, self.calc_timeout(start_time, half), stderr=err_file) < 0:
+        if self.souffle_threads > 1:
+            analysis_args.append(f"--jobs={self.souffle_threads}")
+
+        if self.profile:
+            analysis_args.append(f"--profile={join(out_dir, os.path.basename(souffle_client) + PROFILE_SUFFIX)}")
+
+        usage = run_process(analysis_args, self.calc_timeout(start_time, half), stdout=sizes_file, stderr=err_file, monitor=monitor)
+        if sizes_file != devnull:
+            sizes_file.close()
+        self.record_usage(os.path.basename(souffle_client), usage)
+        if usage.timed_out or usage.aborted is not None:
             timeouts.append(souffle_client)
         if err_file != devnull:
             souffle_err = open(err_filename).read()
@@ -120,6 +359,19 @@ class AnalysisExecutor:
                 errors.append(os.path.basename(souffle_client))
             elif len(souffle_err) > 0:
                 log(f"Unrecognized error during {souffle_client} dl execution: {souffle_err}.")
+
+        if manifest_file is not None:
+            # clients of the same contract may finish concurrently
+            with manifest_lock:
+                manifest = load_client_manifest(manifest_file)
+                if fingerprint is not None and not errors and not timeouts:
+                    manifest[client_name] = fingerprint
+                else:
+                    manifest.pop(client_name, None)
+                with open(manifest_file + '.tmp', 'w') as f:
+                    json.dump(manifest, f)
+                os.replace(manifest_file + '.tmp', manifest_file)
+
         return errors, timeouts
 
     def run_script_client(self, script_client: str, in_dir: str, out_dir: str, start_time: float):
@@ -130,58 +382,165 @@ class AnalysisExecutor:
         client_name = client_split[0].split('/')[-1]
         err_filename = join(out_dir, client_name+'.err')
 
-        runtime = run_process(
+        usage = run_process(
             client_split,
             self.calc_timeout(start_time),
             devnull,
             open(err_filename, 'w'),
             cwd=in_dir
         )
+        self.record_usage(client_name, usage)
         if len(open(err_filename).read()) > 0:
             errors.append(client_name)
-        if runtime < 0:
+        if usage.timed_out:
             timeouts.append(script_client)
         return errors, timeouts
 
 
-    def run_clients(self, souffle_clients: list[str], other_clients: list[str], in_dir: str, out_dir: str, start_time: float, half: bool = False) -> tuple[list[str], list[str]]:
-        errors = []
-        timeouts = []
+    def client_dependencies(self, souffle_clients: list[str], other_clients: list[str], in_dir: str, out_dir: str) -> list[set[int]]:
+        """
+        For every client (souffle clients first, then the others, as run by `run_clients`),
+        the indices of the earlier clients it has to wait for: the ones writing a file it reads,
+        reading a file it writes, or writing the same file.
+        Clients with unknown I/O (script clients, interpreted souffle clients) wait for, and are waited by, all others.
+        """
+        io_files: list[tuple[set[str], set[str]] | None] = []
         for souffle_client in souffle_clients:
-            e, t = self.run_souffle_client(souffle_client, in_dir, out_dir, start_time, half)
-            errors.extend(e)
-            timeouts.extend(t)
+            client_io = self.client_io(souffle_client)
+            if client_io is None:
+                io_files.append(None)
+            else:
+                io_files.append((
+                    {os.path.abspath(join(in_dir, f)) for f in client_io['inputs']},
+                    {os.path.abspath(join(out_dir, f)) for f in client_io['outputs']}
+                ))
+        io_files += [None] * len(other_clients)
+
+        dependencies: list[set[int]] = []
+        for j, io_j in enumerate(io_files):
+            deps = set()
+            for i, io_i in enumerate(io_files[:j]):
+                if io_i is None or io_j is None:
+                    deps.add(i)
+                    continue
+                inputs_i, outputs_i = io_i
+                inputs_j, outputs_j = io_j
+                if outputs_i & inputs_j or inputs_i & outputs_j or outputs_i & outputs_j:
+                    deps.add(i)
+            dependencies.append(deps)
+        return dependencies
+
+    def run_clients(self, souffle_clients: list[str], other_clients: list[str], in_dir: str, out_dir: str, start_time: float, half: bool = False, manifest_file: str | None = None) -> tuple[list[str], list[str]]:
+        """
+        Runs the souffle clients, followed by the other clients. With `client_jobs` > 1, clients that do not
+        depend on each other's files (see `client_dependencies`) run concurrently, each under its own timeout.
+        """
+        def run_client(i: int) -> tuple[list[str], list[str]]:
+            if i < len(souffle_clients):
+                return self.run_souffle_client(souffle_clients[i], in_dir, out_dir, start_time, half, manifest_file)
+            return self.run_script_client(other_clients[i - len(souffle_clients)], in_dir, out_dir, start_time)
+
+        num_clients = len(souffle_clients) + len(other_clients)
+        results: dict[int, tuple[list[str], list[str]]] = {}
+
+        if self.client_jobs <= 1 or num_clients <= 1:
+            for i in range(num_clients):
+                results[i] = run_client(i)
+        else:
+            dependencies = self.client_dependencies(souffle_clients, other_clients, in_dir, out_dir)
+            waiting = list(range(num_clients))
+            with ThreadPoolExecutor(max_workers=self.client_jobs) as pool:
+                running: dict[Future, int] = {}
+                while waiting or running:
+                    for i in [i for i in waiting if dependencies[i] <= results.keys()]:
+                        waiting.remove(i)
+                        running[pool.submit(run_client, i)] = i
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        results[running.pop(future)] = future.result()
 
-        for other_client in other_clients:
-            e,t = self.run_script_client(other_client, in_dir, out_dir, start_time)
+        errors = []
+        timeouts = []
+        for i in range(num_clients):
+            e, t = results[i]
             errors.extend(e)
             timeouts.extend(t)
         return timeouts, errors
 
-def run_process(process_args, timeout: float, stdout=devnull, stderr=devnull, cwd: str='.', memory_limit=DEFAULT_MEMORY_LIMIT) -> float:
+def load_client_manifest(manifest_file: str) -> dict[str, Any]:
+    try:
+        with open(manifest_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def run_process(process_args, timeout: float, stdout=devnull, stderr=devnull, cwd: str='.', memory_limit=DEFAULT_MEMORY_LIMIT, monitor: ProcessMonitor | None = None) -> ProcessUsage:
     ''' Runs process described by args, for a specific time period
     as specified by the timeout.
 
-    Returns the time it took to run the process and -1 if the process
-    times out
+    Returns the resource usage of the process, collected using `wait4`.
+    `timed_out` is set if the process had to be killed because of the timeout.
+    If a monitor is given, it is checked every MONITOR_INTERVAL seconds and the process is killed
+    as soon as it returns a reason to, which is kept in `aborted`.
     '''
     if timeout < 0:
         # This can theoretically happen
-        return -1
+        return ProcessUsage(0.0, 0, 0.0, 0.0, 0, 0, timed_out=True)
 
     start_time = time.time()
 
-    try:
-        subprocess.run(process_args, timeout=timeout, stdout=stdout, stderr=stderr, cwd=cwd, env=souffle_env, preexec_fn=lambda: set_memory_limit(memory_limit))
-    except subprocess.TimeoutExpired:
-        return -1
+    proc = subprocess.Popen(process_args, stdout=stdout, stderr=stderr, cwd=cwd, env=souffle_env)
+    set_memory_limit(proc.pid, memory_limit)
 
-    return time.time() - start_time
+    # Reap the child using wait4 (instead of Popen.wait) to get its rusage.
+    # This happens on a separate thread so that the timeout can be enforced without polling.
+    wait_result: list[tuple[int, int, resource.struct_rusage]] = []
+    waiter = threading.Thread(target=lambda: wait_result.append(os.wait4(proc.pid, 0)), daemon=True)
+    waiter.start()
+
+    aborted = None
+    if monitor is None:
+        waiter.join(timeout)
+    else:
+        deadline = start_time + timeout
+        while waiter.is_alive() and time.time() < deadline:
+            waiter.join(min(MONITOR_INTERVAL, deadline - time.time()))
+            if waiter.is_alive():
+                aborted = monitor(proc.pid, time.time() - start_time)
+                if aborted is not None:
+                    break
+
+    timed_out = waiter.is_alive() and aborted is None
+    if waiter.is_alive():
+        proc.kill()
+        waiter.join()
+
+    _, status, rusage = wait_result[0]
+    # Let the Popen object know the child has been reaped
+    proc.returncode = os.waitstatus_to_exitcode(status)
+
+    return ProcessUsage(
+        wall_time = time.time() - start_time,
+        # ru_maxrss is in kilobytes, ru_inblock/ru_oublock are in 512-byte blocks
+        max_rss = rusage.ru_maxrss * 1024,
+        user_time = rusage.ru_utime,
+        sys_time = rusage.ru_stime,
+        read_bytes = rusage.ru_inblock * 512,
+        write_bytes = rusage.ru_oublock * 512,
+        signal = os.WTERMSIG(status) if os.WIFSIGNALED(status) else 0,
+        timed_out = timed_out,
+        aborted = aborted
+    )
 
 
-def compile_datalog(spec: str, souffle_bin: str, cache_dir: str, reuse_datalog_bin: bool, souffle_macros: str) -> None:
+def compile_datalog(spec: str, souffle_bin: str, cache_dir: str, reuse_datalog_bin: bool, souffle_macros: str, profile: bool = False, variant: str | None = None) -> None:
+    """
+    Compiles a souffle program, reusing the cached executable of the same preprocessed program if there is one.
+    With `profile`, the program is compiled with profiling enabled, to a separate executable.
+    A `variant` of the program (compiled with its own macros) gets its own executable as well.
+    """
     pathlib.Path(cache_dir).mkdir(exist_ok=True)
-    executable_path = get_souffle_executable_path(cache_dir, spec)
+    executable_path = get_souffle_executable_path(cache_dir, spec, profile, variant)
 
     if reuse_datalog_bin and os.path.isfile(executable_path):
         return
@@ -201,19 +560,47 @@ def compile_datalog(spec: str, souffle_bin: str, cache_dir: str, reuse_datalog_b
 
     log_debug(f"md5 of spec {spec} is {md5_hash}")
 
-    cache_path = join(cache_dir, md5_hash)
+    cache_path = join(cache_dir, md5_hash + (PROFILE_EXECUTABLE_SUFFIX if profile else ''))
 
     if os.path.exists(cache_path):
         log(f"Found cached executable for {spec}")
     else:
         comp_start = time.time()
         log(f"Compiling {spec} to C++ program and executable")
-        compilation_command = [souffle_bin, '-M', souffle_macros, '-o', cache_path, spec, '-L', functor_path]
+        # other gigahorse.py instances (e.g. parallel test workers) may use the same cache: files are written
+        # under a name of their own and renamed into place, so no instance sees (or runs) a partially written one
+        compiled_path = f'{cache_path}_tmp{os.getpid()}'
+        compilation_command = [souffle_bin, '-M', souffle_macros, '-o', compiled_path, spec, '-L', functor_path]
+        if profile:
+            # the profile log is given to each run of the executable
+            compilation_command[1:1] = ['-p', os.devnull]
         process = subprocess.run(compilation_command, universal_newlines=True, env = souffle_env)
         assert not(process.returncode), f"Compilation for {spec} failed. Stopping."
+        if os.path.exists(compiled_path + '.cpp'):
+            os.replace(compiled_path + '.cpp', cache_path + '.cpp')
+        os.replace(compiled_path, cache_path)
         log(f"Compilation of {spec} successful after {time.time() - comp_start} seconds.")
 
-    shutil.copy2(cache_path, executable_path)
+    copied_path = f'{executable_path}_tmp{os.getpid()}'
+    shutil.copy2(cache_path, copied_path)
+    os.replace(copied_path, executable_path)
+
+    inputs, outputs = parse_io_directives(preproc_process.stdout)
+    io_path = get_souffle_io_path(cache_dir, spec, profile, variant)
+    with open(f'{io_path}_tmp{os.getpid()}', 'w') as f:
+        json.dump({'binary_hash': file_md5(cache_path), 'inputs': inputs, 'outputs': outputs}, f)
+    os.replace(f'{io_path}_tmp{os.getpid()}', io_path)
+
+
+def read_relation_sizes(filename: str) -> dict[str, int]:
+    """The relation sizes printed by a souffle program, one `<relation>\t<size>` line per `.printsize` directive"""
+    sizes = {}
+    with open(filename) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 2 and fields[1].isdigit():
+                sizes[fields[0]] = int(fields[1])
+    return sizes
 
 
 def write_context_depth_file(filename: str, max_context_depth: int | None = None) -> None:
@@ -240,6 +627,23 @@ class FactGenUsedEnum(str, Enum):
     MultiContract = "MultiContract"
     Custom = "Custom"
 
+def decompiler_programs_run(decompiler_config: FactGenUsedEnum | None) -> list[str]:
+    """
+    The decompiler programs run on a contract decompiled with the given configuration, in order: the ones it fell back from, then its own.
+    All of them if the configuration is unknown (e.g. with --rerun_clients), none if the contract wasn't decompiled.
+    """
+    fallback_chain = [
+        (FactGenUsedEnum.DefaultDecomp, DecompilerFactGenerator.decompiler_dl),
+        (FactGenUsedEnum.ScalableDecomo, DecompilerFactGenerator.fallback_scalable_decompiler_dl),
+        (FactGenUsedEnum.LastResortDecomp, DecompilerFactGenerator.last_resort_decompiler_dl),
+    ]
+    programs = []
+    for config, decompiler_dl in fallback_chain:
+        programs.append(os.path.basename(decompiler_dl))
+        if config == decompiler_config:
+            return programs
+    return programs if decompiler_config is None else []
+
 class AbstractFactGenerator(ABC):
     _analysis_executor: AnalysisExecutor
     pattern: re.Pattern
@@ -264,6 +668,10 @@ class AbstractFactGenerator(ABC):
     def get_datalog_files(self) -> list[str]:
         pass
 
+    def get_datalog_variants(self) -> list[tuple[str, str, str]]:
+        """Variants of datalog programs to compile as well, as (program, variant name, extra souffle macros)"""
+        return []
+
     @abstractmethod
     def decomp_out_produced(self, out_dir: str) -> bool:
         pass
@@ -279,12 +687,10 @@ class AbstractFactGenerator(ABC):
 class MixedFactGenerator(AbstractFactGenerator):
     fact_generators: dict[re.Pattern, AbstractFactGenerator]
     out_dir_to_gen: dict[str, AbstractFactGenerator]
-    contract_filename_to_gen: dict[str, AbstractFactGenerator]
 
     def __init__(self, args):
         self.fact_generators = {}
         self.out_dir_to_gen = {}
-        self.contract_filename_to_gen = {}
 
     @property
     def analysis_executor(self) -> AnalysisExecutor:
@@ -297,8 +703,8 @@ class MixedFactGenerator(AbstractFactGenerator):
             fact_gen.analysis_executor = analysis_executor
 
     def generate_facts(self, contract_filename: str, work_dir: str, out_dir: str) -> tuple[float, float, FactGenUsedEnum]:
-        generator = self.contract_filename_to_gen[contract_filename]
-        del self.contract_filename_to_gen[contract_filename] # maybe remove these
+        generator = self.generator_for(contract_filename)
+        assert generator is not None
         self.out_dir_to_gen[out_dir] = generator
         return generator.generate_facts(contract_filename, work_dir, out_dir)
 
@@ -308,6 +714,12 @@ class MixedFactGenerator(AbstractFactGenerator):
             datalog_files += fact_gen.get_datalog_files()
         return datalog_files
 
+    def get_datalog_variants(self) -> list[tuple[str, str, str]]:
+        datalog_variants = []
+        for fact_gen in self.fact_generators.values():
+            datalog_variants += fact_gen.get_datalog_variants()
+        return datalog_variants
+
     def decomp_out_produced(self, out_dir: str) -> bool:
         if out_dir not in self.out_dir_to_gen:
             for fact_gen in self.fact_generators.values():
@@ -318,15 +730,23 @@ class MixedFactGenerator(AbstractFactGenerator):
         result = self.out_dir_to_gen[out_dir].decomp_out_produced(out_dir)
         return result
 
-    def match_pattern(self, contract_filename: str) -> bool:
+    def generator_for(self, contract_filename: str) -> AbstractFactGenerator | None:
+        """The first fact generator whose pattern matches the contract, matched again when needed instead of kept for every input"""
         for gen in self.fact_generators.values():
             if gen.match_pattern(contract_filename):
-                self.contract_filename_to_gen[contract_filename] = gen
-                return True
-        return False
+                return gen
+        return None
+
+    def match_pattern(self, contract_filename: str) -> bool:
+        return self.generator_for(contract_filename) is not None
+
+    def priority_of(self, contract_filename: str) -> int:
+        generator = self.generator_for(contract_filename)
+        assert generator is not None
+        return generator.priority
 
     def sort_inputs(self, files: list[str]) -> list[str]:
-        return sorted(files, key = lambda x: self.contract_filename_to_gen[x].priority)
+        return sorted(files, key=self.priority_of)
 
     def add_fact_generator(self, pattern: str, scripts: list[str], fact_gen_option: FactGenSelectionEnum, args):
         if not pattern.endswith("$"):
@@ -338,11 +758,25 @@ class MixedFactGenerator(AbstractFactGenerator):
         else:
             self.fact_generators[re.compile(pattern)] = CustomFactGenerator(pattern, scripts)
 
-    def partition_inputs_by_priority(self, files: list[str]) -> list[list[str]]:
-        return [list(v) for _, v in groupby(
-                sorted(files, key=lambda x: self.contract_filename_to_gen[x].priority),
-                key=lambda x: self.contract_filename_to_gen[x].priority
-            )]
+    def partition_inputs_by_priority(self, files: Iterable[str]) -> Iterator[Iterable[str]]:
+        """
+        Splits the inputs into rounds of decreasing priority, to be consumed one after the other.
+        The first round streams the high priority inputs as they come, buffering the rest,
+        which make up the following rounds once it is exhausted.
+        """
+        buffered: defaultdict[int, list[str]] = defaultdict(list)
+
+        def high_priority_round() -> Iterator[str]:
+            for contract_filename in files:
+                priority = self.priority_of(contract_filename)
+                if priority == FACT_GEN_HIGH_PRIORITY:
+                    yield contract_filename
+                else:
+                    buffered[priority].append(contract_filename)
+
+        yield high_priority_round()
+        for priority in sorted(buffered):
+            yield buffered[priority]
 
 
 class DecompilerFactGenerator(AbstractFactGenerator):
@@ -355,11 +789,24 @@ class DecompilerFactGenerator(AbstractFactGenerator):
     souffle_pre_clients: list[str]
     other_pre_clients: list[str]
     skip_sig_resolution: bool
+    signature_index_dir: str | None
+    blowup_detector: BlowupDetector | None
+    adaptive_limitsize: bool
+    context_depth_history: ContextDepthHistory | None
 
 
     def __init__(self, args, pattern: str):
         self.context_depth = args.context_depth
         self.disable_scalable_fallback = args.disable_scalable_fallback
+        self.adaptive_limitsize = args.adaptive_limitsize and not args.interpreted
+        # read-only in the workers, gigahorse.py records the results of the run once it is over
+        self.context_depth_history = ContextDepthHistory(args.context_depth_history, args.context_depth) if args.context_depth_history else None
+        if args.adaptive_limitsize and args.interpreted:
+            log("[WARNING]: --adaptive_limitsize is not supported in interpreted mode, ignoring it.")
+        self.blowup_detector = None
+        if args.early_fallback and not args.disable_scalable_fallback:
+            rss_threshold = int(args.early_fallback_rss * 1_000_000_000) if args.early_fallback_rss is not None else None
+            self.blowup_detector = BlowupDetector(DEFAULT_MEMORY_LIMIT, rss_threshold, args.memory_history, args.early_fallback_grace)
         if not pattern.endswith("$"):
             pattern = pattern + "$"
         self.pattern = re.compile(pattern)
@@ -370,10 +817,20 @@ class DecompilerFactGenerator(AbstractFactGenerator):
         self.other_pre_clients = [a for a in pre_clients_split if not (a.endswith('.dl') or a == '')]
 
         self.skip_sig_resolution = args.skip_sig_resolution
+        self.signature_index_dir = args.cache_dir if args.filter_signatures else None
+        self._signature_indexes: dict[str, SignatureIndex | None] | None = None
 
         if args.disable_precise_fallback:
             log("The use of the --disable_precise_fallback is deprecated. Its functionality is disabled.")
 
+    def signature_indexes(self) -> dict[str, SignatureIndex | None] | None:
+        """The signature indexes used to filter the signatures of each contract, None if signatures are not filtered"""
+        if self.signature_index_dir is None:
+            return None
+        if self._signature_indexes is None:
+            self._signature_indexes = open_signature_indexes(self.signature_index_dir)
+        return self._signature_indexes
+
     def generate_facts(self, contract_filename: str, work_dir: str, out_dir: str) -> tuple[float, float, FactGenUsedEnum]:
         with open(contract_filename) as file:
             bytecode = file.read().strip()
@@ -385,7 +842,9 @@ class DecompilerFactGenerator(AbstractFactGenerator):
 
         disassemble_start = time.time()
         blocks = blockparse.EVMBytecodeParser(bytecode).parse()
-        exporter.EVMBlockExporter(work_dir, blocks, True, bytecode, metadata, self.skip_sig_resolution).export()
+        exporter.EVMBlockExporter(work_dir, blocks, True, bytecode, metadata, self.skip_sig_resolution, self.signature_indexes()).export()
+        if self.adaptive_limitsize:
+            self.analysis_executor.limitsize_tier = select_limitsize_tier(len(blocks)).name
 
         os.symlink(join(work_dir, 'bytecode.hex'), join(out_dir, 'bytecode.hex'))
 
@@ -396,6 +855,7 @@ class DecompilerFactGenerator(AbstractFactGenerator):
             # Create a symlink with a name starting with 'Verbatim_' to be added to results json
             os.symlink(join(work_dir, 'compiler_info.csv'), join(out_dir, 'Verbatim_compiler_info.csv'))
 
+        self.analysis_executor.stage = "disassemble"
         timeouts, errors = self.analysis_executor.run_clients(self.souffle_pre_clients, self.other_pre_clients, work_dir, work_dir, disassemble_start)
         if timeouts:
             # pre clients should be very light, should never happen
@@ -403,24 +863,72 @@ class DecompilerFactGenerator(AbstractFactGenerator):
         if errors:
             raise DecompilationException()
 
-        write_context_depth_file(os.path.join(work_dir, MAX_CONTEXT_DEPTH_INPUT_FILE), self.context_depth)
+        depth_plan = None
+        if self.context_depth_history is not None:
+            code_hash = bytecode_hash(bytecode)
+            self.analysis_executor.decompiler_analytics['bytecode_hash'] = code_hash
+            depth_plan = self.context_depth_history.plan(os.path.split(contract_filename)[1], code_hash)
+        context_depth = depth_plan.depth if depth_plan is not None else self.context_depth
+
+        write_context_depth_file(os.path.join(work_dir, MAX_CONTEXT_DEPTH_INPUT_FILE), context_depth)
+        self.analysis_executor.decompiler_analytics['context_depth'] = context_depth
 
         decomp_start = time.time()
 
+        self.analysis_executor.stage = "decomp"
         decompiler_config = self.run_decomp(contract_filename, work_dir, out_dir, disassemble_start)
 
+        if depth_plan is not None and context_depth != depth_plan.fallback_depth and decompiler_config == FactGenUsedEnum.DefaultDecomp and not depth_plan.matches(out_dir):
+            log(f"Context depth {context_depth} changes the decompilation of {os.path.split(contract_filename)[1]}, decompiling again with {depth_plan.fallback_depth}")
+            # recorded in the history with the results, so this depth isn't tried again for the same bytecode
+            self.analysis_executor.decompiler_analytics['context_depth_mismatch'] = context_depth
+            self.analysis_executor.decompiler_analytics['context_depth'] = depth_plan.fallback_depth
+            write_context_depth_file(os.path.join(work_dir, MAX_CONTEXT_DEPTH_INPUT_FILE), depth_plan.fallback_depth)
+            decompiler_config = self.run_decomp(contract_filename, work_dir, out_dir, disassemble_start)
+
         return decomp_start - disassemble_start, time.time() - decomp_start, decompiler_config
 
     def get_datalog_files(self) -> list[str]:
-        datalog_files = self.souffle_pre_clients + [DecompilerFactGenerator.decompiler_dl]
+        datalog_files = list(self.souffle_pre_clients)
+        # with adaptive limitsize, the main decompiler only runs as one of its tiers
+        if not self.adaptive_limitsize:
+            datalog_files.append(DecompilerFactGenerator.decompiler_dl)
         if not self.disable_scalable_fallback:
             datalog_files += [DecompilerFactGenerator.fallback_scalable_decompiler_dl, DecompilerFactGenerator.last_resort_decompiler_dl]
 
         return datalog_files
 
+    def get_datalog_variants(self) -> list[tuple[str, str, str]]:
+        if not self.adaptive_limitsize:
+            return []
+        return [(DecompilerFactGenerator.decompiler_dl, tier.name, tier.souffle_macros()) for tier in LIMITSIZE_TIERS]
+
+    def run_decompiler(self, decompiler_dl: str, in_dir: str, out_dir: str, start_time: float, half: bool) -> tuple[list[str], list[str]]:
+        """Runs a decompiler configuration, which is aborted early if it blows up when a fallback configuration follows it"""
+        monitor = None
+        if self.blowup_detector is not None and decompiler_dl != DecompilerFactGenerator.last_resort_decompiler_dl:
+            monitor = self.blowup_detector.monitor(decompiler_dl, self.analysis_executor.calc_timeout(start_time, half))
+        variant = self.analysis_executor.limitsize_tier if decompiler_dl == DecompilerFactGenerator.decompiler_dl else None
+        errors, timeouts = self.analysis_executor.run_souffle_client(decompiler_dl, in_dir, out_dir, start_time, half, monitor=monitor, variant=variant, print_sizes=True)
+        return timeouts, errors
+
+    def record_fallback_reason(self, decompiler_dl: str, timeouts: list[str]) -> None:
+        """Records why the decompiler configuration didn't produce an output, and a fallback one is used"""
+        client_name = os.path.basename(decompiler_dl)
+        usage = self.analysis_executor.last_usage(client_name)
+        if usage is not None and usage.aborted is not None:
+            reason = usage.aborted
+        elif timeouts:
+            reason = "timeout"
+        elif usage is not None and usage.signal == signal.SIGKILL:
+            reason = "killed"
+        else:
+            reason = "no output"
+        self.analysis_executor.fallback_reasons.append(f"{client_name}: {reason}")
+
     def run_decomp(self, contract_filename: str, in_dir: str, out_dir: str, start_time: float) -> FactGenUsedEnum:
         config = FactGenUsedEnum.DefaultDecomp
-        def_timeouts, def_errors = self.analysis_executor.run_clients([DecompilerFactGenerator.decompiler_dl], [], in_dir, out_dir, start_time, not self.disable_scalable_fallback)
+        def_timeouts, def_errors = self.run_decompiler(DecompilerFactGenerator.decompiler_dl, in_dir, out_dir, start_time, not self.disable_scalable_fallback)
 
         if def_errors:
             raise DecompilationException()
@@ -429,16 +937,18 @@ class DecompilerFactGenerator(AbstractFactGenerator):
                 raise TimeoutException()
             else:
                 # Default using scalable fallback config
-                log(f"Using the scalable fallback decompilation configuration for {os.path.split(contract_filename)[1]}")
+                self.record_fallback_reason(DecompilerFactGenerator.decompiler_dl, def_timeouts)
+                log(f"Using the scalable fallback decompilation configuration for {os.path.split(contract_filename)[1]} ({self.analysis_executor.fallback_reasons[-1]})")
                 write_context_depth_file(os.path.join(in_dir, MAX_CONTEXT_DEPTH_INPUT_FILE), FALLBACK_SCALABLE_MAX_CONTEXT_DEPTH)
 
-                sca_timeouts, sca_errors = self.analysis_executor.run_clients([DecompilerFactGenerator.fallback_scalable_decompiler_dl], [], in_dir, out_dir, start_time, half=True)
+                sca_timeouts, sca_errors = self.run_decompiler(DecompilerFactGenerator.fallback_scalable_decompiler_dl, in_dir, out_dir, start_time, half=True)
                 if sca_errors:
                     raise DecompilationException()
                 elif sca_timeouts:
-                    log(f"Using the last resort ultra scalable decompilation configuration for {os.path.split(contract_filename)[1]}")
+                    self.record_fallback_reason(DecompilerFactGenerator.fallback_scalable_decompiler_dl, sca_timeouts)
+                    log(f"Using the last resort ultra scalable decompilation configuration for {os.path.split(contract_filename)[1]} ({self.analysis_executor.fallback_reasons[-1]})")
                     write_context_depth_file(os.path.join(in_dir, MAX_CONTEXT_DEPTH_INPUT_FILE), LAST_RESORT_MAX_CONTEXT_DEPTH)
-                    last_timeouts, last_errors = self.analysis_executor.run_clients([DecompilerFactGenerator.last_resort_decompiler_dl], [], in_dir, out_dir, start_time)
+                    last_timeouts, last_errors = self.run_decompiler(DecompilerFactGenerator.last_resort_decompiler_dl, in_dir, out_dir, start_time, half=False)
                     if last_errors:
                         raise DecompilationException()
                     elif not last_timeouts and self.decomp_out_produced(out_dir):
@@ -474,25 +984,23 @@ class ContractStitchingGenerator(AbstractFactGenerator):
         with open(contract_filename) as f:
             manifest = json.load(f)
 
-            main = manifest["main"]
-            contracts = manifest["contracts"]  # Dict[str, str]
-            facts: dict[str, TACRelations] = dict()
-            for address, id in contracts.items():
-                path = Path(work_dir).parent / f"{id}/out"
-                facts[address] = TACRelations.from_dir(path)
-
-            for address in facts.keys():
-                if address == main:
-                    # copy the bytecode of the main contract, as clients read it
-                    code_src = path = Path(work_dir).parent / f"{id}/out/bytecode.hex"
-                    shutil.copy2(code_src, out_dir)
-                    continue
-                # TODO: ensure no clashes in the first 8 chars
-                facts[address].prefix_identifiers(address[:8] + "_")
-                facts[address].set_contract(address)
-        
-            merged = TACRelations.merge(*list(facts.values()))
-            merged.write_dir(out_dir)
+        main = manifest["main"]
+        contracts = manifest["contracts"]  # Dict[str, str]
+        stitch_map = StitchMap.numbered([address for address in contracts if address != main])
+        members = []
+        for address, id in contracts.items():
+            path = str(Path(work_dir).parent / f"{id}/out")
+            if address == main:
+                members.append(StitchMember(path))
+            else:
+                members.append(StitchMember(path, prefix=stitch_map.prefix_of(address), contract=address))
+
+        # relations are streamed from the members' outputs, in this process: other contracts' jobs are using the other cores
+        stitch_dirs(members, out_dir)
+        stitch_map.write(out_dir)
+
+        # copy the bytecode of the main contract, as clients read it
+        shutil.copy2(Path(work_dir).parent / f"{contracts[main]}/out/bytecode.hex", out_dir)
 
         return 0, time.time() - fact_gen_time_start, FactGenUsedEnum.MultiContract
 
@@ -519,6 +1027,7 @@ class CustomFactGenerator(AbstractFactGenerator):
         errors = []
         timeouts = []
         fact_gen_time_start = time.time()
+        self.analysis_executor.stage = "disassemble"
         for script in self.fact_generator_scripts:
             if script.endswith('dl'):
                 e,t = self.analysis_executor.run_souffle_client(script, out_dir, out_dir, fact_gen_time_start, False)
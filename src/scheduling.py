@@ -0,0 +1,193 @@
+"""scheduling.py: helpers deciding when (and how) the batch scheduler launches new analysis jobs"""
+
+import os
+import time
+
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Iterator, TypeVar
+
+from .common import log, log_debug, peak_memory
+from .runners import DEFAULT_MEMORY_LIMIT
+from .results import iter_results
+from .blowup import process_rss
+
+DEFAULT_MEMORY_RESERVE = 2 * 1_000_000_000
+"""Memory left free for the rest of the system when admitting new jobs (2 GB)"""
+
+DEFAULT_MEMORY_PER_BYTECODE_BYTE = 100_000
+"""Estimated peak memory per byte of bytecode, used until enough jobs have been observed (unless --memory_per_bytecode_byte is given)"""
+
+MIN_MEMORY_ESTIMATE = 256 * 1_000_000
+"""No job is estimated to need less than this (256 MB)"""
+
+HISTORY_MARGIN = 1.2
+"""Safety margin applied to the peak memory previously recorded for a contract"""
+
+MIN_OBSERVATIONS = 10
+"""Number of observed jobs (including those of the memory history) needed before the learned memory per bytecode byte is used"""
+
+ADMISSION_RETRY_INTERVAL = 0.5
+"""Seconds to wait before re-evaluating a held back launch"""
+
+T = TypeVar('T')
+
+
+def available_memory() -> int:
+    """Memory available for new allocations without swapping, in bytes"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+
+def process_tree_rss(pid: int) -> int:
+    """Current resident set size of a process and all of its descendants, in bytes"""
+    total = process_rss(pid)
+    try:
+        for tid in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{tid}/children') as f:
+                for child in f.read().split():
+                    total += process_tree_rss(int(child))
+    except OSError:
+        pass
+    return total
+
+
+@dataclass
+class MemoryHistory:
+    peaks: dict[str, int] = field(default_factory=dict)
+    """Peak memory per contract name"""
+    ratios: list[float] = field(default_factory=list)
+    """Peak memory per byte of bytecode of each contract"""
+
+
+def memory_ratio(analytics: dict[str, Any]) -> float | None:
+    """Peak memory per byte of bytecode of a finished contract, None if either is unknown"""
+    peak = peak_memory(analytics)
+    bytecode_size = analytics.get('bytecode_size', 0)
+    if peak > 0 and bytecode_size > 0:
+        return peak / bytecode_size
+    return None
+
+
+def load_memory_history(results_file: str) -> MemoryHistory:
+    """The peak memory of the contracts of a results file of a previous run"""
+    history = MemoryHistory()
+    for contract_name, _, _, analytics in iter_results(results_file, {'resource_usage', 'bytecode_size'}):
+        peak = peak_memory(analytics)
+        if peak > 0:
+            history.peaks[contract_name] = peak
+        ratio = memory_ratio(analytics)
+        if ratio is not None:
+            history.ratios.append(ratio)
+    return history
+
+
+class MemoryAdmissionController:
+    """
+    Holds back new jobs while the memory expected to be needed by the running jobs
+    and the new one is more than the memory available in the system.
+
+    The footprint of a job comes from a previous run of the same contract if one is known,
+    otherwise from its bytecode size scaled by the memory per bytecode byte observed so far
+    (in the history and this run), or `memory_per_bytecode_byte` until MIN_OBSERVATIONS are known.
+    """
+
+    def __init__(self, reserve: int, history: MemoryHistory | None = None, memory_per_bytecode_byte: float = DEFAULT_MEMORY_PER_BYTECODE_BYTE):
+        self.reserve = reserve
+        history = history or MemoryHistory()
+        self.history = history.peaks
+        self.observed_ratios = list(history.ratios)
+        self.memory_per_bytecode_byte = memory_per_bytecode_byte
+        self.throttle_events = 0
+        self.throttled_time = 0.0
+        self._throttled_since: float | None = None
+
+    def estimate(self, contract_filename: str) -> int:
+        contract_name = os.path.split(contract_filename)[1]
+        if contract_name in self.history:
+            return int(self.history[contract_name] * HISTORY_MARGIN)
+
+        try:
+            # hex encoded: two characters per byte
+            bytecode_size = os.path.getsize(contract_filename) // 2
+        except OSError:
+            bytecode_size = 0
+
+        if len(self.observed_ratios) >= MIN_OBSERVATIONS:
+            ratios = sorted(self.observed_ratios)
+            ratio = ratios[int(0.9 * (len(ratios) - 1))]
+        else:
+            ratio = self.memory_per_bytecode_byte
+
+        return min(max(int(ratio * bytecode_size), MIN_MEMORY_ESTIMATE), DEFAULT_MEMORY_LIMIT)
+
+    def observe(self, analytics: dict[str, Any]) -> None:
+        """Learns from the analytics of a finished contract"""
+        ratio = memory_ratio(analytics)
+        if ratio is not None:
+            self.observed_ratios.append(ratio)
+
+    def admit(self, estimate: int, workers: list[dict[str, Any]]) -> bool:
+        """
+        Decides whether a job with the given memory estimate can start next to the running `workers`.
+        The memory running jobs are still expected to claim is their estimate minus what they already use.
+        """
+        if not workers:
+            # Always make progress, even if the job may not fit
+            admitted = True
+        else:
+            outstanding = sum(max(0, w["memory_estimate"] - process_tree_rss(w["proc"].pid)) for w in workers)
+            admitted = available_memory() - outstanding - self.reserve >= estimate
+
+        now = time.time()
+        if not admitted and self._throttled_since is None:
+            self.throttle_events += 1
+            self._throttled_since = now
+            log_debug(f"Memory is tight, holding back a job estimated at {estimate / 1_000_000:.0f} MB")
+        elif admitted and self._throttled_since is not None:
+            self.throttled_time += now - self._throttled_since
+            self._throttled_since = None
+        return admitted
+
+    def report(self) -> None:
+        if self.throttle_events:
+            log(f"Memory admission control held back new jobs {self.throttle_events} times, for {self.throttled_time:.1f} secs in total.")
+
+
+class Lookahead(Iterator[T]):
+    """Wraps an iterator, buffering up to `size` items so the number of items left can be known near its end"""
+
+    def __init__(self, iterable: Iterable[T], size: int):
+        self.iterator = iter(iterable)
+        self.size = size
+        self.buffer: deque[T] = deque()
+
+    def __next__(self) -> T:
+        if self.buffer:
+            return self.buffer.popleft()
+        return next(self.iterator)
+
+    def depth(self) -> int:
+        """Number of items left, saturating at `size`"""
+        while len(self.buffer) < self.size:
+            try:
+                self.buffer.append(next(self.iterator))
+            except StopIteration:
+                break
+        return len(self.buffer)
+
+
+def souffle_threads_for_job(num_cores: int, threads_in_use: int, free_job_slots: int, queue_depth: int) -> int:
+    """
+    Threads to give the souffle programs of a job about to be launched.
+    The idle cores are split evenly between this job and the ones that can still be launched next to it,
+    so while the queue is deep every job gets a single thread and the tail of a batch gets the rest.
+    """
+    sharing_jobs = max(1, min(free_job_slots, queue_depth + 1))
+    return max(1, (num_cores - threads_in_use) // sharing_jobs)
@@ -0,0 +1,258 @@
+"""signatures.py: sorted, memory-mapped indexes of the function, event and error signature files"""
+
+import mmap
+import os
+import struct
+
+from typing import Iterable
+
+from os.path import join, basename
+
+from .common import GIGAHORSE_DIR, public_function_signature_filename, event_signature_filename, error_signature_filename
+
+SIGNATURE_FILES = {
+    'PublicFunctionSignature.facts': public_function_signature_filename,
+    'EventSignature.facts': event_signature_filename,
+    'ErrorSignature.facts': error_signature_filename,
+}
+"""Signature facts read by the decompiler, and the files they come from"""
+
+SIGNATURE_KINDS = {
+    'function': 'PublicFunctionSignature.facts',
+    'event': 'EventSignature.facts',
+    'error': 'ErrorSignature.facts',
+}
+
+DEFAULT_INDEX_DIR = join(GIGAHORSE_DIR, 'cache')
+"""Where indexes are kept by default, the default cache directory of gigahorse.py"""
+
+INDEX_SUFFIX = '.idx'
+
+INDEX_MAGIC = b'GHSIGIDX'
+INDEX_VERSION = 1
+
+# magic, version, key width, number of records, size and mtime of the indexed file
+HEADER = struct.Struct('<8sIIQQQ')
+# offset and length of the indexed row, after the key
+RECORD_TAIL = struct.Struct('<QI')
+
+
+class SignatureIndex:
+    """
+    Read-only view of an index built by `build_signature_index`.
+
+    The file is a header, followed by fixed-size records sorted by key, followed by the indexed rows.
+    Each record is the signature hash as a big-endian integer (4 bytes for selectors, 32 for event topics)
+    and the position of its row, so lookups are a binary search over the memory-mapped records.
+    """
+
+    def __init__(self, index_file: str):
+        with open(index_file, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.key_width, self.count, self.source_size, self.source_mtime_ns = HEADER.unpack_from(self.mmap, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f"{index_file} is not a signature index")
+        self.record_size = self.key_width + RECORD_TAIL.size
+        self.rows_start = HEADER.size + self.count * self.record_size
+
+    def _key(self, i: int) -> bytes:
+        start = HEADER.size + i * self.record_size
+        return self.mmap[start : start + self.key_width]
+
+    def _row(self, i: int) -> str:
+        offset, length = RECORD_TAIL.unpack_from(self.mmap, HEADER.size + i * self.record_size + self.key_width)
+        return self.mmap[self.rows_start + offset : self.rows_start + offset + length].decode()
+
+    def _lower_bound(self, key_bytes: bytes, lo: int = 0) -> int:
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key_bytes:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _rows_from(self, i: int, key_bytes: bytes) -> tuple[list[str], int]:
+        rows = []
+        while i < self.count and self._key(i) == key_bytes:
+            rows.append(self._row(i))
+            i += 1
+        return rows, i
+
+    def _key_bytes(self, key: int) -> bytes | None:
+        if key < 0 or key.bit_length() > 8 * self.key_width:
+            return None
+        return key.to_bytes(self.key_width, 'big')
+
+    def lookup(self, key: int) -> list[str]:
+        """The rows (tab-separated, without line terminator) whose signature hash is `key`"""
+        key_bytes = self._key_bytes(key)
+        if key_bytes is None:
+            return []
+        rows, _ = self._rows_from(self._lower_bound(key_bytes), key_bytes)
+        return rows
+
+    def resolve(self, key: int) -> list[str]:
+        """The signatures (e.g. `transfer(address,uint256)`) whose hash is `key`"""
+        return [row.split('\t', 1)[1] for row in self.lookup(key) if '\t' in row]
+
+    def resolve_many(self, keys: Iterable[int]) -> dict[int, list[str]]:
+        """
+        The signatures of each of the given hashes that has any.
+        The keys are looked up in order, each search starting where the previous one ended.
+        """
+        resolved = {}
+        lo = 0
+        for key in sorted(set(keys)):
+            key_bytes = self._key_bytes(key)
+            if key_bytes is None:
+                continue
+            lo = self._lower_bound(key_bytes, lo)
+            rows, lo = self._rows_from(lo, key_bytes)
+            if rows:
+                resolved[key] = [row.split('\t', 1)[1] for row in rows if '\t' in row]
+        return resolved
+
+    def is_stale(self, facts_file: str) -> bool:
+        stat = os.stat(facts_file)
+        return (stat.st_size, stat.st_mtime_ns) != (self.source_size, self.source_mtime_ns)
+
+    def close(self) -> None:
+        self.mmap.close()
+
+
+def parse_signature_key(row: str) -> int | None:
+    hex_signature = row.split('\t', 1)[0]
+    try:
+        return int(hex_signature, 16)
+    except ValueError:
+        return None
+
+
+def build_signature_index(facts_file: str, index_file: str) -> None:
+    """Indexes a tab-separated signature file, whose first column is the hex signature hash"""
+    stat = os.stat(facts_file)
+    entries = []
+    with open(facts_file, 'rb') as f:
+        for raw_row in f:
+            row = raw_row.rstrip(b'\r\n')
+            key = parse_signature_key(row.decode(errors='replace'))
+            if key is not None:
+                entries.append((key, row))
+    entries.sort(key=lambda e: e[0])
+
+    key_width = 4 if all(key < 2**32 for key, _ in entries) else 32
+
+    tmp_file = index_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(HEADER.pack(INDEX_MAGIC, INDEX_VERSION, key_width, len(entries), stat.st_size, stat.st_mtime_ns))
+        offset = 0
+        for key, row in entries:
+            f.write(key.to_bytes(key_width, 'big'))
+            f.write(RECORD_TAIL.pack(offset, len(row)))
+            offset += len(row)
+        for _, row in entries:
+            f.write(row)
+    os.replace(tmp_file, index_file)
+
+
+def get_signature_index_path(index_dir: str, facts_file: str) -> str:
+    return join(index_dir, basename(facts_file) + INDEX_SUFFIX)
+
+
+def build_signature_indexes(index_dir: str) -> None:
+    """(Re)builds the indexes of all signature files that changed since they were last indexed"""
+    for kind in SIGNATURE_KINDS:
+        index = load_signature_index(kind, index_dir)
+        if index is not None:
+            index.close()
+
+
+def load_signature_index(kind: str, index_dir: str = DEFAULT_INDEX_DIR) -> SignatureIndex | None:
+    """
+    The index of the `function`, `event` or `error` signatures, built first if missing or out of date.
+    None if there is no such signature file.
+    """
+    facts_file = SIGNATURE_FILES[SIGNATURE_KINDS[kind]]
+    if not os.path.isfile(facts_file):
+        return None
+    index_file = get_signature_index_path(index_dir, facts_file)
+    if os.path.isfile(index_file):
+        index = SignatureIndex(index_file)
+        if not index.is_stale(facts_file):
+            return index
+        index.close()
+    os.makedirs(index_dir, exist_ok=True)
+    build_signature_index(facts_file, index_file)
+    return SignatureIndex(index_file)
+
+
+def open_signature_indexes(index_dir: str) -> dict[str, SignatureIndex | None]:
+    """The index of each signature file in `SIGNATURE_FILES`, None for the ones that do not exist"""
+    indexes: dict[str, SignatureIndex | None] = {}
+    for out_filename, facts_file in SIGNATURE_FILES.items():
+        index_file = get_signature_index_path(index_dir, facts_file)
+        indexes[out_filename] = SignatureIndex(index_file) if os.path.isfile(index_file) else None
+    return indexes
+
+
+def selector_candidates(push_values: Iterable[int]) -> set[int]:
+    """
+    4-byte signature hashes the decompiler could match against the given pushed constants.
+    Mirrors `ConstantPossibleSigHash`, which compares the first 8, 7 or 6 hex digits of a constant
+    (zero-padded to 8) to the signatures, also covering constants shifted by whole hex digits, e.g. `sel << 224`.
+    """
+    candidates = set()
+    for value in push_values:
+        digits = format(value, 'x')
+        candidates.add(int(digits[:8], 16))
+        padded = digits + '0' * 8
+        for n in (6, 7, 8):
+            candidates.add(int(padded[:n], 16))
+    return candidates
+
+
+def filter_signatures(index: SignatureIndex, keys: set[int]) -> list[str]:
+    rows = []
+    for key in sorted(keys):
+        rows.extend(index.lookup(key))
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Builds and queries the indexes of the signature files.")
+    parser.add_argument("--index_dir", default=DEFAULT_INDEX_DIR, metavar="DIR",
+                        help=f"The location of the indexes (default: {DEFAULT_INDEX_DIR}).")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("build", help="(Re)build the indexes of the signature files that changed.")
+
+    query_parser = subparsers.add_parser("query", help="Resolve signature hashes, one result per line as `hash<TAB>signature`.")
+    query_parser.add_argument("--kind", choices=SIGNATURE_KINDS.keys(), default="function",
+                              help="The kind of signatures to look up (default: function).")
+    query_parser.add_argument("hashes", nargs="*", metavar="HASH",
+                              help="Hex signature hashes to resolve (read from stdin, one per line, if none are given).")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_signature_indexes(args.index_dir)
+        for facts_file in SIGNATURE_FILES.values():
+            index_file = get_signature_index_path(args.index_dir, facts_file)
+            if os.path.isfile(index_file):
+                print(f"{facts_file} -> {index_file}")
+        sys.exit(0)
+
+    index = load_signature_index(args.kind, args.index_dir)
+    if index is None:
+        sys.exit(f"No {SIGNATURE_KINDS[args.kind]} signature file found")
+
+    hashes = args.hashes or [line.strip() for line in sys.stdin if line.strip()]
+    resolved = index.resolve_many(int(h, 16) for h in hashes)
+    for h in hashes:
+        for signature in resolved.get(int(h, 16), []):
+            print(f"{h}\t{signature}")
@@ -13,6 +13,11 @@ instead of raw strings:
 
 `ALL_RELATIONS` is the frozenset of every defined RelationDef.
 
+`stitch_dirs` merges the output directories of several contracts without
+loading them, streaming each relation file through identifier rewriting.
+The identifiers of the stitched contracts get the compact prefixes of a
+`StitchMap`, which is written next to the merged relations to map them back.
+
 Schema derived from:
   https://github.com/nevillegrech/gigahorse-toolchain/blob/master/logic/decompiler_output.dl
 """
@@ -20,7 +25,11 @@ Schema derived from:
 from __future__ import annotations
 
 import csv
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
+from itertools import repeat
 from enum import Enum, auto
 from pathlib import Path
 from typing import Callable, Optional, Union
@@ -289,6 +298,73 @@ def _resolve_def(key: RelKey) -> Optional[RelationDef]:
     return _RELATION_BY_NAME.get(key)
 
 
+def _relation_path(out_dir: Path, name: str) -> Optional[Path]:
+    """The file of a relation in a Souffle output directory, with or without
+    the .csv extension.  None if there is neither."""
+    path = out_dir / f"{name}.csv"
+    if not path.exists():
+        path = out_dir / name
+        if not path.exists():
+            return None
+    return path
+
+
+# ---------------------------------------------------------------------------
+# Stitch prefixes — telling apart the identifiers of stitched contracts
+# ---------------------------------------------------------------------------
+
+_STITCH_PREFIX = re.compile(r"([1-9][0-9]*_)(.*)", re.DOTALL)
+
+
+class StitchMap:
+    """The prefixes given to the identifiers of the contracts stitched with a
+    main contract, whose identifiers are left as they are.
+
+    The i-th stitched contract gets the prefix "<i>_".  Prefixes are unique
+    and end at the first "_", so prefixed identifiers of different contracts
+    never collide; nor do they collide with the main contract's, as
+    decompiler identifiers start with "0x".  This keeps identifiers much
+    shorter than prefixing them with (part of) the contract's address.
+    """
+
+    FILENAME = "StitchedContract.csv"
+    """Tab-separated (prefix, contract) rows, written next to the merged relations"""
+
+    def __init__(self, prefixes: Optional[dict[str, str]] = None):
+        self.prefixes: dict[str, str] = prefixes or {}
+        self._by_contract = {contract: prefix for prefix, contract in self.prefixes.items()}
+
+    @classmethod
+    def numbered(cls, contracts: list[str]) -> StitchMap:
+        """Numbers the stitched contracts (not including the main one) in order."""
+        return cls({f"{i}_": contract for i, contract in enumerate(contracts, 1)})
+
+    def prefix_of(self, contract: str) -> str:
+        return self._by_contract[contract]
+
+    def original(self, identifier: str) -> tuple[Optional[str], str]:
+        """The contract an identifier of the merged relations belongs to (None
+        for the main contract) and its identifier in that contract's output."""
+        match = _STITCH_PREFIX.fullmatch(identifier)
+        if match is None or match.group(1) not in self.prefixes:
+            return None, identifier
+        return self.prefixes[match.group(1)], match.group(2)
+
+    def write(self, out_dir: str | Path) -> None:
+        with open(Path(out_dir) / self.FILENAME, "w") as f:
+            for prefix, contract in self.prefixes.items():
+                f.write(f"{prefix}\t{contract}\n")
+
+    @classmethod
+    def from_dir(cls, out_dir: str | Path) -> StitchMap:
+        """The map of a stitched output directory, empty if it wasn't stitched."""
+        path = Path(out_dir) / cls.FILENAME
+        if not path.exists():
+            return cls()
+        with open(path) as f:
+            return cls(dict(line.rstrip("\n").split("\t") for line in f if line.strip()))
+
+
 # ---------------------------------------------------------------------------
 # TACRelations — low-level relational TAC container
 # ---------------------------------------------------------------------------
@@ -347,11 +423,9 @@ class TACRelations:
     @staticmethod
     def _read_csv(out_dir: Path, name: str) -> Optional[list[tuple[str, ...]]]:
         """Read a single Souffle relation file (tab-separated, no header)."""
-        path = out_dir / f"{name}.csv"
-        if not path.exists():
-            path = out_dir / name
-            if not path.exists():
-                return None
+        path = _relation_path(out_dir, name)
+        if path is None:
+            return None
         with open(path, "r") as f:
             return [tuple(row) for row in csv.reader(f, delimiter="\t")]
 
@@ -503,6 +577,93 @@ class TACRelations:
         return f"TACRelations({loaded} relations, {total} rows)"
 
 
+# ---------------------------------------------------------------------------
+# Streaming stitching
+# ---------------------------------------------------------------------------
+
+@dataclass(frozen=True)
+class StitchMember:
+    """A contract output directory to stitch, and how its rows are rewritten.
+
+    `prefix` is prepended to every identifier column; `contract`, if given,
+    replaces the contract column of Function_Contract.
+    """
+    out_dir: str
+    prefix: str = ""
+    contract: Optional[str] = None
+
+
+def _stitch_relation(rel: RelationDef, members: list[StitchMember], out_dir: Path) -> None:
+    """Write the merged file of one relation, streaming each member's rows.
+
+    Souffle writes one tab-separated row per line, without quoting, so rows
+    are split and joined on tabs rather than parsed with `csv`.
+    """
+    id_indices = rel.id_column_indices
+    contract_index = rel.column_names.index("contract") if rel.name == function_contract.name else None
+
+    with open(out_dir / f"{rel.name}.csv", "wb") as out:
+        for member in members:
+            path = _relation_path(Path(member.out_dir), rel.name)
+            assert path is not None
+
+            if not member.prefix and (member.contract is None or contract_index is None):
+                # nothing to rewrite: copy the file as it is
+                with open(path, "rb") as f:
+                    shutil.copyfileobj(f, out)
+                    if f.tell() > 0:
+                        f.seek(-1, 2)
+                        if f.read(1) != b"\n":
+                            out.write(b"\n")
+                continue
+
+            prefix = member.prefix.encode()
+            contract = member.contract.encode() if member.contract is not None else None
+            with open(path, "rb") as f:
+                for line in f:
+                    fields = line.rstrip(b"\n").split(b"\t")
+                    if fields == [b""]:
+                        continue
+                    if prefix:
+                        for i in id_indices:
+                            if i < len(fields):
+                                fields[i] = prefix + fields[i]
+                    if contract is not None and contract_index is not None and contract_index < len(fields):
+                        fields[contract_index] = contract
+                    out.write(b"\t".join(fields) + b"\n")
+
+
+def stitch_dirs(members: list[StitchMember], out_dir: str | Path, jobs: int = 1) -> None:
+    """Merge the output directories of several contracts into `out_dir`.
+
+    Unlike loading them with `TACRelations.from_dir`, rewriting and merging
+    them, every relation is written in a single streaming pass over the
+    members' files, so only a row at a time is held in memory.  With
+    `jobs` > 1, relations are stitched in parallel processes.
+
+    Raises FileNotFoundError, before writing anything, if a member is
+    missing a relation file.
+    """
+    for member in members:
+        missing = [rel.name for rel in ALL_RELATIONS if _relation_path(Path(member.out_dir), rel.name) is None]
+        if missing:
+            names = ", ".join(sorted(missing))
+            raise FileNotFoundError(
+                f"Missing relation files in {member.out_dir}: {names}"
+            )
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    relations = sorted(ALL_RELATIONS, key=lambda r: r.name)
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(relations))) as pool:
+            list(pool.map(_stitch_relation, relations, repeat(members), repeat(out_dir)))
+    else:
+        for rel in relations:
+            _stitch_relation(rel, members, out_dir)
+
+
 # ---------------------------------------------------------------------------
 # CLI entry point
 # ---------------------------------------------------------------------------
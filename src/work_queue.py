@@ -0,0 +1,209 @@
+"""work_queue.py: contracts shared between any number of gigahorse.py instances, claimed with expiring leases"""
+
+import os
+import socket
+import sqlite3
+import time
+
+from contextlib import contextmanager
+from itertools import islice
+from typing import Iterable, Iterator
+
+DEFAULT_LEASE = 300
+"""Seconds a claim lasts unless renewed; claims of killed instances become claimable again once they expire"""
+
+MAX_ATTEMPTS = 3
+"""Contracts whose analysis was interrupted this many times are marked as failed instead of being claimed again"""
+
+POLL_INTERVAL = 1.0
+"""Seconds to wait before trying to claim again, while no contract can be claimed but some are still pending or claimed"""
+
+ENQUEUE_CHUNK = 1000
+"""Contracts an instance adds to the queue at a time, whenever fewer than this are pending"""
+
+PENDING = 'pending'
+CLAIMED = 'claimed'
+DONE = 'done'
+FAILED = 'failed'
+
+ABANDONED = 'status = :claimed AND lease_expires < :now AND NOT owner_alive(owner)'
+"""Claims whose lease expired because their instance was killed (an instance still running keeps its claims)"""
+
+CLAIMABLE = (f'attempts < :max_attempts AND (status = :pending OR ({ABANDONED})) '
+             'AND priority <= (SELECT MIN(priority) FROM items WHERE status IN (:pending, :claimed))')
+"""
+Contracts that can be claimed: pending ones or abandoned ones, of the lowest priority not yet done,
+so (as with the rounds of MixedFactGenerator) no contract is claimed before all contracts of a lower priority are finished
+"""
+
+
+def owner_alive(owner: str | None) -> bool:
+    """Whether the instance owning a claim is a process still running on this host"""
+    if owner is None:
+        return False
+    host, _, pid = owner.rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class WorkQueue:
+    """
+    A queue of contract filenames in an SQLite database (in WAL mode), which instances on the same host
+    fill with their inputs and claim work from. A claimed contract is leased to its instance,
+    which renews the lease while it is analyzed and acknowledges it once done.
+
+    No connection is kept open between operations, so none is inherited by the analysis processes forked in between.
+    """
+
+    def __init__(self, queue_file: str, lease: float = DEFAULT_LEASE):
+        self.queue_file = queue_file
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.last_renewal = time.time()
+        self.added = 0
+        """Number of contracts this instance added to the queue"""
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS items (
+                                name TEXT PRIMARY KEY,
+                                priority INTEGER NOT NULL,
+                                status TEXT NOT NULL,
+                                owner TEXT,
+                                lease_expires REAL,
+                                attempts INTEGER NOT NULL DEFAULT 0)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS items_by_status ON items (status, priority)')
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.queue_file, timeout=60, isolation_level=None)
+        conn.create_function('owner_alive', 1, owner_alive)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, contracts: Iterable[tuple[str, int]], batch_size: int = 1000) -> int:
+        """Adds (filename, priority) pairs, ignoring contracts already in the queue, whatever their status. Returns the number added."""
+        added = 0
+        batch: list[tuple[str, int]] = []
+
+        def flush(conn: sqlite3.Connection) -> int:
+            conn.execute('BEGIN IMMEDIATE')
+            before = conn.total_changes
+            conn.executemany('INSERT OR IGNORE INTO items (name, priority, status) VALUES (?, ?, ?)',
+                             [(name, priority, PENDING) for name, priority in batch])
+            conn.execute('COMMIT')
+            return conn.total_changes - before
+
+        with self._connect() as conn:
+            for contract in contracts:
+                batch.append(contract)
+                if len(batch) >= batch_size:
+                    added += flush(conn)
+                    batch = []
+            if batch:
+                added += flush(conn)
+        self.added += added
+        return added
+
+    def claim(self) -> str | None:
+        """Claims the next claimable contract, None if there is none right now"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # abandoned claims of contracts that keep getting their jobs killed are given up on
+                conn.execute(f'UPDATE items SET status = :failed, owner = NULL WHERE {ABANDONED} AND attempts >= :max_attempts',
+                             self._claimable_params(now) | {'failed': FAILED})
+                row = conn.execute(f'SELECT name FROM items WHERE {CLAIMABLE} ORDER BY priority, rowid LIMIT 1', self._claimable_params(now)).fetchone()
+                if row is not None:
+                    conn.execute('UPDATE items SET status = ?, owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE name = ?',
+                                 (CLAIMED, self.owner, now + self.lease, row[0]))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return row[0] if row is not None else None
+
+    def claims(self, feed: Iterable[tuple[str, int]] = (), chunk_size: int = ENQUEUE_CHUNK) -> Iterator[str | None]:
+        """
+        Claims contracts one at a time, until none are left pending or claimed (by any instance).
+        The (filename, priority) pairs of `feed` are added to the queue `chunk_size` at a time, whenever fewer are pending,
+        so streamed inputs are only consumed as the work progresses.
+        Yields None while none can be claimed yet (they are held back by the ones of a lower priority, or leased),
+        for the caller to come back after POLL_INTERVAL, as leases of killed instances may expire and its own claims finish.
+        """
+        feed = iter(feed)
+        feed_exhausted = False
+        while True:
+            if not feed_exhausted and self.pending() < chunk_size:
+                chunk = list(islice(feed, chunk_size))
+                feed_exhausted = len(chunk) < chunk_size
+                self.enqueue(chunk)
+            name = self.claim()
+            if name is None and feed_exhausted and self.outstanding() == 0:
+                return
+            yield name
+
+    def claimable(self, limit: int) -> int:
+        """Number of contracts that can be claimed right now, saturating at `limit`"""
+        with self._connect() as conn:
+            return conn.execute(f'SELECT COUNT(*) FROM (SELECT 1 FROM items WHERE {CLAIMABLE} LIMIT :limit)',
+                                self._claimable_params(time.time()) | {'limit': limit}).fetchone()[0]
+
+    def pending(self) -> int:
+        """Number of contracts pending"""
+        with self._connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM items WHERE status = ?', (PENDING,)).fetchone()[0]
+
+    def outstanding(self) -> int:
+        """Number of contracts pending or claimed"""
+        with self._connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM items WHERE status IN (?, ?)', (PENDING, CLAIMED)).fetchone()[0]
+
+    def owns(self, name: str) -> bool:
+        """Whether the contract is claimed by this instance"""
+        with self._connect() as conn:
+            return conn.execute('SELECT 1 FROM items WHERE name = ? AND owner = ? AND status = ?', (name, self.owner, CLAIMED)).fetchone() is not None
+
+    @staticmethod
+    def _claimable_params(now: float) -> dict[str, object]:
+        return {'max_attempts': MAX_ATTEMPTS, 'pending': PENDING, 'claimed': CLAIMED, 'now': now}
+
+    def renew(self) -> None:
+        """Extends the leases of all contracts claimed by this instance"""
+        self.last_renewal = time.time()
+        with self._connect() as conn:
+            conn.execute('UPDATE items SET lease_expires = ? WHERE owner = ? AND status = ?',
+                         (self.last_renewal + self.lease, self.owner, CLAIMED))
+
+    def renew_if_due(self) -> None:
+        if time.time() - self.last_renewal > self.lease / 3:
+            self.renew()
+
+    def ack(self, name: str, done: bool = True) -> bool:
+        """
+        Acknowledges a claimed contract: done, or interrupted (e.g. its job was killed), in which case it is claimable again,
+        unless it has been attempted MAX_ATTEMPTS times. Returns whether the contract is settled (done or failed),
+        i.e. its inputs are no longer needed.
+        """
+        with self._connect() as conn:
+            if done:
+                rows = conn.execute('UPDATE items SET status = ?, lease_expires = NULL WHERE name = ? AND owner = ? RETURNING status',
+                                    (DONE, name, self.owner)).fetchall()
+            else:
+                rows = conn.execute('UPDATE items SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, owner = NULL, lease_expires = NULL '
+                                    'WHERE name = ? AND owner = ? RETURNING status', (MAX_ATTEMPTS, FAILED, PENDING, name, self.owner)).fetchall()
+        # a contract no longer claimed by this instance (its lease expired and it was claimed again) is someone else's to settle
+        return bool(rows) and rows[0][0] in (DONE, FAILED)
+
+    def counts(self) -> dict[str, int]:
+        with self._connect() as conn:
+            return dict(conn.execute('SELECT status, COUNT(*) FROM items GROUP BY status').fetchall())
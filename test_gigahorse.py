@@ -4,16 +4,120 @@ import subprocess
 import pytest
 import re
 import json
-from os.path import abspath, dirname, join, isdir, isfile
-from os import listdir, makedirs
+import hashlib
+from os.path import abspath, basename, dirname, join, isdir, isfile
+from os import cpu_count, environ, listdir, makedirs
+from pathlib import Path
 from typing import Mapping, MutableMapping, Any, Iterator
 
+from filelock import FileLock
+
 GIGAHORSE_TOOLCHAIN_ROOT = dirname(abspath(__file__))
 
 DEFAULT_TEST_DIR = join(GIGAHORSE_TOOLCHAIN_ROOT, 'tests')
 
 TEST_WORKING_DIR = join(GIGAHORSE_TOOLCHAIN_ROOT, '.tests')
 
+PERF_TOLERANCES: dict[str, tuple[float, float]] = {
+    'decomp_time': (0.5, 2.0),
+    'inline_time': (0.5, 2.0),
+    'client_time': (0.5, 2.0),
+    'peak_memory': (0.25, 50_000_000),
+}
+"""Relative and absolute slack of each measurement of the perf tests over its baseline, before it counts as a regression"""
+
+
+def perf_measurements(analytics: Mapping[str, Any]) -> dict[str, float]:
+    stages = analytics.get('resource_usage', {}).get('stages', {})
+    measurements = {metric: analytics.get(metric, 0) for metric in PERF_TOLERANCES if metric != 'peak_memory'}
+    measurements['peak_memory'] = max((usage['max_rss'] for usage in stages.values()), default=0)
+    return measurements
+
+
+def contract_names_of(test_path: str) -> set[str]:
+    """The names of the contracts of a test, a single contract or a directory of them"""
+    return set(listdir(test_path)) if isdir(test_path) else {basename(test_path)}
+
+
+class LogicTestBatch():
+    """
+    Logic tests with the same client and gigahorse arguments, analyzed together by a single gigahorse.py run with many jobs,
+    whose results are then checked by each test. The contract names within a batch are unique.
+    A batch runs a job per core at most, shared between the xdist workers, so each contract still gets a core to itself.
+    """
+    def __init__(self, name: str, client_path: str | None, gigahorse_args: list[str]):
+        self.name = name
+        self.client_path = client_path
+        self.gigahorse_args = gigahorse_args
+
+        self.test_paths: list[str] = []
+        self.contract_names: set[str] = set()
+
+        self.working_dir = abspath(f'{TEST_WORKING_DIR}/batches/{self.name}')
+        self.results_file = join(self.working_dir, 'results.json')
+
+        self.returncode: int | None = None
+        self.results: list[list[Any]] = []
+
+    def add(self, test_path: str) -> bool:
+        """Adds the contracts of a test, unless one of them has the name of a contract already in the batch"""
+        names = contract_names_of(test_path)
+        if names & self.contract_names:
+            return False
+        self.test_paths.append(test_path)
+        self.contract_names |= names
+        return True
+
+    def command(self, test_paths: list[str], working_dir: str, results_file: str, jobs: int) -> list[str]:
+        client_arg = ['-C', self.client_path] if self.client_path else []
+
+        return [
+            'python3',
+            join(GIGAHORSE_TOOLCHAIN_ROOT, 'gigahorse.py'),
+            *test_paths,
+            '--restart',
+            '--jobs', str(jobs),
+            '--results_file', results_file,
+            '--working_dir', working_dir,
+            *client_arg,
+            *self.gigahorse_args
+        ]
+
+    def compiled(self) -> bool:
+        return '-i' not in self.gigahorse_args and '--interpreted' not in self.gigahorse_args
+
+    def run(self, lock_dir: Path) -> int:
+        """
+        Runs the batch, unless it already ran in this session (possibly in another xdist worker), and loads its results.
+        Returns the exit code of gigahorse.py.
+        """
+        if self.returncode is not None:
+            return self.returncode
+
+        done_path = lock_dir / f'{self.name}.done'
+        with FileLock(str(lock_dir / f'{self.name}.lock')):
+            if done_path.exists():
+                self.returncode = int(done_path.read_text())
+            else:
+                workers = int(environ.get('PYTEST_XDIST_WORKER_COUNT', 1))
+                jobs = max(1, min(len(self.contract_names), (cpu_count() or 1) // workers))
+                result = subprocess.run(self.command(self.test_paths, self.working_dir, self.results_file, jobs), capture_output=True)
+
+                makedirs(self.working_dir, exist_ok=True)
+                with open(join(self.working_dir, 'stdout'), 'wb') as f:
+                    f.write(result.stdout)
+
+                with open(join(self.working_dir, 'stderr'), 'wb') as f:
+                    f.write(result.stderr)
+
+                self.returncode = result.returncode
+                done_path.write_text(str(self.returncode))
+
+        if self.returncode == 0:
+            with open(self.results_file) as f:
+                self.results = json.load(f)
+        return self.returncode
+
 
 class LogicTestCase():
     def __init__(self, name: str, test_root:str, test_path: str, test_config: Mapping[str, Any]):
@@ -25,9 +129,12 @@ class LogicTestCase():
         self.client_path = abspath(join(dirname(test_root), client_path)) if client_path else None
 
         self.test_path = test_path
+        self.contract_names = contract_names_of(test_path)
+
+        self.batch: LogicTestBatch
 
-        self.working_dir = abspath(f'{TEST_WORKING_DIR}/{self.name}')
-        self.results_file = join(self.working_dir, f'results.json')
+        self.perf_working_dir = abspath(f'{TEST_WORKING_DIR}/perf/{self.name}')
+        self.perf_results_file = join(self.perf_working_dir, f'results.json')
 
         self.gigahorse_args = test_config.get('gigahorse_args', [])
         self.contract_specific: dict[str, list[tuple[Any, ...]]] = test_config.get('contract_specific', dict())
@@ -44,36 +151,18 @@ class LogicTestCase():
     def __repr__(self) -> str:
         return self.name
 
-    def __run(self) -> subprocess.CompletedProcess:
-        client_arg = ['-C', self.client_path] if self.client_path else []
-
-        return subprocess.run(
-            [
-                'python3',
-                join(GIGAHORSE_TOOLCHAIN_ROOT, 'gigahorse.py'),
-                self.test_path,
-                '--restart',
-                '--jobs', '1',
-                '--results_file', self.results_file,
-                '--working_dir', self.working_dir,
-                *client_arg,
-                *self.gigahorse_args
-            ],
-            capture_output=True
-        )
-
     def __relation_size(self, name: str) -> int:
         hex_name = self.test_path.split('/')[-1].split('.')[-2]
 
-        if isfile(join(self.working_dir, hex_name, 'out', f'{name}.csv')):
-            path = join(self.working_dir, hex_name, 'out', f'{name}.csv')
+        if isfile(join(self.batch.working_dir, hex_name, 'out', f'{name}.csv')):
+            path = join(self.batch.working_dir, hex_name, 'out', f'{name}.csv')
         else:
-            path = join(self.working_dir, hex_name, f'{name}.csv')
+            path = join(self.batch.working_dir, hex_name, f'{name}.csv')
 
         with open(path) as f:
             return len(f.readlines())
 
-    def run(self):
+    def run(self, lock_dir: Path):
         def within_margin(actual: int, expected: int, margin: float) -> bool:
             return (1 - margin) * expected <= actual <= (1 + margin) * expected
 
@@ -96,33 +185,59 @@ class LogicTestCase():
                     regex = re.compile(expected)
                     assert regex.match(analytics[metric]), f"Value for {metric} ({analytics[metric]}) not the expected value ({expected})."
 
-        result = self.__run()
+        returncode = self.batch.run(lock_dir)
+
+        assert returncode == 0, f"Gigahorse exited with an error code: {returncode}, see {self.batch.working_dir}"
 
-        def get_analytics_for_file(res_file, file_name):
-            for contract in res_file:
-                if contract[0] == file_name:
-                    return contract[3]
-            return None
+        # the results of the other tests of the batch are left to them
+        res_contents = [contract for contract in self.batch.results if contract[0] in self.contract_names]
+        assert sorted(contract[0] for contract in res_contents) == sorted(self.contract_names), f"Results for {sorted(contract[0] for contract in res_contents)}, expected {sorted(self.contract_names)}"
 
-        with open(join(self.working_dir, 'stdout'), 'wb') as f:
+        if not self.contract_specific:
+            (_, _, _, temp_analytics), = res_contents
+            check_analytics(temp_analytics, self.expected_analytics)
+            check_verbatim(temp_analytics, self.expected_verbatim)
+        else:
+            res_analytics = {contract[0]: contract[3] for contract in res_contents}
+            for contract, contract_res in self.contract_specific.items():
+                temp_analytics = res_analytics.get(contract)
+                assert temp_analytics is not None, f"No results for {contract}"
+                check_analytics(temp_analytics, contract_res.get("expected_analytics", dict()))
+                check_verbatim(temp_analytics, contract_res.get("expected_verbatim", dict()))
+
+    def run_perf(self, baselines: MutableMapping[str, Any], update: bool):
+        # a test is timed on its own, with a single job, rather than as part of its batch
+        result = subprocess.run(self.batch.command([self.test_path], self.perf_working_dir, self.perf_results_file, 1), capture_output=True)
+
+        with open(join(self.perf_working_dir, 'stdout'), 'wb') as f:
             f.write(result.stdout)
 
-        with open(join(self.working_dir, 'stderr'), 'wb') as f:
+        with open(join(self.perf_working_dir, 'stderr'), 'wb') as f:
             f.write(result.stderr)
 
         assert result.returncode == 0, f"Gigahorse exited with an error code: {result.returncode}"
 
-        with open(self.results_file) as f:
-            res_contents = json.load(f)
-            if not self.contract_specific:
-                (_, _, _, temp_analytics), = res_contents
-                check_analytics(temp_analytics, self.expected_analytics)
-                check_verbatim(temp_analytics, self.expected_verbatim)
-            else:
-                for contract, contract_res in self.contract_specific.items():
-                    temp_analytics = get_analytics_for_file(res_contents, contract)
-                    check_analytics(temp_analytics, contract_res.get("expected_analytics", dict()))
-                    check_verbatim(temp_analytics, contract_res.get("expected_verbatim", dict()))
+        with open(self.perf_results_file) as f:
+            measured = {contract: perf_measurements(analytics) for contract, _, _, analytics in json.load(f)}
+
+        if update:
+            baselines[self.name] = measured
+            return
+
+        if self.name not in baselines:
+            pytest.skip(f"No performance baseline for {self.name}, record one with --update-perf-baselines")
+
+        regressions = []
+        for contract, contract_baselines in baselines[self.name].items():
+            for metric, baseline in contract_baselines.items():
+                actual = measured.get(contract, {}).get(metric)
+                relative, absolute = PERF_TOLERANCES[metric]
+                if actual is None:
+                    regressions.append(f"{contract}: no {metric}")
+                elif actual > (1 + relative) * baseline + absolute:
+                    regressions.append(f"{contract}: {metric} of {actual} over the baseline of {baseline}")
+
+        assert not regressions, "Performance regressions:\n" + "\n".join(regressions)
                 
 
 
@@ -151,6 +266,31 @@ def discover_logic_tests(current_config: MutableMapping[str, Any], directory: st
             yield from discover_logic_tests(current_config, entry_path)
 
 
+def assign_batches(tests: list[LogicTestCase]) -> list[LogicTestBatch]:
+    """Groups the tests by client and gigahorse arguments, splitting a group when contract names collide"""
+    groups: dict[str, list[LogicTestBatch]] = {}
+    for test in tests:
+        key = json.dumps([test.client_path, test.gigahorse_args])
+        group = groups.setdefault(key, [])
+        batch = next((batch for batch in group if batch.add(test.test_path)), None)
+        if batch is None:
+            batch = LogicTestBatch(f'{hashlib.md5(key.encode()).hexdigest()[:12]}-{len(group)}', test.client_path, test.gigahorse_args)
+            batch.add(test.test_path)
+            group.append(batch)
+        test.batch = batch
+
+    return [batch for group in groups.values() for batch in group]
+
+
+def compilation_batches() -> list[LogicTestBatch]:
+    """A batch of each client and gigahorse arguments using compiled programs, to compile them before the tests run"""
+    unique: dict[tuple[str | None, tuple[str, ...]], LogicTestBatch] = {}
+    for batch in batches:
+        if batch.compiled():
+            unique.setdefault((batch.client_path, tuple(batch.gigahorse_args)), batch)
+    return list(unique.values())
+
+
 def collect_tests(test_dirs: list[str]):
     makedirs(TEST_WORKING_DIR, exist_ok=True)
 
@@ -166,9 +306,76 @@ def collect_tests(test_dirs: list[str]):
 
 testdata = []
 
+batches: list[LogicTestBatch] = []
+
 collect_tests([DEFAULT_TEST_DIR])
 
 
 @pytest.mark.parametrize("gigahorse_test", testdata)
-def test_gigahorse(gigahorse_test):
-    gigahorse_test.run()
+def test_gigahorse(gigahorse_test, gigahorse_batch_dir):
+    gigahorse_test.run(gigahorse_batch_dir)
+
+
+@pytest.mark.perf
+@pytest.mark.parametrize("gigahorse_test", testdata)
+def test_gigahorse_perf(gigahorse_test, perf_baselines, update_perf_baselines):
+    gigahorse_test.run_perf(perf_baselines, update_perf_baselines)
+
+
+def test_killed_job_retried_from_queue(tmp_path):
+    """A streamed contract whose job got killed stays spooled, so the next instance working on the queue can analyze it"""
+    from multiprocessing import Process
+    from time import sleep
+
+    from gigahorse import settle_contract
+    from src.inputs import ContractSpool, StreamedContract
+    from src.work_queue import WorkQueue
+
+    working_dir = str(tmp_path / 'working_dir')
+    queue_file = str(tmp_path / 'queue.db')
+    results_file = str(tmp_path / 'results.json')
+
+    with open(join(DEFAULT_TEST_DIR, 'core-decompiler', '11116421e77b80a26b273843d54829d8.hex')) as f:
+        contract = StreamedContract('killed', f.read().strip())
+
+    spool = ContractSpool(working_dir)
+    contract_filename = spool.materialize(contract)
+    work_queue = WorkQueue(queue_file)
+    work_queue.enqueue([(contract_filename, 0)])
+    assert work_queue.claim() == contract_filename
+
+    job = Process(target=sleep, args=(60,))
+    job.start()
+    job.kill()
+    job.join()
+    settle_contract(contract_filename, job.exitcode == 0, spool, work_queue)
+
+    assert isfile(contract_filename), "The contract of a killed job was released before its retry"
+    assert work_queue.counts() == {'pending': 1}
+
+    result = subprocess.run(['python3', join(GIGAHORSE_TOOLCHAIN_ROOT, 'gigahorse.py'), '--queue', queue_file, '--jobs', '1',
+                             '--working_dir', working_dir, '--results_file', results_file], capture_output=True)
+    assert result.returncode == 0, f"Gigahorse exited with an error code: {result.returncode}\n{result.stderr.decode()}"
+
+    with open(results_file) as f:
+        (name, _, meta, _), = json.load(f)
+    assert name == 'killed.hex'
+    assert 'ERROR' not in meta, f"The retry failed: {meta}"
+    assert work_queue.counts() == {'done': 1}
+    assert not isfile(contract_filename)
+
+
+@pytest.mark.parametrize("num_blocks, tier", [(1, 'default'), (4000, 'default'), (4001, 'large'), (12000, 'large'), (12001, 'huge'), (100_000, 'huge')])
+def test_limitsize_tier_selection(num_blocks, tier):
+    from src.runners import select_limitsize_tier
+
+    assert select_limitsize_tier(num_blocks).name == tier
+
+
+def test_limitsize_tiers_shrink():
+    from src.runners import LIMITSIZE_TIERS
+
+    for smaller, larger in zip(LIMITSIZE_TIERS, LIMITSIZE_TIERS[1:]):
+        assert larger.block_output_contents < smaller.block_output_contents
+        assert larger.big_block_output_contents < smaller.big_block_output_contents
+        assert larger.can_reach_under_context < smaller.can_reach_under_context
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+
+"""
+Runs a corpus of contracts under several gigahorse.py configurations, with repeated trials on pinned CPUs,
+and reports how their runtime, memory, timeouts and the analytics compared by compare-runs.py differ from the first configuration
+"""
+
+import argparse
+import importlib.util
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import shlex
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+from dataclasses import dataclass, field
+from os.path import join
+from pathlib import Path
+from typing import Any
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.common import log, peak_memory
+from src.results import iter_results
+
+GIGAHORSE = str(Path(__file__).resolve().parent.parent / 'gigahorse.py')
+
+
+def load_compare_runs() -> Any:
+    """compare-runs.py, whose analytic tables are reused (its name is not importable)"""
+    spec = importlib.util.spec_from_file_location('compare_runs', Path(__file__).resolve().parent / 'compare-runs.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+compare_runs = load_compare_runs()
+
+TIME_ANALYTICS = ['decomp_time', 'inline_time', 'client_time']
+
+RESOURCE_METRICS = {
+    'analysis_time': 'scalability',
+    'decomp_time': 'scalability',
+    'inline_time': 'scalability',
+    'client_time': 'scalability',
+    'peak_memory': 'scalability',
+}
+"""Metrics of every contract besides its analytics, all of them better when lower"""
+
+EXACT_PAIRS = 16
+"""Paired tests over at most this many contracts enumerate every sign assignment, larger ones use the normal approximation"""
+
+EXACT_PERMUTATIONS = 100_000
+"""Two-sample tests with at most this many permutations enumerate them all, others sample SAMPLED_PERMUTATIONS of them"""
+
+SAMPLED_PERMUTATIONS = 10_000
+
+SIGNIFICANCE_LEVEL = 0.05
+
+
+@dataclass
+class Configuration:
+    name: str
+    args: list[str]
+
+
+@dataclass
+class ContractRun:
+    has_output: bool
+    timed_out: bool
+    metrics: dict[str, float]
+
+
+@dataclass
+class TrialRun:
+    wall_time: float
+    contracts: dict[str, ContractRun] = field(default_factory=dict)
+
+
+def configuration_arg(value: str) -> Configuration:
+    name, sep, config_args = value.partition('=')
+    if not sep or not name or '/' in name:
+        raise argparse.ArgumentTypeError(f"configurations are given as NAME=ARGS, got {value!r}")
+    return Configuration(name, shlex.split(config_args))
+
+
+def cpu_list_arg(value: str) -> set[int]:
+    """A CPU list in the format of taskset -c, e.g. 0-3,8"""
+    cpus = set()
+    try:
+        for part in value.split(','):
+            first, _, last = part.partition('-')
+            cpus.update(range(int(first), int(last or first) + 1))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid CPU list {value!r}")
+    return cpus
+
+
+def numeric(value: Any) -> float:
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, (list, str)):
+        return len(value)
+    return 0
+
+
+def load_trial(results_file: str, wall_time: float, metrics: dict[str, str]) -> TrialRun:
+    trial = TrialRun(wall_time)
+    if not os.path.exists(results_file):
+        log(f"[WARNING]: {results_file} is missing, the run has no results")
+        return trial
+    for name, files, meta, analytics in iter_results(results_file, set(metrics) | {'resource_usage'}):
+        contract_metrics = {metric: numeric(analytics.get(metric, 0)) for metric in metrics if metric not in RESOURCE_METRICS}
+        contract_metrics |= {t: analytics.get(t, 0) for t in TIME_ANALYTICS}
+        contract_metrics['analysis_time'] = sum(analytics.get(t, 0) for t in TIME_ANALYTICS)
+        contract_metrics['peak_memory'] = peak_memory(analytics)
+        trial.contracts[name.replace('.hex', '')] = ContractRun(
+            has_output=bool(files) and 'CLIENT TIMEOUT' not in meta,
+            timed_out=any('TIMEOUT' in m for m in meta),
+            metrics=contract_metrics
+        )
+    return trial
+
+
+def run_trial(config: Configuration, trial_dir: str, corpus: list[str], gigahorse_args: list[str], cpus: set[int] | None, keep_working_dir: bool) -> float:
+    """Runs gigahorse.py on the corpus, returning its wall time. The results file is left in trial_dir."""
+    os.makedirs(trial_dir, exist_ok=True)
+    working_dir = join(trial_dir, 'work')
+    cmd = [sys.executable, GIGAHORSE, *corpus, '--restart', '-w', working_dir, '-r', join(trial_dir, 'results.json'), *gigahorse_args, *config.args]
+
+    start = time.time()
+    with open(join(trial_dir, 'gigahorse.log'), 'w') as log_file:
+        # the analysis processes inherit the affinity of gigahorse.py
+        proc = subprocess.run(cmd, stdout=log_file, stderr=subprocess.STDOUT,
+                              preexec_fn=(lambda: os.sched_setaffinity(0, cpus)) if cpus else None)
+    wall_time = time.time() - start
+
+    if proc.returncode != 0:
+        log(f"[WARNING]: gigahorse.py exited with {proc.returncode}, see {join(trial_dir, 'gigahorse.log')}")
+    if not keep_working_dir:
+        shutil.rmtree(working_dir, ignore_errors=True)
+    return wall_time
+
+
+def paired_permutation_test(differences: list[float]) -> float:
+    """
+    Two-sided p-value of the sign-flip permutation test of paired differences (e.g. of a metric per contract between two configurations).
+    Exact for up to EXACT_PAIRS non-zero differences, otherwise the normal approximation of the permutation distribution.
+    """
+    diffs = [d for d in differences if d != 0]
+    if not diffs:
+        return 1.0
+    observed = abs(sum(diffs))
+    if len(diffs) <= EXACT_PAIRS:
+        tolerance = 1e-9 * observed
+        extreme = sum(1 for signs in itertools.product((1, -1), repeat=len(diffs))
+                      if abs(sum(s * d for s, d in zip(signs, diffs))) >= observed - tolerance)
+        return extreme / 2 ** len(diffs)
+    return math.erfc(observed / math.sqrt(2 * sum(d * d for d in diffs)))
+
+
+def two_sample_permutation_test(a: list[float], b: list[float], rng: random.Random) -> float:
+    """Two-sided p-value of the permutation test of the difference of the means of two samples (e.g. the wall times of the trials of two configurations)"""
+    if not a or not b:
+        return 1.0
+    pooled = a + b
+    observed = abs(statistics.mean(a) - statistics.mean(b))
+    tolerance = 1e-9 * observed
+
+    def extreme(indices: set[int]) -> bool:
+        first = [v for i, v in enumerate(pooled) if i in indices]
+        second = [v for i, v in enumerate(pooled) if i not in indices]
+        return abs(statistics.mean(first) - statistics.mean(second)) >= observed - tolerance
+
+    if math.comb(len(pooled), len(a)) <= EXACT_PERMUTATIONS:
+        splits = [set(c) for c in itertools.combinations(range(len(pooled)), len(a))]
+        return sum(1 for s in splits if extreme(s)) / len(splits)
+    hits = sum(1 for _ in range(SAMPLED_PERMUTATIONS) if extreme(set(rng.sample(range(len(pooled)), len(a)))))
+    return (hits + 1) / (SAMPLED_PERMUTATIONS + 1)
+
+
+def contract_metric(trials: list[TrialRun], contract: str, metric: str) -> float:
+    """The median of a metric of a contract over the trials of a configuration"""
+    return statistics.median(t.contracts[contract].metrics.get(metric, 0) for t in trials)
+
+
+def majority_timeouts(trials: list[TrialRun]) -> set[str]:
+    """Contracts timing out in most trials of a configuration"""
+    counts: dict[str, int] = {}
+    for trial in trials:
+        for name, run in trial.contracts.items():
+            counts[name] = counts.get(name, 0) + run.timed_out
+    return {name for name, count in counts.items() if 2 * count > len(trials)}
+
+
+def compare(configs: list[Configuration], trials: dict[str, list[TrialRun]], metrics: dict[str, str], rng: random.Random) -> dict[str, Any]:
+    """The comparison of every configuration with the first one, the baseline"""
+    baseline = configs[0].name
+    common = set.intersection(*(
+        {name for name, run in trial.contracts.items() if run.has_output}
+        for config_trials in trials.values() for trial in config_trials
+    ))
+    baseline_timeouts = majority_timeouts(trials[baseline])
+
+    report: dict[str, Any] = {'baseline': baseline, 'common_contracts': len(common), 'configurations': {}}
+    for config in configs:
+        config_trials = trials[config.name]
+        wall_times = [t.wall_time for t in config_trials]
+        timeouts = majority_timeouts(config_trials)
+        config_report = report['configurations'][config.name] = {
+            'args': config.args,
+            'wall_times': wall_times,
+            'wall_time_p_value': two_sample_permutation_test(wall_times, [t.wall_time for t in trials[baseline]], rng),
+            'timeouts_per_trial': statistics.mean(sum(r.timed_out for r in t.contracts.values()) for t in config_trials),
+            'new_timeouts': sorted(timeouts - baseline_timeouts),
+            'fixed_timeouts': sorted(baseline_timeouts - timeouts),
+            'metrics': {},
+        }
+        for metric in metrics:
+            values = {c: contract_metric(config_trials, c, metric) for c in common}
+            differences = [values[c] - contract_metric(trials[baseline], c, metric) for c in common]
+            config_report['metrics'][metric] = {
+                'total': sum(values.values()),
+                'p_value': paired_permutation_test(differences),
+            }
+    return report
+
+
+def log_report(report: dict[str, Any], metrics: dict[str, str]) -> None:
+    baseline = report['configurations'][report['baseline']]
+
+    def change(value: float, base: float) -> str:
+        return f" ({100 * (value - base) / base:+.4g}%)" if base and value != base else ""
+
+    def verdict(metric: str, value: float, base: float, p_value: float) -> str:
+        if value == base or p_value >= SIGNIFICANCE_LEVEL:
+            return ""
+        better = compare_runs.analytic_comp[metrics[metric]](value) < compare_runs.analytic_comp[metrics[metric]](base)
+        return " \x1b[32mbetter\x1b[0m" if better else " \x1b[31mworse\x1b[0m"
+
+    log('-'*80)
+    log(f"Benchmark against {report['baseline']} ({report['common_contracts']} contracts with output in every trial, p-values vs the baseline)")
+    log('-'*80)
+    for name, config in report['configurations'].items():
+        log(f"\033[1m{name}\033[0m: {shlex.join(config['args']) or '(default arguments)'}")
+        mean_wall = statistics.mean(config['wall_times'])
+        base_wall = statistics.mean(baseline['wall_times'])
+        spread = f" ± {statistics.stdev(config['wall_times']):.1f}" if len(config['wall_times']) > 1 else ""
+        log(f"  wall time: {mean_wall:.1f}{spread} secs{change(mean_wall, base_wall)}, p={config['wall_time_p_value']:.3g}"
+            f"{verdict('analysis_time', mean_wall, base_wall, config['wall_time_p_value'])}")
+        log(f"  timeouts: {config['timeouts_per_trial']:.1f} per trial, {len(config['new_timeouts'])} new, {len(config['fixed_timeouts'])} fixed")
+        for metric, stats in config['metrics'].items():
+            base = baseline['metrics'][metric]['total']
+            log(f"  {metric}: {stats['total']:.6g}{change(stats['total'], base)}, p={stats['p_value']:.3g}"
+                f"{verdict(metric, stats['total'], base, stats['p_value'])}")
+    log('\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs a corpus under several gigahorse.py configurations, with repeated trials,"
+                                                 " and reports how they compare with the first one.")
+    parser.add_argument('corpus', nargs='+', metavar='CONTRACT',
+                        help="The contracts (or directories of contracts) to analyze, as given to gigahorse.py.")
+    parser.add_argument('-c', '--config', dest='configs', type=configuration_arg, action='append', required=True, metavar='NAME=ARGS',
+                        help="A configuration: a name and the gigahorse.py arguments it adds, e.g. cs='-M CONTEXT_SENSITIVITY=CallSiteContext'."
+                        " Can be given many times, the first one is the baseline.")
+    parser.add_argument('-n', '--trials', type=int, default=5, metavar='NUM',
+                        help="The number of runs of every configuration (default: 5).")
+    parser.add_argument('--cpus', type=cpu_list_arg, default=None, metavar='LIST',
+                        help="The CPUs every run is pinned to, as a list like 0-3,8 (default: no pinning)."
+                        " Unless gigahorse.py arguments set -j, it is set to the number of CPUs.")
+    parser.add_argument('-o', '--output_dir', default='benchmark', metavar='DIR',
+                        help="Where the results file and log of every run and the report are written (default: benchmark).")
+    parser.add_argument('--warmup', action='store_true',
+                        help="Runs every configuration once before the trials, so that no trial includes the compilation of its programs.")
+    parser.add_argument('--keep_working_dirs', action='store_true',
+                        help="Keeps the working directory of every run, which are removed by default.")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="The seed of the sampled permutation tests (default: 0).")
+    parser.add_argument('-d', '--decomp', action='store_true',
+                        help='Includes the core decompilation analytics of compare-runs.py')
+    parser.add_argument('-m', '--memory', action='store_true',
+                        help='Includes the memory modeling analytics of compare-runs.py')
+    parser.add_argument('-s', '--storage', action='store_true',
+                        help='Includes the storage modeling analytics of compare-runs.py')
+    parser.add_argument('--clients', action='store_true',
+                        help='Includes the client analytics of compare-runs.py')
+    parser.add_argument('-a', '--gigahorse_args', type=shlex.split, default=[], metavar='ARGS',
+                        help="Arguments given to gigahorse.py in every configuration, e.g. -a '-T 600 -C clients/foo.dl'.")
+
+    args = parser.parse_args()
+    logging.basicConfig(format='%(message)s', level=logging.INFO + 1)
+
+    names = [config.name for config in args.configs]
+    if len(set(names)) != len(names):
+        parser.error("configuration names must be unique")
+    if args.cpus and not hasattr(os, 'sched_setaffinity'):
+        parser.error("--cpus is not supported on this platform")
+
+    if args.trials < 1:
+        parser.error("at least one trial is needed")
+
+    gigahorse_args = args.gigahorse_args
+    if args.cpus and not {'-j', '--jobs'} & set(gigahorse_args):
+        gigahorse_args += ['-j', str(len(args.cpus))]
+
+    metrics = dict(RESOURCE_METRICS)
+    for enabled, table in [(True, compare_runs.analytics), (args.decomp, compare_runs.decomp_analytics), (args.memory, compare_runs.mem_analytics),
+                           (args.storage, compare_runs.storage_analytics), (args.clients, compare_runs.clients_analytics)]:
+        if enabled:
+            metrics |= table
+
+    if args.warmup:
+        for config in args.configs:
+            log(f"Warming up {config.name}")
+            run_trial(config, join(args.output_dir, config.name, 'warmup'), args.corpus, gigahorse_args, args.cpus, False)
+
+    trials: dict[str, list[TrialRun]] = {name: [] for name in names}
+    for trial in range(args.trials):
+        # the order of the configurations rotates every trial, spreading any drift of the machine over all of them
+        for config in args.configs[trial % len(args.configs):] + args.configs[:trial % len(args.configs)]:
+            trial_dir = join(args.output_dir, config.name, f'trial{trial}')
+            log(f"Running {config.name}, trial {trial + 1}/{args.trials}")
+            wall_time = run_trial(config, trial_dir, args.corpus, gigahorse_args, args.cpus, args.keep_working_dirs)
+            trials[config.name].append(load_trial(join(trial_dir, 'results.json'), wall_time, metrics))
+
+    report = compare(args.configs, trials, metrics, random.Random(args.seed))
+    log_report(report, metrics)
+
+    report_file = join(args.output_dir, 'report.json')
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=1)
+    log(f"Report written to {report_file}")
@@ -1,7 +1,11 @@
-import json
+import sys
 from pathlib import Path
 import argparse
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.results import iter_results
+
 rels = [
 #  'Analytics_NonModeledMSTORE',
 #  'Analytics_NonModeledMLOAD',
@@ -17,7 +21,8 @@ analytic_comp = {
   'precision': lambda x: -x,
   'imprecision': lambda x: x,
   'completeness': lambda x: -x,
-  'incompleteness': lambda x: x
+  'incompleteness': lambda x: x,
+  'unscalability': lambda x: x
 }
 
 analytics = {
@@ -98,8 +103,6 @@ parser.add_argument('-c', '--clients', action='store_true',
                     help='Includes client specific relations and analytics')
 parser.add_argument('--point_to_point', type=str)
 
-args = parser.parse_args()
-
 def process_result_file(filename, output_set=None):
     filemap = dict()
 
@@ -112,111 +115,116 @@ def process_result_file(filename, output_set=None):
     filemap['timeout'] = set()
 
     relset = set(rels)
-    with open(filename) as json_file:
-        data = json.load(json_file)
-        for contract in data:
-            name = contract[0].replace('.hex', '')
-            have_output = set(contract[1])
-            client_success = "CLIENT TIMEOUT" not in contract[2]
-
+    # only the analytics compared are decoded and kept, the results are streamed
+    analytics_keys = set(analytics.keys())
+    if args.point_to_point:
+        analytics_keys.add(args.point_to_point)
+    for contract in iter_results(filename, analytics_keys):
+        name = contract[0].replace('.hex', '')
+        have_output = set(contract[1])
+        client_success = "CLIENT TIMEOUT" not in contract[2]
+
+        if args.point_to_point:
             filemap[name] = dict()
-            filemap[name]["rels"] = have_output
-            filemap[name]["analytics"] = contract[3]
-            if output_set and name not in output_set:
-                continue
-            if have_output and client_success:
-                filemap['has_output'].add(name)
-            else:
-                filemap['timeout'].add(name)
+            filemap[name]["analytics"] = {args.point_to_point: contract[3].get(args.point_to_point, 0)}
+        if output_set and name not in output_set:
+            continue
+        if have_output and client_success:
+            filemap['has_output'].add(name)
+        else:
+            filemap['timeout'].add(name)
 
-            for rel in relset & have_output:
-                #print(f'contract {name} has vuln {vuln}')
-                filemap[rel].add(name)
+        for rel in relset & have_output:
+            #print(f'contract {name} has vuln {vuln}')
+            filemap[rel].add(name)
 
-            for analytic in analytics.keys():
-                if analytic in contract[3]:
-                    filemap[analytic] += contract[3][analytic]
+        for analytic in analytics.keys():
+            if analytic in contract[3]:
+                filemap[analytic] += contract[3][analytic]
 
-            #break
+        #break
     return filemap
 
-if args.decomp:
-    analytics |= decomp_analytics
+if __name__ == '__main__':
+    args = parser.parse_args()
 
-if args.memory:
-    analytics |= mem_analytics
+    if args.decomp:
+        analytics |= decomp_analytics
 
-if args.storage:
-    analytics |= storage_analytics
+    if args.memory:
+        analytics |= mem_analytics
 
-if args.clients:
-    analytics |= clients_analytics
+    if args.storage:
+        analytics |= storage_analytics
 
-# add it as an analytic with completeness as a placeholder
-if args.point_to_point:
-    analytics |= {args.point_to_point: 'completeness'}
+    if args.clients:
+        analytics |= clients_analytics
 
-result_files = args.result_files
+    # add it as an analytic with completeness as a placeholder
+    if args.point_to_point:
+        analytics |= {args.point_to_point: 'completeness'}
 
-result_files_simple = [Path(file).stem for file in result_files]
+    result_files = args.result_files
 
-results_processed = [process_result_file(file) for file in result_files]
+    result_files_simple = [Path(file).stem for file in result_files]
 
-has_out = [res['has_output'] for res in results_processed]
+    results_processed = [process_result_file(file) for file in result_files]
 
-has_timeout = [res['timeout'] for res in results_processed]
+    has_out = [res['has_output'] for res in results_processed]
 
-output_in_any = set.union(*has_out)
+    has_timeout = [res['timeout'] for res in results_processed]
 
-output_in_all = set.intersection(*has_out)
+    output_in_any = set.union(*has_out)
 
-timeout_in_all = set.intersection(*has_timeout)
+    output_in_all = set.intersection(*has_out)
 
-results_processed_common = [process_result_file(file, output_in_all) for file in result_files]
+    timeout_in_all = set.intersection(*has_timeout)
 
-print(f"{len(timeout_in_all) + len(output_in_any)} total contracts")
-print("")
-for i in range(0, len(result_files)):
-    solo = has_out[i] - set.union(*[has_out[j] for j in range(len(has_out)) if j != i])
-    print(f"{len(has_out[i])} contracts decompiled/analyzed by {result_files_simple[i]} ({len(solo)} exclusively)")
-print("")
-print(f"{len(output_in_any)} contracts decompiled/analyzed by some config")
-print(f"{len(output_in_all)} contracts decompiled/analyzed by all configs \033[1m(common)\033[0m")
+    results_processed_common = [process_result_file(file, output_in_all) for file in result_files]
 
-if args.verbose:
-    print(f"Contracts that timed out for all configs:")
-    for contract in timeout_in_all:
-        print(contract)
-
-if len(result_files) == 2:
-    for rel in rels + ['has_output']:
-        not_in_file1 = results_processed[1][rel] - results_processed[0][rel]
-        not_in_file2 = results_processed[0][rel] - results_processed[1][rel]
-        print(len(results_processed[0][rel]), len(results_processed[1][rel]))
-        print(f'\n\nFor {rel} {len(not_in_file1)} not detected by config {result_files_simple[0]}: {not_in_file1}')
-        print(f'For {rel} {len(not_in_file2)} not detected by config {result_files_simple[1]}: {not_in_file2}')
+    print(f"{len(timeout_in_all) + len(output_in_any)} total contracts")
+    print("")
+    for i in range(0, len(result_files)):
+        solo = has_out[i] - set.union(*[has_out[j] for j in range(len(has_out)) if j != i])
+        print(f"{len(has_out[i])} contracts decompiled/analyzed by {result_files_simple[i]} ({len(solo)} exclusively)")
+    print("")
+    print(f"{len(output_in_any)} contracts decompiled/analyzed by some config")
+    print(f"{len(output_in_all)} contracts decompiled/analyzed by all configs \033[1m(common)\033[0m")
 
-for analytic, kind in analytics.items():
-    print(f'\n\033[1mANALYTIC: {analytic}\033[0m')
     if args.verbose:
+        print(f"Contracts that timed out for all configs:")
+        for contract in timeout_in_all:
+            print(contract)
+
+    if len(result_files) == 2:
+        for rel in rels + ['has_output']:
+            not_in_file1 = results_processed[1][rel] - results_processed[0][rel]
+            not_in_file2 = results_processed[0][rel] - results_processed[1][rel]
+            print(len(results_processed[0][rel]), len(results_processed[1][rel]))
+            print(f'\n\nFor {rel} {len(not_in_file1)} not detected by config {result_files_simple[0]}: {not_in_file1}')
+            print(f'For {rel} {len(not_in_file2)} not detected by config {result_files_simple[1]}: {not_in_file2}')
+
+    for analytic, kind in analytics.items():
+        print(f'\n\033[1mANALYTIC: {analytic}\033[0m')
+        if args.verbose:
+            for i in range(0, len(result_files)):
+                print(f'{result_files_simple[i]}: {results_processed[i][analytic]}')
+
+        pref = sorted([result[analytic] for result in results_processed_common], key=analytic_comp[kind])[0]
         for i in range(0, len(result_files)):
-            print(f'{result_files_simple[i]}: {results_processed[i][analytic]}')
-
-    pref = sorted([result[analytic] for result in results_processed_common], key=analytic_comp[kind])[0]
-    for i in range(0, len(result_files)):
-        diff = results_processed_common[i][analytic] - pref
-        percentage = 100 * (results_processed_common[i][analytic] - pref)/pref if pref > 0 else 0
-        extra = f" \x1b[31m({percentage:+.4g}%)\x1b[0m" if diff != 0 else ""
-        print(f'{result_files_simple[i]} \033[1m(common)\033[0m: {results_processed_common[i][analytic]}{extra}')
-
-
-if args.point_to_point:
-    print(args.point_to_point)
-    format_row = "{:>30}" * (len(result_files_simple) + 2)
-    print(format_row.format("", *(["Contract"] + result_files_simple)))
-    for file in output_in_all:
-        # vals = [res[file]["analytics"][args.point_to_point].replace('\n', '') for res in results_processed_common]
-        vals = [res[file]["analytics"].get(args.point_to_point, 0) for res in results_processed_common]
-        if len(set(vals)) == 1:
-            continue
-        print(format_row.format("", *([file] + vals)))
+            diff = results_processed_common[i][analytic] - pref
+            percentage = 100 * (results_processed_common[i][analytic] - pref)/pref if pref > 0 else 0
+            extra = f" \x1b[31m({percentage:+.4g}%)\x1b[0m" if diff != 0 else ""
+            print(f'{result_files_simple[i]} \033[1m(common)\033[0m: {results_processed_common[i][analytic]}{extra}')
+
+
+    if args.point_to_point:
+        print(args.point_to_point)
+        format_row = "{:>30}" * (len(result_files_simple) + 2)
+        print(format_row.format("", *(["Contract"] + result_files_simple)))
+        for file in output_in_all:
+            # vals = [res[file]["analytics"][args.point_to_point].replace('\n', '') for res in results_processed_common]
+            vals = [res[file]["analytics"].get(args.point_to_point, 0) for res in results_processed_common]
+            if len(set(vals)) == 1:
+                continue
+            print(format_row.format("", *([file] + vals)))
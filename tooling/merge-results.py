@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+"""Merges the results files of the shards of a run (gigahorse.py --shard i/N) and reports the stragglers of each shard"""
+
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.common import log
+from src.results import RESULTS_FORMATS, iter_results, log_summary, percentile, write_results_file
+
+TIME_ANALYTICS = ['disassemble_time', 'decomp_time', 'inline_time', 'client_time']
+
+STRAGGLER_SHARD_FACTOR = 1.5
+"""Shards taking this many times the median shard's total analysis time are reported as stragglers"""
+
+
+def analysis_time(analytics: dict) -> float:
+    return sum(analytics.get(t, 0) for t in TIME_ANALYTICS)
+
+
+def report_shards(shard_results: list[tuple[str, list]], slowest: int) -> None:
+    totals = [sum(analysis_time(res[3]) for res in res_list) for _, res_list in shard_results]
+    median_total = percentile(sorted(totals), 50) if totals else 0
+
+    log('-'*80)
+    log('Shards')
+    log('-'*80)
+    for (results_file, res_list), total in zip(shard_results, totals):
+        failed = sum(1 for res in res_list if 'TIMEOUT' in res[2] or 'ERROR' in res[2])
+        straggler = " \033[1m(straggler)\033[0m" if median_total > 0 and total > STRAGGLER_SHARD_FACTOR * median_total else ""
+        log(f"  {results_file}: {len(res_list)} contracts, {failed} timed out or failed, {total:.1f} secs of analysis{straggler}")
+        for name, _, meta, analytics in sorted(res_list, key=lambda res: -analysis_time(res[3]))[:slowest]:
+            flags = f" [{', '.join(meta)}]" if meta else ""
+            log(f"    {name}: {analysis_time(analytics):.1f} secs{flags}")
+    log('\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Merges the results files of the shards of a gigahorse.py run, recomputing its summaries.")
+    parser.add_argument('result_files', nargs='+', metavar='RESULTS_FILE')
+    parser.add_argument('-o', '--output', default='results.json',
+                        help="The merged results file (default: results.json).")
+    parser.add_argument('--format', choices=RESULTS_FORMATS, default='json',
+                        help="The format of the merged results file (default: json). The results files to merge can be in either format.")
+    parser.add_argument('-n', '--slowest', type=int, default=5, metavar='NUM',
+                        help="The number of slowest contracts listed for each shard (default: 5).")
+
+    args = parser.parse_args()
+    logging.basicConfig(format='%(message)s', level=logging.INFO + 1)
+
+    shard_results = []
+    merged: dict[str, list] = {}
+    for results_file in args.result_files:
+        res_list = list(iter_results(results_file))
+        shard_results.append((results_file, res_list))
+        for res in res_list:
+            if res[0] in merged:
+                log(f"[WARNING]: {res[0]} is in more than one results file, keeping the one of {results_file}")
+            merged[res[0]] = res
+
+    report_shards(shard_results, args.slowest)
+
+    merged_list = list(merged.values())
+    log_summary(merged_list)
+
+    log(f"Writing {len(merged_list)} results to {args.output}")
+    write_results_file(merged_list, args.output, args.format)
@@ -0,0 +1,49 @@
+import pytest
+
+from gigahorse import count_lines, get_gigahorse_analytics
+
+
+@pytest.mark.parametrize('content, lines', [(b'', 0), (b'a\n', 1), (b'a\nb', 2), (b'a\nb\n', 2), (b'\n\n', 2)])
+def test_count_lines(tmp_path, monkeypatch, content, lines):
+    monkeypatch.setattr('gigahorse.LINE_COUNT_CHUNK_SIZE', 1)
+    path = tmp_path / 'Metric_Rows.csv'
+    path.write_bytes(content)
+    assert count_lines(str(path), len(content)) == lines
+
+
+def test_analytics(tmp_path):
+    (tmp_path / 'Analytics_Calls.csv').write_text('a\nb\nc\n')
+    (tmp_path / 'Metric_Empty.csv').write_text('')
+    (tmp_path / 'Verbatim_Version.csv').write_text('0.8.19\n')
+    (tmp_path / 'Leaked.csv').write_text('x\n')
+    (tmp_path / 'vulnerability.csv').write_text('Reentrancy\tHigh\tf\nReentrancy\tHigh\tg\nLeak\tLow\th\n')
+
+    analytics: dict = {}
+    get_gigahorse_analytics(str(tmp_path), analytics)
+    assert analytics == {'Analytics_Calls': 3, 'Metric_Empty': 0, 'Verbatim_Version': '0.8.19\n', 'High: Reentrancy': 2, 'Low: Leak': 1}
+
+
+def test_analytics_patterns(tmp_path):
+    (tmp_path / 'Analytics_Calls.csv').write_text('a\n')
+    (tmp_path / 'Analytics_Jumps.csv').write_text('a\n')
+    (tmp_path / 'Verbatim_Version.csv').write_text('0.8.19\n')
+
+    analytics: dict = {}
+    get_gigahorse_analytics(str(tmp_path), analytics, patterns=['Analytics_C*', 'Verbatim_*'])
+    assert analytics == {'Analytics_Calls': 1, 'Verbatim_Version': '0.8.19\n'}
+
+
+def test_relation_sizes(tmp_path):
+    (tmp_path / 'main.dl.sizes').write_text('global.BlockEdge\t100\nglobal.sens.MergeContext\t7\n')
+    (tmp_path / 'fallback_scalable.dl.sizes').write_text('global.BlockEdge\t20\n')
+    # left over from an earlier run which fell back further
+    (tmp_path / 'last_resort.dl.sizes').write_text('global.BlockEdge\t5\n')
+    (tmp_path / 'client.dl.sizes').write_text('Client\t1\n')
+
+    analytics: dict = {}
+    get_gigahorse_analytics(str(tmp_path), analytics, patterns=['Size_*'], sizes_programs=['main.dl', 'fallback_scalable.dl'])
+    assert analytics == {'Size_BlockEdge': 20, 'Size_sens_MergeContext': 7}
+
+    analytics = {}
+    get_gigahorse_analytics(str(tmp_path), analytics, patterns=['Size_*'])
+    assert analytics == {}
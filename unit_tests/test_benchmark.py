@@ -0,0 +1,89 @@
+import argparse
+import importlib.util
+import json
+import random
+import subprocess
+import sys
+from os.path import dirname, join
+
+import pytest
+
+BENCHMARK = join(dirname(dirname(__file__)), 'tooling', 'benchmark.py')
+
+
+def load_benchmark():
+    spec = importlib.util.spec_from_file_location('benchmark', BENCHMARK)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+benchmark = load_benchmark()
+
+
+def test_imports_without_souffle_addon():
+    # src.runners can't be imported without the functors library, which running a benchmark doesn't need
+    check = subprocess.run([sys.executable, '-c', f'import runpy, sys; runpy.run_path({BENCHMARK!r}); assert "src.runners" not in sys.modules'],
+                           capture_output=True, text=True)
+    assert check.returncode == 0, check.stderr
+
+
+def test_arguments():
+    assert benchmark.configuration_arg("cs=-M 'CONTEXT_SENSITIVITY=CallSiteContext' -T 60") == benchmark.Configuration(
+        'cs', ['-M', 'CONTEXT_SENSITIVITY=CallSiteContext', '-T', '60'])
+    assert benchmark.configuration_arg('default=') == benchmark.Configuration('default', [])
+    for invalid in ['no-args', '=-T 60', 'a/b=-T 60']:
+        with pytest.raises(argparse.ArgumentTypeError):
+            benchmark.configuration_arg(invalid)
+
+    assert benchmark.cpu_list_arg('0-3,8') == {0, 1, 2, 3, 8}
+    with pytest.raises(argparse.ArgumentTypeError):
+        benchmark.cpu_list_arg('0-a')
+
+
+def test_paired_permutation_test():
+    assert benchmark.paired_permutation_test([0, 0]) == 1.0
+    # of the 8 sign assignments of three equal differences, the 2 all-equal ones are as extreme as observed
+    assert benchmark.paired_permutation_test([1, 1, 1, 0]) == 0.25
+    assert benchmark.paired_permutation_test([1, -1]) == 1.0
+    consistent = benchmark.paired_permutation_test([1.0] * (benchmark.EXACT_PAIRS + 4))
+    assert consistent < 0.001
+    assert benchmark.paired_permutation_test([1.0, -1.0] * benchmark.EXACT_PAIRS) == 1.0
+
+
+def test_two_sample_permutation_test():
+    rng = random.Random(0)
+    # of the 20 ways to split 6 values in 3 and 3, only the observed split and its mirror are as extreme
+    assert benchmark.two_sample_permutation_test([1, 2, 3], [10, 11, 12], rng) == pytest.approx(0.1)
+    assert benchmark.two_sample_permutation_test([1, 2], [], rng) == 1.0
+    sampled = benchmark.two_sample_permutation_test(list(range(20)), list(range(100, 120)), rng)
+    assert sampled == pytest.approx(1 / (benchmark.SAMPLED_PERMUTATIONS + 1))
+
+
+def write_trial(path, *rows: tuple[str, float, list[str]]) -> str:
+    res_list = [[name, ['Out'] if 'TIMEOUT' not in meta else [], meta,
+                 {'decomp_time': time, 'resource_usage': {'stages': {'decomp': {'max_rss': 1000}}}}] for name, time, meta in rows]
+    path.write_text(json.dumps(res_list))
+    return str(path)
+
+
+def test_compare(tmp_path):
+    metrics = dict(benchmark.RESOURCE_METRICS)
+    configs = [benchmark.Configuration('base', []), benchmark.Configuration('fast', ['-T', '60'])]
+    trials = {
+        'base': [benchmark.load_trial(write_trial(tmp_path / f'base{i}.json', ('a.hex', 2.0, []), ('b.hex', 2.0, []), ('c.hex', 9.0, ['TIMEOUT'])), 10.0, metrics)
+                 for i in range(3)],
+        'fast': [benchmark.load_trial(write_trial(tmp_path / f'fast{i}.json', ('a.hex', 1.0, []), ('b.hex', 1.0, []), ('c.hex', 3.0, [])), 5.0, metrics)
+                 for i in range(3)],
+    }
+    assert trials['base'][0].contracts['a'].metrics['peak_memory'] == 1000
+
+    report = benchmark.compare(configs, trials, metrics, random.Random(0))
+    # only contracts with output in every trial of every configuration are compared
+    assert report['common_contracts'] == 2
+    fast = report['configurations']['fast']
+    assert fast['metrics']['decomp_time']['total'] == 2.0
+    assert fast['metrics']['peak_memory'] == {'total': 2000, 'p_value': 1.0}
+    assert fast['fixed_timeouts'] == ['c'] and fast['new_timeouts'] == []
+    assert fast['wall_time_p_value'] == pytest.approx(0.1)
+    assert report['configurations']['base']['timeouts_per_trial'] == 1
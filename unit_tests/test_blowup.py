@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+import src.blowup as blowup
+from src.blowup import BlowupDetector, DEFAULT_RSS_THRESHOLD, MIN_OBSERVATIONS, RSS_THRESHOLD_MARGIN, learn_rss_thresholds
+
+GB = 1_000_000_000
+
+
+def result(config: str, program: str, max_rss: int, meta: list[str] | None = None) -> list:
+    return [f'{max_rss}.hex', [], meta or [], {'decompiler_config': config, 'resource_usage': {'clients': {program: {'max_rss': max_rss}}}}]
+
+
+@pytest.fixture
+def history_file(tmp_path):
+    res_list = [result('DefaultDecomp', 'main.dl', i * GB) for i in range(1, 101)]
+    # runs that fell back, or failed, say nothing about what a successful run needs
+    res_list += [result('ScalableDecomp', 'main.dl', 500 * GB), result('DefaultDecomp', 'main.dl', 500 * GB, ['TIMEOUT'])]
+    res_list += [result('ScalableDecomp', 'fallback_scalable.dl', GB)] * (MIN_OBSERVATIONS - 1)
+    path = tmp_path / 'results.json'
+    path.write_text(json.dumps(res_list))
+    return str(path)
+
+
+def test_learn_rss_thresholds(history_file):
+    # too few successful runs of the scalable fallback to learn its threshold
+    assert learn_rss_thresholds(history_file) == {'main.dl': int(99 * GB * RSS_THRESHOLD_MARGIN)}
+
+
+@pytest.fixture
+def rss(monkeypatch):
+    """The RSS of the monitored process, as set by the test"""
+    current = [0]
+    monkeypatch.setattr(blowup, 'process_rss', lambda pid: current[0])
+    return current
+
+
+def test_rss_threshold(history_file, rss):
+    detector = BlowupDetector(50 * GB, history_file=history_file)
+    main, scalable = detector.monitor('logic/main.dl', 100), detector.monitor('logic/fallback_scalable.dl', 100)
+
+    rss[0] = 100 * GB
+    assert main(1, 1.0) is None
+    assert scalable(1, 1.0) is not None and 'threshold' in scalable(1, 1.0)
+    rss[0] = int(99 * GB * RSS_THRESHOLD_MARGIN) + 1
+    assert main(1, 2.0) is not None
+
+    # an explicit threshold applies to every program, instead of the learned ones
+    detector = BlowupDetector(50 * GB, rss_threshold=GB, history_file=history_file)
+    assert detector.thresholds == {}
+    rss[0] = GB + 1
+    assert detector.monitor('logic/main.dl', 100)(1, 1.0) is not None
+    assert BlowupDetector(50 * GB).default_threshold == DEFAULT_RSS_THRESHOLD
+
+
+def run_monitor(detector: BlowupDetector, rss: list[int], growth: float, until: float, timeout: float = 100) -> tuple[float, str | None]:
+    """Checks a run whose RSS grows `growth` bytes per second every second, returning when and why it was aborted"""
+    check = detector.monitor('main.dl', timeout)
+    elapsed = 1.0
+    while elapsed <= until:
+        rss[0] = int(growth * elapsed)
+        reason = check(1, elapsed)
+        if reason is not None:
+            return elapsed, reason
+        elapsed += 1
+    return elapsed, None
+
+
+def test_growth_projection(rss):
+    detector = BlowupDetector(100 * GB, rss_threshold=1000 * GB, grace_period=30)
+    # 2 GB/s reaches the 100 GB limit before the 100 secs timeout, which is only acted on after the grace period
+    elapsed, reason = run_monitor(detector, rss, 2 * GB, until=60)
+    assert elapsed == 30 and reason is not None and 'growing' in reason
+    # at 0.5 GB/s, the run stays under the limit until its timeout
+    assert run_monitor(detector, rss, GB / 2, until=90) == (91, None)
+
+
+def test_growth_measured_over_window(rss):
+    detector = BlowupDetector(100 * GB, rss_threshold=1000 * GB, grace_period=0)
+    check = detector.monitor('main.dl', 100)
+    # growth isn't extrapolated until it has been measured over half the window
+    rss[0] = 40 * GB
+    assert check(1, 1.0) is None
+    rss[0] = 80 * GB
+    assert check(1, 2.0) is None
+    assert check(1, 1.0 + blowup.GROWTH_WINDOW / 2) is not None
+
+    # growth that stopped more than a window ago is forgotten
+    check = detector.monitor('main.dl', 100)
+    rss[0] = 40 * GB
+    assert check(1, 1.0) is None
+    rss[0] = 80 * GB
+    for elapsed in range(2, 4):
+        assert check(1, float(elapsed)) is None
+    assert check(1, 3.0 + blowup.GROWTH_WINDOW) is None
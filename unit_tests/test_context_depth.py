@@ -0,0 +1,67 @@
+from os.path import join
+
+from src.context_depth import ContextDepthHistory, DepthPlan
+
+REFERENCE = {'Analytics_JumpToMany': 3, 'Analytics_ReachableBlocks': 100}
+
+
+def result(depth: int, values: dict[str, int] = REFERENCE, **analytics) -> list:
+    return ['c.hex', [], [], {'context_depth': depth, 'decompiler_config': 'DefaultDecomp', 'bytecode_hash': 'h'} | values | analytics]
+
+
+def test_no_plan_without_reference(tmp_path):
+    history = ContextDepthHistory(str(tmp_path / 'history.json'), 20)
+    assert history.plan('c.hex', 'h') is None
+
+    history.record_results([result(16)])
+    assert history.plan('c.hex', 'h') is None
+
+
+def test_plan_lowers_depth_while_identical(tmp_path):
+    history = ContextDepthHistory(str(tmp_path / 'history.json'), 20)
+    history.record_results([result(20)])
+    assert history.plan('c.hex', 'h') == DepthPlan(16, 20, REFERENCE)
+
+    history.record_results([result(16)])
+    assert history.plan('c.hex', 'h') == DepthPlan(12, 16, REFERENCE)
+
+    history.record_results([result(12)])
+    history.save()
+    assert ContextDepthHistory(str(tmp_path / 'history.json'), 20).plan('c.hex', 'h') == DepthPlan(8, 12, REFERENCE)
+
+
+def test_mismatch_not_probed_again(tmp_path):
+    history = ContextDepthHistory(str(tmp_path / 'history.json'), 20)
+    history.record_results([result(20), result(16)])
+
+    # depth 12 changed the result, so the contract was decompiled again with 16
+    history.record_results([result(16, context_depth_mismatch=12)])
+    assert history.plan('c.hex', 'h') == DepthPlan(16, 20, REFERENCE)
+
+    # a depth known to give the same result may stop giving it
+    history.record_results([result(16, {'Analytics_JumpToMany': 5, 'Analytics_ReachableBlocks': 100})])
+    assert history.plan('c.hex', 'h') == DepthPlan(20, 20, REFERENCE)
+
+
+def test_fallback_decompiler_is_mismatch(tmp_path):
+    history = ContextDepthHistory(str(tmp_path / 'history.json'), 20)
+    history.record_results([result(20)])
+    history.record_results([result(16, decompiler_config='ScalableFallback')])
+    assert history.plan('c.hex', 'h') == DepthPlan(20, 20, REFERENCE)
+
+
+def test_changed_bytecode_starts_over(tmp_path):
+    history = ContextDepthHistory(str(tmp_path / 'history.json'), 20)
+    history.record_results([result(20), result(16)])
+    assert history.plan('c.hex', 'other') is None
+
+    history.record_results([result(20, bytecode_hash='other')])
+    assert history.plan('c.hex', 'other') == DepthPlan(16, 20, REFERENCE)
+
+
+def test_plan_matches_reference(tmp_path):
+    for analytic, rows in REFERENCE.items():
+        with open(join(tmp_path, analytic + '.csv'), 'w') as f:
+            f.write('x\n' * rows)
+    assert DepthPlan(16, 20, REFERENCE).matches(str(tmp_path))
+    assert not DepthPlan(16, 20, REFERENCE | {'Analytics_JumpToMany': 4}).matches(str(tmp_path))
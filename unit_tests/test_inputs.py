@@ -0,0 +1,105 @@
+import csv
+import gzip
+import io
+import json
+import os
+import tarfile
+from os.path import join
+
+from src.inputs import ContractSpool, StreamedContract, contract_shard, discover_contracts, is_corpus, iter_corpus, record_to_contract
+
+METADATA = {'abi': [{'type': 'function', 'name': 'f'}]}
+
+
+def test_record_to_contract():
+    assert record_to_contract({'address': '0x1', 'code': '0x6000 \n', 'bytecode': ''}) == StreamedContract('0x1', '0x6000')
+    assert record_to_contract({'name': 'dir/c', 'bytecode': '0x00', '_metadata': json.dumps(METADATA)}) == StreamedContract('dir_c', '0x00', METADATA)
+    assert record_to_contract({'address': '0x1'}) is None
+    assert record_to_contract({'bytecode': '0x00'}) is None
+
+
+def test_jsonl(tmp_path):
+    path = str(tmp_path / 'contracts.jsonl.gz')
+    with gzip.open(path, 'wt') as f:
+        f.write(json.dumps({'address': '0x1', 'bytecode': '0x6000', '_metadata': METADATA}) + '\n\n')
+        f.write(json.dumps({'address': '0x2'}) + '\n')
+        f.write(json.dumps({'contract_address': '0x3', 'runtime_bytecode': '0x00'}) + '\n')
+    assert is_corpus(path)
+    assert list(iter_corpus(path)) == [StreamedContract('0x1', '0x6000', METADATA), StreamedContract('0x3', '0x00')]
+
+
+def test_csv(tmp_path):
+    path = tmp_path / 'contracts.csv'
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['address', 'bytecode', '_metadata'])
+        writer.writerow(['0x1', '0x' + '60' * 100_000, json.dumps(METADATA)])
+        writer.writerow(['0x2', '0x00', ''])
+    assert list(iter_corpus(str(path))) == [StreamedContract('0x1', '0x' + '60' * 100_000, METADATA), StreamedContract('0x2', '0x00')]
+
+
+def test_tar(tmp_path):
+    path = str(tmp_path / 'contracts.tar.gz')
+    with tarfile.open(path, 'w:gz') as tar:
+        def add(name: str, content: str) -> None:
+            data = content.encode()
+            member = tarfile.TarInfo(name)
+            member.size = len(data)
+            tar.addfile(member, io.BytesIO(data))
+        # metadata before or after its contract
+        add('corpus/a_metadata.json', json.dumps(METADATA))
+        add('corpus/a.hex', '0x00\n')
+        add('corpus/README', 'not a contract')
+        add('corpus/b.hex', '0x01')
+        add('corpus/b_metadata.json', json.dumps(METADATA))
+        add('corpus/c.hex', '0x02')
+    assert list(iter_corpus(path)) == [
+        StreamedContract('a', '0x00', METADATA), StreamedContract('b', '0x01', METADATA), StreamedContract('c', '0x02')
+    ]
+
+
+def test_spool(tmp_path):
+    spool = ContractSpool(str(tmp_path))
+    contract = StreamedContract('0x1', '0x00', METADATA)
+    contract_filename = spool.materialize(contract)
+    assert contract_filename == spool.filename(contract)
+    with open(contract_filename) as f:
+        assert f.read() == '0x00'
+    with open(contract_filename[:-len('.hex')] + '_metadata.json') as f:
+        assert json.load(f) == METADATA
+
+    spool.release(contract_filename)
+    assert os.listdir(spool.spool_dir) == []
+
+    # contracts that weren't streamed are left alone
+    hex_file = tmp_path / 'c.hex'
+    hex_file.write_text('0x00')
+    assert spool.materialize(str(hex_file)) == str(hex_file)
+    spool.release(str(hex_file))
+    assert hex_file.exists()
+
+
+def test_discover_contracts(tmp_path):
+    contracts_dir = tmp_path / 'contracts'
+    contracts_dir.mkdir()
+    (contracts_dir / 'a.hex').write_text('0x00')
+    (contracts_dir / 'b.hex').write_text('0x00')
+    corpus = tmp_path / 'contracts.jsonl'
+    corpus.write_text(json.dumps({'address': '0x1', 'bytecode': '0x00'}) + '\n')
+
+    discovered = discover_contracts([str(tmp_path / 'c.hex'), str(contracts_dir), str(corpus)])
+    assert next(discovered) == str(tmp_path / 'c.hex')
+    # inputs are only scanned once reached, so files added meanwhile are found
+    (contracts_dir / 'd.hex').write_text('0x00')
+    rest = list(discovered)
+    assert sorted(rest[:3]) == [str(contracts_dir / name) for name in ('a.hex', 'b.hex', 'd.hex')]
+    assert rest[3:] == [StreamedContract('0x1', '0x00')]
+
+
+def test_contract_shard():
+    names = [f'0x{i:040x}.hex' for i in range(1000)]
+    shards = [contract_shard(name, 4) for name in names]
+    assert set(shards) == {0, 1, 2, 3}
+    assert all(shards.count(shard) > 150 for shard in range(4))
+    # the shard depends only on the contract's name, not where it is read from
+    assert all(contract_shard(join('/some/dir', name), 4) == shard for name, shard in zip(names, shards))
@@ -0,0 +1,61 @@
+import os
+import signal
+import sqlite3
+from multiprocessing import Process
+from os.path import join
+
+from src.ledger import CompletionLedger, LEDGER_FILE
+
+
+def test_record_and_lookup(tmp_path):
+    ledger = CompletionLedger(str(tmp_path))
+    assert ledger.lookup('/inputs/a.hex') == (False, None)
+
+    ledger.record([('a.hex', ['TAC_Def'], [], {'decomp_time': 1.0}), ('b.hex', [], ['TIMEOUT'], {})])
+    assert ledger.lookup('/inputs/a.hex') == (True, ['a.hex', ['TAC_Def'], [], {'decomp_time': 1.0}])
+    assert CompletionLedger(str(tmp_path)).lookup('b.hex') == (True, ['b.hex', [], ['TIMEOUT'], {}])
+
+    # a contract analyzed again replaces its earlier result
+    ledger.record([('b.hex', ['TAC_Def'], [], {})])
+    assert ledger.lookup('b.hex') == (True, ['b.hex', ['TAC_Def'], [], {}])
+
+
+def test_legacy_dirs_analyzed_again(tmp_path):
+    os.makedirs(tmp_path / 'a')
+    ledger = CompletionLedger(str(tmp_path))
+    assert ledger.legacy_entries == 1
+    assert ledger.lookup('a.hex') == (False, None)
+
+
+def test_legacy_dirs_adopted(tmp_path):
+    os.makedirs(tmp_path / 'a')
+    ledger = CompletionLedger(str(tmp_path), adopt_legacy=True)
+    assert ledger.legacy_entries == 1
+    assert ledger.lookup('a.hex') == (True, None)
+
+    # only directories predating the ledger are adopted
+    os.makedirs(tmp_path / 'b')
+    ledger = CompletionLedger(str(tmp_path), adopt_legacy=True)
+    assert ledger.legacy_entries == 0
+    assert ledger.lookup('b.hex') == (False, None)
+
+
+def killed_while_recording(ledger_file: str) -> None:
+    conn = sqlite3.connect(ledger_file)
+    conn.execute("INSERT INTO finished (name, status, result) VALUES ('a', 'OK', '[]')")
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def test_crash_while_recording(tmp_path):
+    ledger = CompletionLedger(str(tmp_path))
+    ledger.record([('b.hex', [], [], {})])
+
+    writer = Process(target=killed_while_recording, args=(join(tmp_path, LEDGER_FILE),))
+    writer.start()
+    writer.join()
+    assert writer.exitcode == -signal.SIGKILL
+
+    assert ledger.lookup('a.hex') == (False, None)
+    assert ledger.lookup('b.hex') == (True, ['b.hex', [], [], {}])
+    ledger.record([('a.hex', [], [], {})])
+    assert ledger.lookup('a.hex') == (True, ['a.hex', [], [], {}])
@@ -0,0 +1,49 @@
+import json
+import subprocess
+import sys
+from os.path import dirname, join
+
+from src.results import iter_results, write_results_file
+
+MERGE_RESULTS = join(dirname(dirname(__file__)), 'tooling', 'merge-results.py')
+
+
+def results(*rows: tuple[str, float]) -> list:
+    return [[name, [], [], {'decomp_time': time}] for name, time in rows]
+
+
+def test_merge_shards(tmp_path):
+    shards = [results(('a.hex', 1.0), ('b.hex', 1.0)), results(('c.hex', 1.0), ('d.hex', 1.0)), results(('e.hex', 10.0), ('b.hex', 2.0))]
+    shard_files = []
+    for i, shard in enumerate(shards):
+        shard_files.append(str(tmp_path / f'shard{i}.json'))
+        with open(shard_files[-1], 'w') as f:
+            json.dump(shard, f)
+    merged_file = str(tmp_path / 'merged.json')
+
+    merge = subprocess.run([sys.executable, MERGE_RESULTS, *shard_files, '-o', merged_file, '-n', '1'], capture_output=True, text=True)
+    assert merge.returncode == 0, merge.stderr
+
+    # the result of a contract found in more than one shard is the one of the last shard
+    merged = {name: analytics for name, _, _, analytics in iter_results(merged_file)}
+    assert merged == {'a.hex': {'decomp_time': 1.0}, 'b.hex': {'decomp_time': 2.0}, 'c.hex': {'decomp_time': 1.0},
+                      'd.hex': {'decomp_time': 1.0}, 'e.hex': {'decomp_time': 10.0}}
+    assert 'b.hex is in more than one results file' in merge.stderr
+
+    shard_lines = [line for line in merge.stderr.splitlines() if line.strip().startswith(str(tmp_path))]
+    assert len(shard_lines) == 3
+    assert '(straggler)' in shard_lines[2] and not any('(straggler)' in line for line in shard_lines[:2])
+    # the slowest contract of each shard is listed
+    assert 'e.hex: 10.0 secs' in merge.stderr and 'b.hex: 2.0 secs' not in merge.stderr
+
+
+def test_merge_columnar(tmp_path):
+    shard_files = [str(tmp_path / 'shard0.json'), str(tmp_path / 'shard1.json')]
+    with open(shard_files[0], 'w') as f:
+        json.dump(results(('a.hex', 1.0)), f)
+    write_results_file(results(('b.hex', 2.0)), shard_files[1], 'columnar')
+    merged_file = str(tmp_path / 'merged')
+
+    merge = subprocess.run([sys.executable, MERGE_RESULTS, *shard_files, '-o', merged_file, '--format', 'columnar'], capture_output=True, text=True)
+    assert merge.returncode == 0, merge.stderr
+    assert list(iter_results(merged_file)) == results(('a.hex', 1.0), ('b.hex', 2.0))
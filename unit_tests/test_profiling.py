@@ -0,0 +1,72 @@
+import json
+import os
+
+from src.profiling import ProfileReport, RelationProfile, RuleProfile, collect_profiles, contract_profiles, parse_profile
+
+# the shape of a souffle profile log, with times in microseconds
+PROFILE = {'root': {'program': {'relation': {
+    'Edge': {
+        'num-tuples': 10,
+        'runtime': {'start': 0, 'end': 2_000_000},
+        'non-recursive-rule': {'Edge(x,y) :- In(x,y).': {'num-tuples': 10, 'runtime': {'start': 0, 'end': 2_000_000}}},
+    },
+    'Path': {
+        'iteration': [
+            {'num-tuples': 5, 'recursive-rule': {'Path(x,z) :- Path(x,y), Edge(y,z).': {
+                '0': {'num-tuples': 5, 'runtime': {'start': 0, 'end': 1_000_000}},
+                '1': {'num-tuples': 2, 'runtime': {'start': 0, 'end': 500_000}},
+            }}},
+            {'num-tuples': 3, 'recursive-rule': {'Path(x,z) :- Path(x,y), Edge(y,z).': {'num-tuples': 0, 'runtime': 500_000}}},
+        ],
+        'non-recursive-rule': {'Path(x,y) :- Edge(x,y).': {'num-tuples': 10, 'runtime': {'start': 0, 'end': 1_000_000}}},
+    },
+}}}}
+
+RECURSIVE_RULE = 'Path(x,z) :- Path(x,y), Edge(y,z).'
+
+
+def test_parse_profile():
+    profile = parse_profile(PROFILE, 'client.dl')
+    assert profile.relations['Edge'] == RelationProfile(tuples=10, runtime=2.0, iterations=0)
+    # without a runtime of its own, a relation's runtime is that of its rules, and its tuples those of its first iteration
+    assert profile.relations['Path'] == RelationProfile(tuples=5, runtime=3.0, iterations=2)
+    # the versions of recursive rules are summed, over all iterations
+    assert profile.rules[('Path', RECURSIVE_RULE)] == RuleProfile(tuples=7, runtime=2.0)
+    assert profile.rules[('Path', 'Path(x,y) :- Edge(x,y).')] == RuleProfile(tuples=10, runtime=1.0)
+
+
+def write_profile(out_dir, name: str, profile) -> None:
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, name), 'w') as f:
+        f.write(profile if isinstance(profile, str) else json.dumps(profile))
+
+
+def test_collect_profiles(tmp_path):
+    slow = json.loads(json.dumps(PROFILE))
+    slow['root']['program']['relation']['Edge']['runtime'] = {'start': 0, 'end': 5_000_000}
+    write_profile(tmp_path / 'a' / 'out', 'client.dl.prof', PROFILE)
+    write_profile(tmp_path / 'b' / 'out', 'client.dl.prof', slow)
+    # a truncated profile, e.g. of a killed client, is skipped
+    write_profile(tmp_path / 'b' / 'out', 'other.dl.prof', '{"root": ')
+    write_profile(tmp_path / '.spool', 'client.dl.prof', PROFILE)
+
+    assert [p.program for p in contract_profiles(str(tmp_path / 'b' / 'out'))] == ['client.dl']
+
+    report = collect_profiles(str(tmp_path))
+    assert report.contracts == 2
+    edge = report.relations[('client.dl', 'Edge')]
+    assert (edge.contracts, edge.runtime, edge.max_runtime, edge.worst_contract, edge.tuples, edge.max_tuples) == (2, 7.0, 5.0, 'b', 20, 10)
+    assert report.rules[('client.dl', 'Path', RECURSIVE_RULE)].runtime == 4.0
+
+
+def test_report_log(caplog):
+    report = ProfileReport()
+    report.add('a', [parse_profile(PROFILE, 'client.dl')])
+    with caplog.at_level(0):
+        report.log(top=1)
+    messages = [record.getMessage().strip() for record in caplog.records]
+    # only the top relation of each ranking is listed
+    runtime_ranking = messages.index('Relations by total runtime:')
+    assert messages[runtime_ranking + 1].startswith('3.00s  client.dl: Path')
+    assert messages[runtime_ranking + 2] == 'Relations by largest size:'
+    assert messages[runtime_ranking + 3].startswith('10  client.dl: Edge')
@@ -0,0 +1,62 @@
+import gzip
+import json
+
+import pytest
+
+import src.results as results
+from src.results import iter_results, percentile, summarize, write_results_file
+
+RESULTS = [
+    ['a.hex', ['Vuln'], [], {'decomp_time': 1.5, 'client_timeouts': 0, 'Vuln:flagged': 1}],
+    ['b.hex', [], ['TIMEOUT'], {'decomp_time': 2.0, 'client_timeouts': 2}],
+    ['c.hex', [], ['TIMEOUT', 'ERROR'], {'client_timeouts': 1, 'Vuln:flagged': 1}],
+]
+
+
+def test_summarize():
+    summary = summarize(RESULTS)
+    assert summary.total == 3
+    # only int analytics are summed
+    assert dict(summary.analytics_sums) == {'client_timeouts': 3, 'Vuln:flagged': 2}
+    assert dict(summary.vulnerability_counts) == {'Vuln:flagged': 2}
+    assert dict(summary.meta_counts) == {'TIMEOUT': 2, 'ERROR': 1}
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert [percentile(values, p) for p in (0, 50, 90, 99, 100)] == [1, 50, 90, 99, 100]
+    assert [percentile([7], p) for p in (0, 50, 100)] == [7, 7, 7]
+    assert [percentile([1, 2, 3, 4], p) for p in (25, 50, 75, 100)] == [1, 2, 3, 4]
+
+
+@pytest.mark.parametrize('results_format', ['json', 'columnar'])
+def test_results_round_trip(tmp_path, monkeypatch, results_format):
+    monkeypatch.setattr(results, 'COLUMNAR_CHUNK_ROWS', 2)
+    res_list = RESULTS + [['d.hex', [], [], {}], ['e.hex', ['Vuln', 'Other'], ['ERROR'], {'decomp_time': 0.5, 'resource_usage': {'stages': {}}}]]
+    results_file = str(tmp_path / 'results')
+    write_results_file(res_list, results_file, results_format)
+
+    assert list(iter_results(results_file)) == res_list
+    assert list(iter_results(results_file, {'decomp_time'})) == [
+        [name, files, meta, {k: v for k, v in analytics.items() if k == 'decomp_time'}] for name, files, meta, analytics in res_list
+    ]
+
+
+def test_columnar_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(results, 'COLUMNAR_CHUNK_ROWS', 2)
+    results_file = str(tmp_path / 'results')
+    write_results_file(RESULTS, results_file, 'columnar')
+    with gzip.open(results_file, 'rt') as f:
+        header, *chunks = [json.loads(line) for line in f]
+    assert header == {'format': 'gigahorse-columnar', 'version': 1}
+    assert [len(chunk['names']) for chunk in chunks] == [2, 1]
+    # strings are only introduced once, by the first chunk using them
+    assert 'decomp_time' in chunks[0]['strings'] and 'decomp_time' not in chunks[1]['strings']
+
+
+def test_unsupported_columnar_version(tmp_path):
+    results_file = str(tmp_path / 'results')
+    with gzip.open(results_file, 'wt') as f:
+        f.write(json.dumps({'format': 'gigahorse-columnar', 'version': 2}) + '\n')
+    with pytest.raises(ValueError):
+        list(iter_results(results_file))
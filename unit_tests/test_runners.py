@@ -0,0 +1,231 @@
+import json
+import os
+import signal
+import stat
+import sys
+import time
+from os.path import join
+
+from src.runners import (AnalysisExecutor, CLIENT_MANIFEST_FILE, FACT_GEN_LOW_PRIORITY, CustomFactGenerator, FactGenUsedEnum, MixedFactGenerator,
+                         ProcessUsage, decompiler_programs_run, get_souffle_executable_path, get_souffle_io_path, run_process)
+
+
+def fake_client(cache_dir: str, client: str, inputs: tuple[str, ...] = ('In.facts',), outputs: tuple[str, ...] = ('Out.csv',), delay: float = 0) -> None:
+    """
+    A compiled client copying its first input to each of its outputs, logging the arguments of every run to runs.log
+    and printing a relation size
+    """
+    executable = get_souffle_executable_path(cache_dir, client)
+    with open(executable, 'w') as f:
+        f.write('#!/bin/sh\n'
+                'facts=${1#--facts=}; output=${2#--output=}\n'
+                f'sleep {delay}\n'
+                + ''.join(f'cp "$facts/{inputs[0]}" "$output/{output}"\n' for output in outputs) +
+                'echo "$@" >> "$output/runs.log"\n'
+                'echo "Out 1"\n')
+    os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+    with open(get_souffle_io_path(cache_dir, client), 'w') as f:
+        json.dump({'binary_hash': 'fake', 'inputs': list(inputs), 'outputs': list(outputs)}, f)
+
+
+def client_runs(out_dir: str) -> int:
+    return len(client_run_args(out_dir))
+
+
+def client_run_args(out_dir: str) -> list[list[str]]:
+    with open(join(out_dir, 'runs.log')) as f:
+        return [line.split() for line in f]
+
+
+def test_unchanged_clients_reused(tmp_path):
+    cache_dir, work_dir = str(tmp_path / 'cache'), str(tmp_path / 'work')
+    os.makedirs(cache_dir)
+    os.makedirs(work_dir)
+    fake_client(cache_dir, 'client.dl')
+    manifest_file = join(work_dir, CLIENT_MANIFEST_FILE)
+    with open(join(work_dir, 'In.facts'), 'w') as f:
+        f.write('1\n')
+
+    executor = AnalysisExecutor(60, False, 10, False, 'souffle', cache_dir, '')
+    executor.reuse_client_outputs = True
+
+    def run() -> None:
+        executor.reset_statistics()
+        assert executor.run_souffle_client('client.dl', work_dir, work_dir, 0, False, manifest_file) == ([], [])
+
+    run()
+    assert client_runs(work_dir) == 1
+
+    run()
+    assert client_runs(work_dir) == 1
+    assert executor.reused_clients == ['client.dl']
+
+    with open(join(work_dir, 'In.facts'), 'w') as f:
+        f.write('2\n')
+    run()
+    assert client_runs(work_dir) == 2
+    assert executor.reused_clients == []
+
+
+def test_no_fingerprints_without_reuse(tmp_path):
+    cache_dir, work_dir = str(tmp_path / 'cache'), str(tmp_path / 'work')
+    os.makedirs(cache_dir)
+    os.makedirs(work_dir)
+    fake_client(cache_dir, 'client.dl')
+    manifest_file = join(work_dir, CLIENT_MANIFEST_FILE)
+    with open(join(work_dir, 'In.facts'), 'w') as f:
+        f.write('1\n')
+
+    executor = AnalysisExecutor(60, False, 10, False, 'souffle', cache_dir, '')
+    executor.run_souffle_client('client.dl', work_dir, work_dir, 0, False, manifest_file)
+    executor.run_souffle_client('client.dl', work_dir, work_dir, 0, False, manifest_file)
+
+    assert client_runs(work_dir) == 2
+    assert not os.path.exists(manifest_file)
+
+
+def test_souffle_threads(tmp_path):
+    cache_dir, work_dir = str(tmp_path / 'cache'), str(tmp_path / 'work')
+    os.makedirs(cache_dir)
+    os.makedirs(work_dir)
+    fake_client(cache_dir, 'client.dl')
+    with open(join(work_dir, 'In.facts'), 'w') as f:
+        f.write('1\n')
+
+    executor = AnalysisExecutor(60, False, 10, False, 'souffle', cache_dir, '')
+    executor.run_souffle_client('client.dl', work_dir, work_dir, 0, False)
+    executor.souffle_threads = 4
+    executor.run_souffle_client('client.dl', work_dir, work_dir, 0, False)
+
+    single, multi = client_run_args(work_dir)
+    assert not any(arg.startswith('--jobs') for arg in single)
+    assert '--jobs=4' in multi
+
+
+def test_client_dependencies(tmp_path):
+    cache_dir = str(tmp_path)
+    fake_client(cache_dir, 'a.dl', outputs=('A.csv',))
+    fake_client(cache_dir, 'b.dl', outputs=('B.csv',))
+    fake_client(cache_dir, 'c.dl', inputs=('A.csv',), outputs=('C.csv',))
+    fake_client(cache_dir, 'd.dl', outputs=('B.csv',))
+
+    executor = AnalysisExecutor(60, False, 10, False, 'souffle', cache_dir, '')
+    # c reads what a writes, d writes what b writes, clients without a known I/O (scripts) wait for all others
+    assert executor.client_dependencies(['a.dl', 'b.dl', 'c.dl', 'd.dl'], ['script.py'], 'work', 'work') == [
+        set(), set(), {0}, {1}, {0, 1, 2, 3}
+    ]
+    # with separate input and output directories, c reads an older A.csv than the one a writes
+    assert executor.client_dependencies(['a.dl', 'c.dl'], [], 'in', 'out') == [set(), set()]
+
+
+def test_concurrent_clients(tmp_path):
+    cache_dir, work_dir = str(tmp_path / 'cache'), str(tmp_path / 'work')
+    os.makedirs(cache_dir)
+    os.makedirs(work_dir)
+    fake_client(cache_dir, 'a.dl', outputs=('A.csv',), delay=1)
+    fake_client(cache_dir, 'b.dl', outputs=('B.csv',), delay=1)
+    fake_client(cache_dir, 'c.dl', inputs=('A.csv',), outputs=('C.csv',))
+    with open(join(work_dir, 'In.facts'), 'w') as f:
+        f.write('1\n')
+
+    executor = AnalysisExecutor(60, False, 10, False, 'souffle', cache_dir, '')
+    executor.client_jobs = 3
+    start = time.time()
+    assert executor.run_clients(['a.dl', 'b.dl', 'c.dl'], [], work_dir, work_dir, start) == ([], [])
+    assert time.time() - start < 1.8
+    # c only ran once a had written its input
+    with open(join(work_dir, 'C.csv')) as f:
+        assert f.read() == '1\n'
+    assert client_runs(work_dir) == 3
+
+
+def test_run_process_usage():
+    usage = run_process([sys.executable, '-c', 'b = bytearray(200_000_000); b[::4096] = b"x" * len(b[::4096])'], 60)
+    assert usage.signal == 0 and not usage.timed_out
+    assert usage.max_rss >= 200_000_000
+    assert usage.user_time + usage.sys_time > 0
+    assert usage.wall_time > 0
+
+
+def test_run_process_killed():
+    usage = run_process(['sleep', '10'], 0.2)
+    assert usage.timed_out and usage.signal == signal.SIGKILL
+    assert usage.wall_time < 5
+
+    usage = run_process(['sleep', '10'], 60, monitor=lambda pid, elapsed: 'too slow')
+    assert usage.aborted == 'too slow' and not usage.timed_out and usage.signal == signal.SIGKILL
+
+    usage = run_process(['sh', '-c', 'kill -9 $$'], 60)
+    assert usage.signal == signal.SIGKILL and not usage.timed_out and usage.aborted is None
+
+
+def test_resource_analytics(tmp_path):
+    executor = AnalysisExecutor(60, False, 10, False, 'souffle', str(tmp_path), '')
+    executor.reset_statistics()
+    executor.stage = 'decompiler'
+    executor.record_usage('main.dl', ProcessUsage(1.0, 100, 1.0, 0.5, 10, 20))
+    executor.stage = 'client'
+    executor.record_usage('a.dl', ProcessUsage(1.0, 300, 2.0, 0.5, 0, 40, signal=signal.SIGKILL))
+    executor.record_usage('b.dl', ProcessUsage(1.0, 200, 3.0, 0.5, 0, 0, signal=signal.SIGKILL, timed_out=True))
+
+    analytics = executor.resource_analytics()
+    assert analytics['stages']['client'] == {
+        'processes': 2, 'max_rss': 300, 'user_time': 5.0, 'sys_time': 1.0, 'read_bytes': 0, 'write_bytes': 40, 'signals': [signal.SIGKILL]
+    }
+    assert analytics['clients']['main.dl']['max_rss'] == 100
+    # only the client killed by someone else than its timeout counts as killed
+    assert executor.killed_clients() == ['a.dl']
+    assert executor.last_usage('b.dl') is not None and executor.last_usage('b.dl').timed_out
+
+
+def test_priority_rounds_streamed():
+    generator = MixedFactGenerator(None)
+    high, low = CustomFactGenerator(r'.*\.hex', []), CustomFactGenerator(r'.*\.bin', [])
+    low.priority = FACT_GEN_LOW_PRIORITY
+    generator.fact_generators = {high.pattern: high, low.pattern: low}
+
+    consumed = []
+
+    def inputs():
+        for contract_filename in ['a.bin', 'b.hex', 'c.bin', 'd.hex']:
+            consumed.append(contract_filename)
+            yield contract_filename
+
+    rounds = generator.partition_inputs_by_priority(inputs())
+    first_round = iter(next(rounds))
+    assert consumed == []
+    assert next(first_round) == 'b.hex'
+    assert consumed == ['a.bin', 'b.hex']
+    assert list(first_round) == ['d.hex']
+    assert [list(r) for r in rounds] == [['a.bin', 'c.bin']]
+
+
+def test_relation_sizes_file(tmp_path):
+    cache_dir, work_dir = str(tmp_path / 'cache'), str(tmp_path / 'work')
+    os.makedirs(cache_dir)
+    os.makedirs(work_dir)
+    fake_client(cache_dir, 'main.dl')
+    with open(join(work_dir, 'In.facts'), 'w') as f:
+        f.write('1\n')
+    sizes_file = join(work_dir, 'main.dl.sizes')
+
+    # clients don't print sizes
+    AnalysisExecutor(60, False, 10, False, 'souffle', cache_dir, 'BULK_ANALYSIS=').run_souffle_client('main.dl', work_dir, work_dir, 0, False)
+    assert not os.path.exists(sizes_file)
+
+    executor = AnalysisExecutor(60, False, 10, False, 'souffle', cache_dir, 'BULK_ANALYSIS= NO_TELEMETRY=')
+    assert not executor.telemetry
+    executor.run_souffle_client('main.dl', work_dir, work_dir, 0, False, print_sizes=True)
+    assert not os.path.exists(sizes_file)
+
+    executor = AnalysisExecutor(60, False, 10, False, 'souffle', cache_dir, 'BULK_ANALYSIS=')
+    executor.run_souffle_client('main.dl', work_dir, work_dir, 0, False, print_sizes=True)
+    with open(sizes_file) as f:
+        assert f.read() == 'Out 1\n'
+
+
+def test_decompiler_programs_run():
+    assert decompiler_programs_run(FactGenUsedEnum.DefaultDecomp) == ['main.dl']
+    assert decompiler_programs_run(FactGenUsedEnum.LastResortDecomp) == ['main.dl', 'fallback_scalable.dl', 'last_resort.dl']
+    assert decompiler_programs_run(None) == ['main.dl', 'fallback_scalable.dl', 'last_resort.dl']
+    assert decompiler_programs_run(FactGenUsedEnum.Custom) == []
@@ -0,0 +1,121 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import src.scheduling as scheduling
+from src.runners import DEFAULT_MEMORY_LIMIT
+from src.scheduling import (Lookahead, MemoryAdmissionController, MemoryHistory, HISTORY_MARGIN, MIN_MEMORY_ESTIMATE, MIN_OBSERVATIONS,
+                            load_memory_history, souffle_threads_for_job)
+
+GB = 1_000_000_000
+
+
+def resource_usage(*peaks: int) -> dict:
+    return {'stages': {f'stage{i}': {'max_rss': peak} for i, peak in enumerate(peaks)}}
+
+
+def hex_file(tmp_path, name: str, bytecode_size: int) -> str:
+    path = tmp_path / name
+    path.write_text('00' * bytecode_size)
+    return str(path)
+
+
+def test_load_memory_history(tmp_path):
+    results_file = tmp_path / 'results.json'
+    results_file.write_text(json.dumps([
+        ['a.hex', [], [], {'resource_usage': resource_usage(100, 300), 'bytecode_size': 10, 'decomp_time': 1.0}],
+        ['b.hex', [], [], {'resource_usage': resource_usage(50)}],
+        ['c.hex', [], ['TIMEOUT'], {}],
+    ]))
+    history = load_memory_history(str(results_file))
+    assert history.peaks == {'a.hex': 300, 'b.hex': 50}
+    assert history.ratios == [30.0]
+
+
+def test_estimate_from_history(tmp_path):
+    controller = MemoryAdmissionController(0, MemoryHistory(peaks={'a.hex': 2 * GB}))
+    assert controller.estimate(hex_file(tmp_path, 'a.hex', 10)) == int(2 * GB * HISTORY_MARGIN)
+
+
+def test_cold_start_estimate(tmp_path):
+    contract = hex_file(tmp_path, 'a.hex', 10_000)
+    assert MemoryAdmissionController(0, memory_per_bytecode_byte=200_000).estimate(contract) == 2 * GB
+    # estimates are clamped between the minimum and the memory limit of a job
+    assert MemoryAdmissionController(0, memory_per_bytecode_byte=1).estimate(contract) == MIN_MEMORY_ESTIMATE
+    assert MemoryAdmissionController(0, memory_per_bytecode_byte=10**9).estimate(contract) == DEFAULT_MEMORY_LIMIT
+
+
+def test_learned_estimate(tmp_path):
+    contract = hex_file(tmp_path, 'a.hex', 10_000)
+    controller = MemoryAdmissionController(0, memory_per_bytecode_byte=200_000)
+    for _ in range(MIN_OBSERVATIONS - 1):
+        controller.observe({'resource_usage': resource_usage(50_000 * 1000), 'bytecode_size': 1000})
+    assert controller.estimate(contract) == 2 * GB
+
+    controller.observe({'resource_usage': resource_usage(50_000 * 1000), 'bytecode_size': 1000})
+    assert controller.estimate(contract) == 50_000 * 10_000
+
+    # the ratios of the memory history count as observations from the start
+    history = MemoryHistory(ratios=[100_000.0] * (MIN_OBSERVATIONS - 1) + [1_000_000.0])
+    assert MemoryAdmissionController(0, history).estimate(contract) == 100_000 * 10_000
+
+
+@pytest.fixture
+def memory(monkeypatch):
+    """Available memory and running jobs' RSS, as set by the test"""
+    state = SimpleNamespace(available=0, rss={})
+    monkeypatch.setattr(scheduling, 'available_memory', lambda: state.available)
+    monkeypatch.setattr(scheduling, 'process_tree_rss', lambda pid: state.rss[pid])
+    return state
+
+
+def worker(pid: int, memory_estimate: int) -> dict:
+    return {'proc': SimpleNamespace(pid=pid), 'memory_estimate': memory_estimate}
+
+
+def test_admission(memory):
+    controller = MemoryAdmissionController(2 * GB)
+    memory.available = 5 * GB
+    memory.rss = {1: 1 * GB}
+    running = [worker(1, 3 * GB)]
+
+    # 5 GB available, 2 GB reserved, 2 GB still expected to be claimed by the running job
+    assert controller.admit(1 * GB, running)
+    assert not controller.admit(1 * GB + 1, running)
+    assert not controller.admit(2 * GB, running)
+    assert controller.throttle_events == 1
+
+    # the running job claimed its memory, which is no longer available
+    memory.available = 3 * GB
+    memory.rss = {1: 3 * GB}
+    assert controller.admit(1 * GB, running)
+
+    # with nothing running, a job is always launched
+    memory.available = 0
+    assert controller.admit(10 * GB, [])
+    assert controller.throttle_events == 1
+
+
+def test_lookahead():
+    items = Lookahead(iter(range(5)), 3)
+    assert items.depth() == 3
+    assert next(items) == 0
+    assert list(items) == [1, 2, 3, 4]
+    assert items.depth() == 0
+
+    items = Lookahead(iter(range(2)), 3)
+    assert items.depth() == 2
+    assert list(items) == [0, 1]
+
+
+@pytest.mark.parametrize('threads_in_use, free_job_slots, queue_depth, expected', [
+    (0, 16, 20, 1),   # deep queue: every job gets a single thread
+    (0, 8, 20, 2),    # fewer jobs than cores: the cores are split between them
+    (0, 8, 1, 8),     # last two contracts share all the cores
+    (0, 8, 0, 16),    # last contract gets all of them
+    (12, 1, 0, 4),    # only the idle cores are shared
+    (16, 1, 5, 1),    # even with none idle, a job gets a thread
+])
+def test_souffle_threads_for_job(threads_in_use, free_job_slots, queue_depth, expected):
+    assert souffle_threads_for_job(16, threads_in_use, free_job_slots, queue_depth) == expected
@@ -0,0 +1,113 @@
+import os
+
+from src.blockparse import EVMBytecodeParser
+from src.exporter import EVMBlockExporter
+import src.signatures as signatures
+from src.signatures import (SignatureIndex, build_signature_index, filter_signatures, load_signature_index, open_signature_indexes,
+                            selector_candidates)
+
+FUNCTIONS = ('a9059cbb\ttransfer(address,uint256)\n'
+             '095ea7b3\tapprove(address,uint256)\n'
+             'not a hash\tignored()\n'
+             '23b872dd\ttransferFrom(address,address,uint256)\n'
+             '095ea7b3\tsign_szabo_bytecode(bytes16,uint128)\n')
+
+EVENTS = ('ddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef\tTransfer(address,address,uint256)\n'
+          '8c5be1e5ebec7d5bd14f71427d1e84f3dd0314c0f7b2291e5b200ac8c7c3b925\tApproval(address,address,uint256)\n')
+
+
+def build_index(tmp_path, name: str, rows: str) -> SignatureIndex:
+    facts_file = tmp_path / name
+    facts_file.write_text(rows)
+    index_file = str(tmp_path / (name + '.idx'))
+    build_signature_index(str(facts_file), index_file)
+    return SignatureIndex(index_file)
+
+
+def test_selector_index(tmp_path):
+    index = build_index(tmp_path, 'functions.facts', FUNCTIONS)
+    assert index.key_width == 4 and index.count == 4
+    assert index.lookup(0xa9059cbb) == ['a9059cbb\ttransfer(address,uint256)']
+    assert index.lookup(0x095ea7b3) == ['095ea7b3\tapprove(address,uint256)', '095ea7b3\tsign_szabo_bytecode(bytes16,uint128)']
+    assert index.lookup(0x12345678) == []
+    assert index.lookup(2**40) == [] and index.lookup(-1) == []
+
+
+def test_topic_index(tmp_path):
+    index = build_index(tmp_path, 'events.facts', EVENTS)
+    assert index.key_width == 32
+    assert index.lookup(0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef) == [EVENTS.splitlines()[0]]
+    assert index.lookup(0xddf252ad) == []
+
+
+def test_stale_index(tmp_path):
+    index = build_index(tmp_path, 'functions.facts', FUNCTIONS)
+    facts_file = str(tmp_path / 'functions.facts')
+    assert not index.is_stale(facts_file)
+    with open(facts_file, 'a') as f:
+        f.write('70a08231\tbalanceOf(address)\n')
+    assert index.is_stale(facts_file)
+
+
+def test_selector_candidates():
+    # a selector, and a selector shifted to the top of a word, are candidates as they are
+    assert 0xa9059cbb in selector_candidates([0xa9059cbb])
+    assert 0xa9059cbb in selector_candidates([0xa9059cbb << 224])
+    # constants are compared on their first 8, 7 and 6 hex digits, zero-padded to 8
+    assert selector_candidates([0x1234]) == {0x1234, 0x123400, 0x1234000, 0x12340000}
+    assert selector_candidates([0xa9059cbb1]) == {0xa9059cbb, 0xa9059c, 0xa9059cb}
+    assert selector_candidates([]) == set()
+
+
+def test_filter_signatures(tmp_path):
+    index = build_index(tmp_path, 'functions.facts', FUNCTIONS)
+    rows = filter_signatures(index, selector_candidates([0x23b872dd, 0xa9059cbb << 224, 0x42]))
+    assert rows == ['23b872dd\ttransferFrom(address,address,uint256)', 'a9059cbb\ttransfer(address,uint256)']
+    index.close()
+    assert os.path.exists(tmp_path / 'functions.facts.idx')
+
+
+def test_export_filtered_signatures(tmp_path):
+    index = build_index(tmp_path, 'functions.facts', FUNCTIONS)
+    # PUSH4 0xa9059cbb, STOP
+    blocks = EVMBytecodeParser('0x63a9059cbb00').parse()
+    out_dir = tmp_path / 'facts'
+    EVMBlockExporter(str(out_dir), blocks, bytecode_hex='0x63a9059cbb00',
+                     signature_indexes={'PublicFunctionSignature.facts': index, 'EventSignature.facts': None}).export()
+
+    assert (out_dir / 'PublicFunctionSignature.facts').read_text() == 'a9059cbb\ttransfer(address,uint256)\n'
+    assert (out_dir / 'EventSignature.facts').read_text() == ''
+    assert not (out_dir / 'PublicFunctionSignature.facts').is_symlink()
+
+
+def test_resolve(tmp_path):
+    index = build_index(tmp_path, 'functions.facts', FUNCTIONS)
+    assert index.resolve(0xa9059cbb) == ['transfer(address,uint256)']
+    assert index.resolve(0x095ea7b3) == ['approve(address,uint256)', 'sign_szabo_bytecode(bytes16,uint128)']
+    assert index.resolve_many([0x23b872dd, 0xa9059cbb, 0x12345678, 0xa9059cbb, 2**40]) == {
+        0x23b872dd: ['transferFrom(address,address,uint256)'],
+        0xa9059cbb: ['transfer(address,uint256)'],
+    }
+
+
+def test_load_signature_index(tmp_path, monkeypatch):
+    facts_file = tmp_path / 'functions.facts'
+    facts_file.write_text(FUNCTIONS)
+    monkeypatch.setitem(signatures.SIGNATURE_FILES, 'PublicFunctionSignature.facts', str(facts_file))
+    monkeypatch.setitem(signatures.SIGNATURE_FILES, 'EventSignature.facts', str(tmp_path / 'missing.facts'))
+    index_dir = str(tmp_path / 'indexes')
+
+    assert load_signature_index('event', index_dir) is None
+    index = load_signature_index('function', index_dir)
+    assert index is not None and index.resolve(0x70a08231) == []
+
+    # an index is rebuilt once its signature file changes
+    with open(facts_file, 'a') as f:
+        f.write('70a08231\tbalanceOf(address)\n')
+    index = load_signature_index('function', index_dir)
+    assert index is not None and index.resolve(0x70a08231) == ['balanceOf(address)']
+
+    indexes = open_signature_indexes(index_dir)
+    assert indexes['EventSignature.facts'] is None
+    function_index = indexes['PublicFunctionSignature.facts']
+    assert function_index is not None and function_index.count == 5
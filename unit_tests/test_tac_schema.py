@@ -0,0 +1,80 @@
+from itertools import permutations
+from pathlib import Path
+
+import pytest
+
+from src.tac_schema import ALL_RELATIONS, StitchMap, StitchMember, TACRelations, function_contract, stitch_dirs
+
+
+def write_facts(out_dir: Path, name: str) -> None:
+    """A contract output with a few rows in every relation, some empty and some missing their last newline"""
+    out_dir.mkdir(parents=True)
+    for i, rel in enumerate(sorted(ALL_RELATIONS, key=lambda r: r.name)):
+        rows = [] if i % 7 == 0 and rel != function_contract else ["\t".join(f"0x{name}{row}_{col}" for col in range(len(rel.columns))) for row in range(3)]
+        (out_dir / f"{rel.name}.csv").write_text("\n".join(rows) + ("" if i % 5 == 0 else "\n" * bool(rows)))
+
+
+def test_stitch_map_original():
+    stitch_map = StitchMap.numbered(['0xaaa', '0xbbb'])
+    assert stitch_map.prefix_of('0xaaa') == '1_'
+    assert stitch_map.prefix_of('0xbbb') == '2_'
+
+    for contract in ['0xaaa', '0xbbb']:
+        for identifier in ['0x12', '0x12_3', '0x4B0x12']:
+            assert stitch_map.original(stitch_map.prefix_of(contract) + identifier) == (contract, identifier)
+
+    # identifiers of the main contract, or with a prefix not in the map, are left as they are
+    assert stitch_map.original('0x12') == (None, '0x12')
+    assert stitch_map.original('3_0x12') == (None, '3_0x12')
+
+
+def test_stitch_prefixes_unique():
+    stitch_map = StitchMap.numbered([f'0x{i:040x}' for i in range(120)])
+    assert len(set(stitch_map.prefixes)) == 120
+
+    for prefix, other in permutations(stitch_map.prefixes, 2):
+        assert not (other + '0x12').startswith(prefix)
+        assert stitch_map.original(other + '0x12') == (stitch_map.prefixes[other], '0x12')
+
+
+def test_stitch_map_from_dir(tmp_path):
+    assert StitchMap.from_dir(tmp_path).prefixes == {}
+
+    stitch_map = StitchMap.numbered(['0xaaa', '0xbbb'])
+    stitch_map.write(tmp_path)
+    assert StitchMap.from_dir(tmp_path).prefixes == stitch_map.prefixes
+    assert StitchMap.from_dir(tmp_path).original('2_0x12') == ('0xbbb', '0x12')
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_stitch_dirs_matches_merge(tmp_path, jobs):
+    """Streaming stitching writes the same rows as rewriting and merging the relations in memory"""
+    for name in ['a', 'b', 'c']:
+        write_facts(tmp_path / name, name)
+    stitch_map = StitchMap.numbered(['0xbbb', '0xccc'])
+
+    facts = [TACRelations.from_dir(tmp_path / name) for name in ['a', 'b', 'c']]
+    for tac, contract in zip(facts[1:], ['0xbbb', '0xccc']):
+        tac.prefix_identifiers(stitch_map.prefix_of(contract))
+        tac.set_contract(contract)
+    TACRelations.merge(*facts).write_dir(tmp_path / 'merged')
+
+    members = [StitchMember(str(tmp_path / 'a'))]
+    members += [StitchMember(str(tmp_path / name), stitch_map.prefix_of(contract), contract) for name, contract in [('b', '0xbbb'), ('c', '0xccc')]]
+    stitch_dirs(members, tmp_path / 'stitched', jobs)
+
+    merged = TACRelations.from_dir(tmp_path / 'merged')
+    stitched = TACRelations.from_dir(tmp_path / 'stitched')
+    for rel in ALL_RELATIONS:
+        assert stitched[rel] == merged[rel], rel.name
+    assert ('2_0xc0_0', '0xccc') in stitched[function_contract]
+
+
+def test_stitch_dirs_missing_relation(tmp_path):
+    write_facts(tmp_path / 'a', 'a')
+    write_facts(tmp_path / 'b', 'b')
+    (tmp_path / 'b' / f"{function_contract.name}.csv").unlink()
+
+    with pytest.raises(FileNotFoundError):
+        stitch_dirs([StitchMember(str(tmp_path / 'a')), StitchMember(str(tmp_path / 'b'), '1_', '0xbbb')], tmp_path / 'stitched')
+    assert not (tmp_path / 'stitched').exists()
@@ -0,0 +1,87 @@
+import socket
+import subprocess
+import time
+
+from src.work_queue import WorkQueue
+
+
+def dead_owner() -> str:
+    proc = subprocess.Popen(['true'])
+    proc.wait()
+    return f"{socket.gethostname()}:{proc.pid}"
+
+
+def test_priority_barrier(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.db'))
+    queue.enqueue([('a', 1), ('b', 1), ('stitched', 2)])
+
+    claims = queue.claims()
+    assert next(claims) == 'a'
+    assert next(claims) == 'b'
+    # not while a contract of a lower priority is still claimed
+    assert next(claims) is None
+    assert queue.claimable(10) == 0
+
+    queue.ack('a')
+    queue.ack('b', done=False)
+    assert next(claims) == 'b'
+    queue.ack('b')
+    assert next(claims) == 'stitched'
+    queue.ack('stitched')
+    assert list(claims) == []
+    assert queue.counts() == {'done': 3}
+
+
+def test_feed_added_in_chunks(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.db'))
+    consumed = []
+
+    def feed():
+        for i in range(10):
+            consumed.append(i)
+            yield f'c{i}', 1
+
+    claims = queue.claims(feed(), chunk_size=3)
+    for i in range(10):
+        assert next(claims) == f'c{i}'
+        # only the chunks needed so far were taken from the feed
+        assert len(consumed) <= (i // 3 + 2) * 3
+        queue.ack(f'c{i}')
+    assert list(claims) == []
+    assert queue.added == 10
+
+
+def test_abandoned_claims(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.db'), lease=0.1)
+    queue.enqueue([('a', 1), ('b', 1)])
+
+    killed = WorkQueue(str(tmp_path / 'queue.db'), lease=0.1)
+    killed.owner = dead_owner()
+    assert killed.claim() == 'a'
+    # still running, but its lease expired (e.g. it was suspended)
+    live = WorkQueue(str(tmp_path / 'queue.db'), lease=0.1)
+    live.owner = f"{socket.gethostname()}:1"
+    assert live.claim() == 'b'
+
+    time.sleep(0.2)
+    claims = queue.claims()
+    assert next(claims) == 'a'
+    assert queue.owns('a')
+    assert next(claims) is None
+    assert not queue.owns('b')
+
+    queue.ack('a')
+    assert live.ack('b')
+    assert list(claims) == []
+
+
+def test_killed_jobs_fail_after_max_attempts(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.db'))
+    queue.enqueue([('a', 1)])
+    for _ in range(2):
+        assert queue.claim() == 'a'
+        assert not queue.ack('a', done=False)
+    assert queue.claim() == 'a'
+    assert queue.ack('a', done=False)
+    assert queue.counts() == {'failed': 1}
+    assert queue.claim() is None